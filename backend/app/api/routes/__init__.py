@@ -1,11 +1,13 @@
 from fastapi import APIRouter
 
-from app.api.routes import auth, health, items, routes
+from app.api.routes import admin, auth, detections, health, items, routes
 
 api_router = APIRouter()
 api_router.include_router(health.router, tags=["health"])
 api_router.include_router(auth.router)
 api_router.include_router(items.router, prefix="/items", tags=["items"])
 api_router.include_router(routes.router, prefix="/routes", tags=["routes"])
+api_router.include_router(detections.router, prefix="/detections", tags=["detections"])
+api_router.include_router(admin.router, prefix="/admin", tags=["admin"])
 
 
@@ -0,0 +1,53 @@
+import secrets
+
+from fastapi import APIRouter, Depends, Header, HTTPException, status
+
+from app.core.config import settings
+from app.schemas.admin import ModelActivation
+from app.services.model_loader import activate_model, list_models, model_status, schedule_model_reload
+
+router = APIRouter()
+
+
+async def require_admin(x_admin_token: str | None = Header(None)) -> None:
+    """Доступ по токену администрирования (settings.admin_token); без настроенного токена — закрыто"""
+    if not settings.admin_token:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Администрирование выключено: не задан admin_token",
+        )
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, settings.admin_token):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Неверный токен администрирования",
+        )
+
+
+@router.get("/models", dependencies=[Depends(require_admin)])
+async def get_models() -> dict:
+    """Версии модели в директории моделей и состояние загруженной версии в этом воркере"""
+    return {"models": list_models(), "status": model_status()}
+
+
+@router.post("/models/activate", status_code=status.HTTP_202_ACCEPTED, dependencies=[Depends(require_admin)])
+async def activate_model_version(body: ModelActivation) -> dict:
+    """
+    Сделать версию модели активной
+
+    Версия загружается и прогревается в фоне, затем подменяет текущую; начатые загрузки
+    дорабатывают на прежней версии. Остальные воркеры подхватывают выбор при очередной
+    проверке (models_watch_interval). Результат — в GET /admin/models.
+    """
+    try:
+        activate_model(body.name)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    schedule_model_reload()
+    return {"status": "loading", "name": body.name}
+
+
+@router.post("/models/reload", status_code=status.HTTP_202_ACCEPTED, dependencies=[Depends(require_admin)])
+async def reload_active_model() -> dict:
+    """Загрузить активную версию заново, например после замены файла модели"""
+    schedule_model_reload()
+    return {"status": "loading"}
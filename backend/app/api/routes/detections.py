@@ -0,0 +1,98 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import ORJSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.deps import get_current_user
+from app.crud.detection import search_detections
+from app.db.session import get_db
+from app.models.user import User
+from app.services.geo import bbox_for_radius, haversine_m, split_bbox
+from app.services.classes import CLASS_NAMES
+
+router = APIRouter()
+
+CLASS_IDS = {name: class_id for class_id, name in CLASS_NAMES.items()}
+
+
+@router.get("/search", response_class=ORJSONResponse)
+async def search_detections_endpoint(
+    min_lat: float | None = Query(None, ge=-90, le=90),
+    min_lon: float | None = Query(None, ge=-180, le=180),
+    max_lat: float | None = Query(None, ge=-90, le=90),
+    max_lon: float | None = Query(None, ge=-180, le=180),
+    lat: float | None = Query(None, ge=-90, le=90, description="Центр круга поиска"),
+    lon: float | None = Query(None, ge=-180, le=180, description="Центр круга поиска"),
+    radius_m: float | None = Query(None, gt=0, le=500_000, description="Радиус поиска в метрах"),
+    class_name: list[str] | None = Query(None, description="Классы детекций, например damaged_insulator"),
+    route_id: str | None = None,
+    limit: int = Query(1000, ge=1, le=10000),
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_db),
+) -> ORJSONResponse:
+    """
+    Найти детекции по всем маршрутам пользователя внутри прямоугольника или круга
+
+    Прямоугольник с min_lon > max_lon пересекает меридиан ±180°: от min_lon на восток до max_lon.
+    """
+    circle = (lat, lon, radius_m)
+    bbox = (min_lat, min_lon, max_lat, max_lon)
+    if all(value is not None for value in circle):
+        boxes = bbox_for_radius(lat, lon, radius_m)
+    elif all(value is not None for value in bbox):
+        if min_lat > max_lat:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Минимальная широта должна быть не больше максимальной",
+            )
+        boxes = split_bbox(*bbox)
+        circle = None
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Укажите прямоугольник (min_lat, min_lon, max_lat, max_lon) или круг (lat, lon, radius_m)",
+        )
+
+    class_ids = None
+    if class_name:
+        unknown = [name for name in class_name if name not in CLASS_IDS]
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Неизвестные классы: {', '.join(unknown)}",
+            )
+        class_ids = [CLASS_IDS[name] for name in class_name]
+
+    rows = await search_detections(
+        session,
+        current_user.id,
+        boxes,
+        class_ids=class_ids,
+        route_id=route_id,
+        limit=limit,
+        circle=circle,
+    )
+
+    detections = []
+    for detection, route_file in rows:
+        distance_m = None
+        if circle is not None:
+            distance_m = haversine_m(lat, lon, detection.latitude, detection.longitude)
+        detections.append({
+            "id": detection.id,
+            "route_id": detection.route_id,
+            "file_id": detection.file_id,
+            "original": route_file.original_name,
+            "class_id": detection.class_id,
+            "class_name": CLASS_NAMES.get(detection.class_id, f"Class {detection.class_id}"),
+            "confidence": detection.confidence,
+            "bbox": [detection.x1, detection.y1, detection.x2, detection.y2],
+            "latitude": detection.latitude,
+            "longitude": detection.longitude,
+            "distance_m": distance_m,
+            "processed_path": f"/api/routes/{detection.route_id}/files/{detection.file_id}/processed",
+        })
+
+    return ORJSONResponse({
+        "count": len(detections),
+        "detections": detections,
+    })
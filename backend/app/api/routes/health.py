@@ -1,10 +1,65 @@
-from fastapi import APIRouter
+import os
+import time
+
+from fastapi import APIRouter, Response, status
+
+from app.core.config import settings
+from app.services.admission import get_admission_controller
+from app.services.model_loader import get_loaded_image_processor, model_status
+from app.services.response_cache import get_response_cache
 
 router = APIRouter()
 
+_started_at = time.monotonic()
+
 
 @router.get("/health", summary="Health check endpoint")
 async def health_check() -> dict[str, str]:
     return {"status": "ok"}
 
 
+@router.get("/health/live", summary="Liveness probe")
+async def liveness() -> dict:
+    """Процесс жив и обслуживает запросы; от состояния модели не зависит"""
+    return {"status": "ok", "pid": os.getpid(), "uptime_seconds": round(time.monotonic() - _started_at, 1)}
+
+
+@router.get("/health/ready", summary="Readiness probe")
+async def readiness(response: Response) -> dict:
+    """Готов ли воркер обрабатывать изображения: 503, пока модель загружается или если загрузка не удалась"""
+    model = model_status()
+    # Во время замены версии запросы обслуживает текущая модель
+    ready = model["state"] in ("ready", "swapping")
+    if not ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return {"status": "ready" if ready else "not_ready", "pid": os.getpid(), "model": model}
+
+
+@router.get("/health/load", summary="Inference load")
+async def inference_load(response: Response) -> dict:
+    """
+    Загрузка обработки изображений в этом воркере
+
+    Пока лимиты исчерпаны, отвечает 503 с Retry-After: балансировщик и клиенты могут
+    отложить загрузки, не отправляя файлы.
+    """
+    load = get_admission_controller().stats()
+    if load["saturated"]:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        response.headers["Retry-After"] = str(load["retry_after"])
+    return {"pid": os.getpid(), **load}
+
+
+@router.get("/health/cascade", summary="Cascade mode statistics")
+async def cascade_stats() -> dict:
+    """Сколько кадров каскад отсеял дешевым проходом и какая доля вычислений сэкономлена"""
+    processor = get_loaded_image_processor()
+    if processor is None:
+        return {"enabled": settings.cascade_enabled, "loaded": False}
+    return {"loaded": True, **processor.cascade_stats()}
+
+
+@router.get("/health/response-cache", summary="Response cache statistics")
+async def response_cache_stats() -> dict:
+    """Кэш ответов GET этого воркера: попадания, промахи и ответы 304"""
+    return {"pid": os.getpid(), **get_response_cache().stats()}
@@ -1,44 +1,189 @@
-import os
-import uuid
+import asyncio
 import json
+import shutil
+import uuid
+from collections.abc import AsyncIterator
+from contextlib import aclosing
+from datetime import date
 from pathlib import Path
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
-from fastapi.responses import Response
+from typing import TYPE_CHECKING
+from urllib.parse import quote
+
+from fastapi import APIRouter, Depends, HTTPException, Request, status, UploadFile, File, Header, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, ORJSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.core.deps import get_current_user, get_current_user_optional
 from app.core.config import settings
+from app.core.deps import get_current_user, get_current_user_optional
 from app.crud.route import (
     create_route,
-    get_routes_by_user,
+    get_routes_with_stats,
     delete_route as delete_route_db,
     get_route_by_id,
     update_route,
 )
-from app.db.session import get_db
+from app.crud.detection import get_route_detections
+from app.crud.reprocess_job import (
+    expire_stale_jobs,
+    get_reprocess_job as get_reprocess_job_db,
+    list_reprocess_jobs as list_reprocess_jobs_db,
+)
+from app.crud.response_version import route_scope, user_scope
+from app.crud.rollup import get_user_summary
+from app.crud.route_file import (
+    delete_route_file,
+    delete_route_files,
+    get_route_file,
+    get_route_file_stats,
+    get_route_files,
+    replace_route_file,
+    select_route_files,
+)
+from app.db.session import AsyncSessionLocal, get_db
+from app.models.route_file import RouteFile
 from app.models.user import User
 from app.schemas.route import RouteCreate, RouteRead
-from app.services.image_processor import get_image_processor
+from app.schemas.route_file import BulkDeleteResponse, BulkFileResult, BulkFileSelection
+from app.services.admission import AdmissionRejected, AdmissionTicket, get_admission_controller
+from app.services.classes import CLASS_NAMES
+from app.services.exif import apply_image_meta, extract_image_meta
+from app.services.export import build_route_export, ensure_export_checksums
+from app.services.report import REPORT_FORMATS, stream_report
+from app.services.response_cache import cached_read
+from app.services.model_loader import current_model_version, get_image_processor
+from app.services.pipeline import ImagePipeline, PipelineJob
+from app.services.reprocess import job_to_dict, live_upload, start_job
+from app.services.storage import (
+    file_processed_path,
+    hash_staged_files,
+    is_image_filename,
+    original_path as get_original_path,
+    processed_media_type,
+    processed_path as get_processed_path,
+    remove_file_data,
+    remove_files_data,
+    route_processed_dir as get_route_processed_dir,
+    route_upload_dir as get_route_upload_dir,
+)
+
+if TYPE_CHECKING:
+    from app.services.image_processor import ImageProcessor
 
 router = APIRouter()
 
+# Размер блока при копировании загруженного файла на диск
+UPLOAD_COPY_CHUNK_SIZE = 1024 * 1024
+
 
-@router.get("/", response_model=list[RouteRead])
+@router.get("/", response_model=list[RouteRead], response_class=ORJSONResponse)
 async def list_routes(
+    request: Request,
+    limit: int | None = Query(None, ge=1, le=1000, description="Без limit возвращаются все маршруты"),
+    offset: int = Query(0, ge=0),
+    sort: str = Query(
+        "name",
+        description="Поле сортировки: name, file_count, defect_count, last_upload_at (префикс '-' — по убыванию)",
+    ),
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_db),
+) -> ORJSONResponse:
+    cached = await cached_read(request, session, current_user.id, user_scope(current_user.id))
+    if cached.response is not None:
+        return cached.response
+    try:
+        rows, total = await get_routes_with_stats(
+            session, current_user.id, limit=limit, offset=offset, sort=sort
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e),
+        )
+
+    return cached.store(ORJSONResponse(
+        [
+            RouteRead(
+                id=route.id,
+                name=route.name,
+                description=route.description,
+                user_id=route.user_id,
+                files=[],
+                file_count=file_count,
+                defect_count=defect_count,
+                last_upload_at=last_upload_at,
+            ).model_dump(mode="json")
+            for route, file_count, defect_count, last_upload_at in rows
+        ],
+        headers={"X-Total-Count": str(total)},
+    ))
+
+
+@router.get("/summary", response_class=ORJSONResponse)
+async def get_routes_summary(
+    request: Request,
+    date_from: date | None = Query(None, description="Первый день периода (дата съемки или загрузки)"),
+    date_to: date | None = Query(None, description="Последний день периода"),
+    top: int = Query(10, ge=1, le=100, description="Сколько маршрутов с наибольшим числом дефектов вернуть"),
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_db),
+) -> ORJSONResponse:
+    """Сводка по дефектам всех маршрутов пользователя: итоги, классы, дни и худшие маршруты"""
+    cached = await cached_read(request, session, current_user.id, user_scope(current_user.id))
+    if cached.response is not None:
+        return cached.response
+    summary = await get_user_summary(session, current_user.id, date_from, date_to, top)
+    for item in summary["classes"]:
+        item["class_name"] = CLASS_NAMES.get(item["class_id"], f"class_{item['class_id']}")
+    return cached.store(ORJSONResponse(summary))
+
+
+@router.post("/reprocess", status_code=status.HTTP_202_ACCEPTED)
+async def reprocess_all_routes(
+    outdated_only: bool = Query(False, description="Только файлы, обработанные другой версией модели"),
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_db),
+) -> dict:
+    """Повторно обработать все маршруты пользователя текущей моделью"""
+    rows, _ = await get_routes_with_stats(session, current_user.id)
+    route_ids = [route.id for route, *_ in rows]
+    job = await start_job(
+        session, current_user.id, route_ids, file_filter="outdated_model" if outdated_only else None
+    )
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Для части маршрутов уже выполняется повторная обработка",
+        )
+    return job_to_dict(job)
+
+
+@router.get("/reprocess-jobs")
+async def list_reprocess_jobs(
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_db),
+) -> list[dict]:
+    """Список задач повторной обработки пользователя (задачи всех воркеров)"""
+    await expire_stale_jobs(session)
+    return [job_to_dict(job) for job in await list_reprocess_jobs_db(session, current_user.id)]
+
+
+@router.get("/reprocess-jobs/{job_id}")
+async def get_reprocess_job(
+    job_id: str,
     current_user: User = Depends(get_current_user),
     session: AsyncSession = Depends(get_db),
-) -> list[RouteRead]:
-    routes = await get_routes_by_user(session, current_user.id)
-    return [
-        RouteRead(
-            id=route.id,
-            name=route.name,
-            description=route.description,
-            user_id=route.user_id,
-            files=[],
+) -> dict:
+    """Прогресс задачи повторной обработки"""
+    await expire_stale_jobs(session)
+    job = await get_reprocess_job_db(session, job_id, current_user.id)
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Задача не найдена",
         )
-        for route in routes
-    ]
+    return job_to_dict(job)
 
 
 @router.post("/", response_model=RouteRead, status_code=status.HTTP_201_CREATED)
@@ -99,13 +244,160 @@ async def delete_route_endpoint(
         )
 
 
-@router.post("/{route_id}/files", status_code=status.HTTP_200_OK)
+async def _process_uploads(
+    session: AsyncSession,
+    pipeline: ImagePipeline,
+    processor: "ImageProcessor | None",
+    route_id: str,
+    user_id: str,
+    uploads: AsyncIterator[tuple[str, str, str, bytes]],
+) -> AsyncIterator[tuple[int, dict, RouteFile]]:
+    """
+    Прогоняет загруженные файлы через конвейер обработки и записывает их в БД
+
+    uploads выдает (file_id, filename, file_ext, content) для уже сохраненных оригиналов.
+    Чтение следующих файлов, обработка и запись в БД идут одновременно; с сессией
+    работает только этот генератор. Файлы выдаются в порядке подачи.
+
+    Yields:
+        (порядковый номер файла, запись о файле для ответа клиенту, сохраненный RouteFile)
+    """
+
+    async def produce() -> None:
+        try:
+            index = 0
+            async for file_id, filename, file_ext, content in uploads:
+                # Метаданные о файле запишем после обработки
+                route_file = RouteFile(
+                    id=file_id,
+                    route_id=route_id,
+                    original_name=filename,
+                    file_ext=file_ext,
+                )
+                if is_image_filename(filename):
+                    apply_image_meta(route_file, extract_image_meta(content))
+
+                # Если это изображение и процессор доступен, отправляем его в конвейер;
+                # остальные файлы проходят конвейер без обработки
+                if processor and processor.is_image_file(filename):
+                    job = PipelineJob(
+                        (index, route_file),
+                        content,
+                        get_processed_path(route_id, file_id, settings.processed_format),
+                    )
+                else:
+                    job = PipelineJob((index, route_file), None)
+                # Ожидание окна и результатов не занимает потоки пула run_in_threadpool
+                await pipeline.submit_async(job)
+                index += 1
+        finally:
+            pipeline.close()
+
+    async def completed() -> AsyncIterator[PipelineJob]:
+        # Конвейер выдает файлы в порядке подачи: из одноименных файлов одной загрузки
+        # в БД остается последний
+        while (job := await pipeline.next_result_async()) is not None:
+            yield job
+
+    producer = asyncio.create_task(produce())
+    try:
+        async for job in completed():
+            index, route_file = job.key
+            file_id, filename = route_file.id, route_file.original_name
+            detections: list[dict] = []
+
+            if job.output_path is None:
+                # Для не-изображений просто сохраняем оригинал;
+                # если процессор недоступен — просто сохраняем информацию о файле
+                entry = {
+                    "original": filename,
+                    "file_id": file_id,
+                    "note": "Обработка ИИ недоступна" if processor is None else "Файл не является изображением"
+                }
+            elif job.error is not None:
+                # Если обработка не удалась, все равно сохраняем оригинал
+                print(f"Ошибка обработки изображения {filename}: {job.error}")
+                entry = {
+                    "original": filename,
+                    "processed_id": file_id,
+                    "error": f"Ошибка обработки: {str(job.error)}"
+                }
+            else:
+                # Сохраняем статистику дефектов в метаданных
+                result = job.result
+                route_file.is_processed = True
+                route_file.processed_format = result['format']
+                route_file.model_version = result['model_version']
+                route_file.red_detection_count = result['red_detection_count']
+                route_file.green_detection_count = result['green_detection_count']
+                route_file.total_detections = result['total_detections']
+                detections = result['detections']
+                entry = {
+                    "original": filename,
+                    "processed_id": file_id,
+                    "processed_path": f"/api/routes/{route_id}/files/{file_id}/processed"
+                }
+
+            # Хеши для хранилища считаем вне транзакции; файлы переносятся при сохранении записи
+            await run_in_threadpool(hash_staged_files, route_file)
+            # Короткая транзакция на файл: запись с тем же именем (дубликат) заменяется атомарно,
+            # поэтому параллельные загрузки в один маршрут не теряют друг друга
+            replaced = await replace_route_file(session, route_file, user_id, detections)
+            for duplicate_id, duplicate_ext in replaced:
+                print(f"🔄 Найден дубликат файла '{filename}', удаляем старую версию")
+                remove_file_data(route_id, duplicate_id, duplicate_ext)
+
+            yield index, entry, route_file
+
+        # Ошибки чтения загрузки поднимаются здесь
+        await producer
+    finally:
+        if not producer.done():
+            producer.cancel()
+            pipeline.cancel()
+
+
+def _get_processor_or_none() -> "ImageProcessor | None":
+    """Процессор изображений или None, если модель не загрузилась; ждет загрузку, если она идет"""
+    try:
+        return get_image_processor()
+    except Exception as e:
+        print(f"⚠️ Процессор изображений недоступен: {e}")
+        print("⚠️ Изображения будут загружены без обработки ИИ")
+        return None
+
+
+def _admission_cost(file: UploadFile) -> tuple[int, int]:
+    """Сколько изображений и байт загруженный файл добавляет к обработке"""
+    return int(is_image_filename(file.filename or "")), file.size or 0
+
+
+def _admit_upload(user: User, costs: list[tuple[int, int]]) -> AdmissionTicket:
+    """Допускает загрузку к обработке или отвечает 429/503 с Retry-After"""
+    try:
+        return get_admission_controller().admit(
+            user.email, sum(images for images, _ in costs), sum(nbytes for _, nbytes in costs)
+        )
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.detail,
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+
+def _prepare_route_dirs(route_id: str) -> None:
+    get_route_upload_dir(route_id).mkdir(parents=True, exist_ok=True)
+    get_route_processed_dir(route_id).mkdir(parents=True, exist_ok=True)
+
+
+@router.post("/{route_id}/files", status_code=status.HTTP_200_OK, response_class=ORJSONResponse)
 async def upload_files(
     route_id: str,
     files: list[UploadFile] = File(...),
     current_user: User = Depends(get_current_user),
     session: AsyncSession = Depends(get_db),
-) -> dict:
+) -> ORJSONResponse:
     route = await get_route_by_id(session, route_id, current_user.id)
     if not route:
         raise HTTPException(
@@ -113,140 +405,179 @@ async def upload_files(
             detail="Маршрут не найден",
         )
 
+    costs = [_admission_cost(file) for file in files]
+    with _admit_upload(current_user, costs) as ticket:
+        return ORJSONResponse(await _upload_admitted(route_id, files, costs, ticket, current_user, session))
+
+
+async def _upload_admitted(
+    route_id: str,
+    files: list[UploadFile],
+    costs: list[tuple[int, int]],
+    ticket: AdmissionTicket,
+    current_user: User,
+    session: AsyncSession,
+) -> dict:
+    """Загрузка, допущенная к обработке; по мере обработки файлов ticket освобождает лимит"""
     uploaded_files = []
     processed_files = []
     
     # Создаем директорию для маршрута
-    route_upload_dir = settings.upload_dir / route_id
-    route_processed_dir = settings.processed_dir / route_id
-    route_upload_dir.mkdir(parents=True, exist_ok=True)
-    route_processed_dir.mkdir(parents=True, exist_ok=True)
+    _prepare_route_dirs(route_id)
 
     # Пытаемся получить процессор изображений
-    processor = None
-    try:
-        processor = get_image_processor()
-    except Exception as e:
-        print(f"⚠️ Процессор изображений недоступен: {e}")
-        print("⚠️ Изображения будут загружены без обработки ИИ")
+    processor = await run_in_threadpool(_get_processor_or_none)
 
-    # Загружаем метаданные один раз перед циклом
-    metadata_file = route_upload_dir / "metadata.json"
-    metadata = {}
-    if metadata_file.exists():
-        try:
-            with open(metadata_file, "r", encoding="utf-8") as f:
-                metadata = json.load(f)
-        except:
-            metadata = {}
-
-    for file in files:
-        content = await file.read()
-        filename = file.filename or "unknown"
-        file_ext = Path(filename).suffix
-        
-        # Проверяем, есть ли уже файл с таким именем (дубликат)
-        duplicate_file_id = None
-        for existing_file_id, file_meta in list(metadata.items()):
-            if file_meta.get("original_name") == filename:
-                duplicate_file_id = existing_file_id
-                break
+    async def uploads() -> AsyncIterator[tuple[str, str, str, bytes]]:
+        for file in files:
+            content = await file.read()
+            filename = file.filename or "unknown"
+            file_ext = Path(filename).suffix
         
-        # Если найден дубликат, удаляем старый файл
-        if duplicate_file_id:
-            print(f"🔄 Найден дубликат файла '{filename}', удаляем старую версию")
-            
-            # Удаляем оригинальный файл
-            original_files = list(route_upload_dir.glob(f"{duplicate_file_id}.*"))
-            for original_file in original_files:
-                if original_file.exists():
-                    original_file.unlink()
-            
-            # Удаляем обработанное изображение
-            processed_path = route_processed_dir / f"{duplicate_file_id}_processed.jpg"
-            if processed_path.exists():
-                processed_path.unlink()
-            
-            # Удаляем из метаданных
-            if duplicate_file_id in metadata:
-                del metadata[duplicate_file_id]
-            
-            # Сохраняем метаданные сразу после удаления дубликата
-            with open(metadata_file, "w", encoding="utf-8") as f:
-                json.dump(metadata, f, ensure_ascii=False, indent=2)
+            # Сохраняем новый файл
+            file_id = str(uuid.uuid4())
+            original_path = get_original_path(route_id, file_id, file_ext)
         
-        # Сохраняем новый файл
-        file_id = str(uuid.uuid4())
-        original_path = route_upload_dir / f"{file_id}{file_ext}"
-        
-        with open(original_path, "wb") as f:
-            f.write(content)
-        
-        uploaded_files.append(filename)
-        
-        # Сохраняем метаданные о файле
-        metadata[file_id] = {
-            "original_name": filename,
-            "file_ext": file_ext,
-        }
+            with open(original_path, "wb") as f:
+                f.write(content)
         
-        # Если это изображение и процессор доступен, обрабатываем его
-        if processor and processor.is_image_file(filename):
-            try:
-                # Обрабатываем изображение через ONNX модель
-                result = processor.process_image(content)
-                
-                # Сохраняем обработанное изображение
-                processed_path = route_processed_dir / f"{file_id}_processed.jpg"
-                with open(processed_path, "wb") as f:
-                    f.write(result['image_bytes'])
-                
-                # Сохраняем статистику дефектов в метаданных
-                metadata[file_id]['red_detection_count'] = result['red_detection_count']
-                metadata[file_id]['green_detection_count'] = result['green_detection_count']
-                metadata[file_id]['has_red_detections'] = result['has_red_detections']
-                metadata[file_id]['has_green_detections'] = result['has_green_detections']
-                metadata[file_id]['total_detections'] = result['total_detections']
-                
-                processed_files.append({
-                    "original": filename,
-                    "processed_id": file_id,
-                    "processed_path": f"/api/routes/{route_id}/files/{file_id}/processed"
-                })
-            except Exception as e:
-                # Если обработка не удалась, все равно сохраняем оригинал
-                print(f"Ошибка обработки изображения {filename}: {e}")
-                processed_files.append({
-                    "original": filename,
-                    "processed_id": file_id,
-                    "error": f"Ошибка обработки: {str(e)}"
-                })
-        elif processor and not processor.is_image_file(filename):
-            # Для не-изображений просто сохраняем оригинал
-            processed_files.append({
-                "original": filename,
-                "file_id": file_id,
-                "note": "Файл не является изображением"
-            })
-        else:
-            # Процессор недоступен - просто сохраняем информацию о файле
-            processed_files.append({
-                "original": filename,
-                "file_id": file_id,
-                "note": "Обработка ИИ недоступна" if processor is None else "Файл не является изображением"
-            })
-    
-    # Сохраняем обновленные метаданные после обработки всех файлов
-    with open(metadata_file, "w", encoding="utf-8") as f:
-        json.dump(metadata, f, ensure_ascii=False, indent=2)
+            uploaded_files.append(filename)
+            yield file_id, filename, file_ext, content
+
+    # Пока идет загрузка, фоновая повторная обработка уступает ей процессор
+    pipeline = ImagePipeline(processor).start()
+    async with live_upload(), aclosing(
+        _process_uploads(session, pipeline, processor, route_id, current_user.id, uploads())
+    ) as results:
+        async for index, entry, _ in results:
+            processed_files.append(entry)
+            ticket.release(*costs[index])
+    stats = pipeline.stats()
+    print(f"📈 Конвейер загрузки: {ImagePipeline.format_stats(stats)}")
 
     return {
         "message": f"Загружено файлов: {len(uploaded_files)}",
         "files": uploaded_files,
         "processed_files": processed_files,
+        "pipeline": stats,
     }
 
 
+def _sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _save_original(file: UploadFile, route_id: str) -> tuple[str, str, str]:
+    """Копирует загруженный файл на диск без чтения целиком в память"""
+    filename = file.filename or "unknown"
+    file_ext = Path(filename).suffix
+    file_id = str(uuid.uuid4())
+    file.file.seek(0)
+    with open(get_original_path(route_id, file_id, file_ext), "wb") as f:
+        shutil.copyfileobj(file.file, f, UPLOAD_COPY_CHUNK_SIZE)
+    return file_id, filename, file_ext
+
+
+@router.post("/{route_id}/files/stream")
+async def upload_files_stream(
+    route_id: str,
+    files: list[UploadFile] = File(...),
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_db),
+) -> StreamingResponse:
+    """
+    Загрузка с потоковым ответом (Server-Sent Events)
+
+    Событие file отправляется сразу после обработки каждого файла, событие summary — в конце.
+    Оригиналы сохраняются на диск до начала ответа: после выхода из обработчика FastAPI
+    закрывает загруженные файлы и сессию БД, поэтому поток работает с копиями на диске.
+    """
+    route = await get_route_by_id(session, route_id, current_user.id)
+    if not route:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Маршрут не найден",
+        )
+
+    costs = [_admission_cost(file) for file in files]
+    ticket = _admit_upload(current_user, costs)
+    saved: list[tuple[str, str, str]] = []
+    stored: set[str] = set()
+    user_id = current_user.id
+
+    def finish() -> None:
+        """Возвращает остаток лимита и удаляет оригиналы, не попавшие в БД; повторный вызов безопасен"""
+        ticket.close()
+        for file_id, _, file_ext in saved:
+            if file_id not in stored:
+                get_original_path(route_id, file_id, file_ext).unlink(missing_ok=True)
+
+    async def uploads() -> AsyncIterator[tuple[str, str, str, bytes]]:
+        for file_id, filename, file_ext in saved:
+            content = await run_in_threadpool(get_original_path(route_id, file_id, file_ext).read_bytes)
+            yield file_id, filename, file_ext, content
+
+    async def events() -> AsyncIterator[str]:
+        processor = await run_in_threadpool(_get_processor_or_none)
+        pipeline = ImagePipeline(processor).start()
+        summary = {
+            "total": len(saved),
+            "uploaded": 0,
+            "processed": 0,
+            "errors": 0,
+            "red_detection_count": 0,
+            "green_detection_count": 0,
+            "total_detections": 0,
+        }
+        try:
+            async with live_upload(), AsyncSessionLocal() as stream_session, aclosing(
+                _process_uploads(stream_session, pipeline, processor, route_id, user_id, uploads())
+            ) as results:
+                async for index, entry, route_file in results:
+                    ticket.release(*costs[index])
+                    stored.add(route_file.id)
+                    summary["uploaded"] += 1
+                    summary["processed"] += 1 if route_file.is_processed else 0
+                    summary["errors"] += 1 if "error" in entry else 0
+                    for key in ("red_detection_count", "green_detection_count", "total_detections"):
+                        summary[key] += getattr(route_file, key) or 0
+
+                    yield _sse_event("file", {
+                        **entry,
+                        "index": index,
+                        "total": len(saved),
+                        "red_detection_count": route_file.red_detection_count or 0,
+                        "green_detection_count": route_file.green_detection_count or 0,
+                        "total_detections": route_file.total_detections or 0,
+                    })
+
+            stats = pipeline.stats()
+            print(f"📈 Конвейер загрузки: {ImagePipeline.format_stats(stats)}")
+            summary["elapsed_seconds"] = stats["wall_seconds"]
+            summary["pipeline"] = stats
+            summary["message"] = f"Загружено файлов: {summary['uploaded']}"
+            yield _sse_event("summary", summary)
+        finally:
+            # Клиент отключился — оригиналы, до которых не дошла очередь, не попадут в БД
+            finish()
+
+    # До передачи ответа поток не запущен: при любой ошибке лимит и оригиналы освобождаются здесь
+    try:
+        _prepare_route_dirs(route_id)
+        for file in files:
+            saved.append(await run_in_threadpool(_save_original, file, route_id))
+        # Фоновая задача ответа выполняется и тогда, когда поток не начался (клиент отключился раньше)
+        return StreamingResponse(
+            events(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            background=BackgroundTask(finish),
+        )
+    except BaseException:
+        finish()
+        raise
+
+
 @router.get("/{route_id}/files/{file_id}/processed")
 async def get_processed_file(
     route_id: str,
@@ -262,18 +593,131 @@ async def get_processed_file(
             detail="Маршрут не найден",
         )
     
-    processed_path = settings.processed_dir / route_id / f"{file_id}_processed.jpg"
+    route_file = await get_route_file(session, route_id, file_id)
+    processed_path = file_processed_path(route_file) if route_file else None
     
-    if not processed_path.exists():
+    if processed_path is None or not processed_path.exists():
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Обработанное изображение не найдено",
         )
     
-    with open(processed_path, "rb") as f:
-        content = f.read()
-    
-    return Response(content=content, media_type="image/jpeg")
+    return FileResponse(processed_path, media_type=processed_media_type(route_file.processed_format))
+
+
+def _parse_byte_range(header: str, size: int) -> tuple[int, int] | None:
+    """
+    Один диапазон из заголовка Range (bytes=a-b, bytes=a-, bytes=-n)
+
+    None — заголовок не поддерживается (несколько диапазонов и т. п.), отдается весь ответ.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    start_text, _, end_text = spec.strip().partition("-")
+    try:
+        if not start_text:
+            start, end = max(0, size - int(end_text)), size - 1
+        else:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail="Запрошенный диапазон вне архива",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    return start, min(end, size - 1)
+
+
+@router.get("/{route_id}/export")
+async def export_route(
+    route_id: str,
+    range_header: str | None = Header(None, alias="range"),
+    if_range: str | None = Header(None),
+    current_user: User = Depends(get_current_user_optional),
+    session: AsyncSession = Depends(get_db),
+) -> StreamingResponse:
+    """
+    Скачать маршрут одним ZIP: обработанные изображения и детекции (detections.csv, manifest.json)
+
+    Архив формируется на лету без сжатия и без временных файлов. Прерванную загрузку можно
+    продолжить запросом с Range (и If-Range с полученным ETag), пока маршрут не изменился.
+    """
+    route = await get_route_by_id(session, route_id, current_user.id)
+    if not route:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Маршрут не найден",
+        )
+
+    route_files = await get_route_files(session, route_id, processed_only=True)
+    await ensure_export_checksums(session, route_files)
+    detections = await get_route_detections(session, route_id)
+    archive, etag = build_route_export(route, route_files, detections)
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Content-Disposition": (
+            f'attachment; filename="route-{route_id[:8]}.zip"; filename*=UTF-8\'\'{quote(route.name)}.zip'
+        ),
+    }
+    byte_range = None
+    # If-Range: диапазон отдается, только если архив не изменился с прошлого запроса
+    if range_header and (if_range is None or if_range == etag):
+        byte_range = _parse_byte_range(range_header, archive.size)
+    if byte_range is None:
+        start, end = 0, archive.size - 1
+        status_code = status.HTTP_200_OK
+    else:
+        start, end = byte_range
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+        headers["Content-Range"] = f"bytes {start}-{end}/{archive.size}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    return StreamingResponse(
+        archive.iter_range(start, end),
+        status_code=status_code,
+        media_type="application/zip",
+        headers=headers,
+    )
+
+
+@router.get("/{route_id}/report")
+async def get_defect_report(
+    route_id: str,
+    report_format: str = Query("html", alias="format", pattern="^(csv|html|pdf)$"),
+    current_user: User = Depends(get_current_user_optional),
+    session: AsyncSession = Depends(get_db),
+) -> StreamingResponse:
+    """
+    Отчет о повреждениях маршрута (bad_insulator, damaged_insulator): CSV, HTML или PDF
+
+    В HTML и PDF у каждой детекции есть вырезка из обработанного изображения. Отчет
+    отдается потоком по мере формирования; вырезки кэшируются, повторный отчет быстрее.
+    """
+    route = await get_route_by_id(session, route_id, current_user.id)
+    if not route:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Маршрут не найден",
+        )
+
+    media_type, suffix = REPORT_FORMATS[report_format]
+    disposition = "attachment" if report_format == "csv" else "inline"
+    filename = f"defects-{route_id[:8]}{suffix}"
+    return StreamingResponse(
+        stream_report(route_id, route.name, report_format),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": (
+                f'{disposition}; filename="{filename}"; filename*=UTF-8\'\'{quote(route.name)}{suffix}'
+            ),
+        },
+    )
 
 
 @router.delete("/{route_id}/files/{file_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -291,116 +735,159 @@ async def delete_file(
             detail="Маршрут не найден",
         )
     
-    # Удаляем оригинальный файл
-    route_upload_dir = settings.upload_dir / route_id
-    original_files = list(route_upload_dir.glob(f"{file_id}.*"))
-    for original_file in original_files:
-        if original_file.exists():
-            original_file.unlink()
-    
-    # Удаляем обработанное изображение
-    processed_path = settings.processed_dir / route_id / f"{file_id}_processed.jpg"
-    if processed_path.exists():
-        processed_path.unlink()
-    
-    # Удаляем метаданные о файле
-    metadata_file = route_upload_dir / "metadata.json"
-    if metadata_file.exists():
-        try:
-            with open(metadata_file, "r", encoding="utf-8") as f:
-                metadata = json.load(f)
-            if file_id in metadata:
-                del metadata[file_id]
-            with open(metadata_file, "w", encoding="utf-8") as f:
-                json.dump(metadata, f, ensure_ascii=False, indent=2)
-        except:
-            pass
+    # Удаляем запись о файле и сам файл с диска
+    route_file = await delete_route_file(session, route_id, file_id, current_user.id)
+    if route_file:
+        remove_file_data(route_id, route_file.id, route_file.file_ext)
     
     return None
 
 
-@router.get("/{route_id}/files")
-async def list_route_files(
+@router.post("/{route_id}/files/bulk-delete", response_model=BulkDeleteResponse)
+async def bulk_delete_files(
     route_id: str,
+    selection: BulkFileSelection,
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_db),
+) -> BulkDeleteResponse:
+    """Удалить несколько файлов маршрута по списку ID или по фильтру"""
+    route = await get_route_by_id(session, route_id, current_user.id)
+    if not route:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Маршрут не найден",
+        )
+
+    try:
+        route_files = await select_route_files(
+            session, route_id, selection.file_ids, selection.filter, model_version=current_model_version()
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    found = {route_file.id: route_file for route_file in route_files}
+
+    # Сначала одной транзакцией удаляем записи, затем пакетно — файлы с диска
+    await delete_route_files(session, route_id, route_files, current_user.id)
+    errors = await run_in_threadpool(
+        remove_files_data,
+        route_id,
+        [(route_file.id, route_file.file_ext) for route_file in route_files],
+    )
+
+    results = []
+    requested_ids = list(dict.fromkeys(selection.file_ids)) if selection.file_ids is not None else list(found)
+    for file_id in requested_ids:
+        route_file = found.get(file_id)
+        if route_file is None:
+            results.append(BulkFileResult(file_id=file_id, status="not_found"))
+        elif file_id in errors:
+            results.append(BulkFileResult(
+                file_id=file_id,
+                status="error",
+                original=route_file.original_name,
+                error=errors[file_id],
+            ))
+        else:
+            results.append(BulkFileResult(
+                file_id=file_id,
+                status="deleted",
+                original=route_file.original_name,
+            ))
+
+    return BulkDeleteResponse(deleted=len(found), results=results)
+
+
+@router.post("/{route_id}/reprocess", status_code=status.HTTP_202_ACCEPTED)
+async def reprocess_route(
+    route_id: str,
+    selection: BulkFileSelection | None = None,
     current_user: User = Depends(get_current_user),
     session: AsyncSession = Depends(get_db),
 ) -> dict:
-    """Получить список файлов маршрута"""
+    """
+    Повторно обработать сохраненные оригиналы маршрута текущей моделью
+
+    Без тела запроса обрабатываются все изображения маршрута. Если предыдущий
+    запуск с той же версией модели был прерван, уже обработанные им файлы пропускаются.
+    """
+    route = await get_route_by_id(session, route_id, current_user.id)
+    if not route:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Маршрут не найден",
+        )
+    job = await start_job(
+        session,
+        current_user.id,
+        [route_id],
+        file_ids=selection.file_ids if selection else None,
+        file_filter=selection.filter if selection else None,
+    )
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Повторная обработка маршрута уже выполняется",
+        )
+    return job_to_dict(job)
+
+
+@router.get("/{route_id}/files", response_class=ORJSONResponse)
+async def list_route_files(
+    route_id: str,
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_db),
+) -> ORJSONResponse:
+    """
+    Получить список файлов маршрута
+
+    Ответ собирается из наших же данных, поэтому отдается готовым ORJSONResponse — без проверки
+    через pydantic и jsonable_encoder, которые на тысячах файлов занимают большую часть времени.
+    Пока файлы маршрута не менялись, ответ берется из кэша (или 304 по ETag) без запросов к файлам.
+    """
+    cached = await cached_read(request, session, current_user.id, route_scope(route_id))
+    if cached.response is not None:
+        return cached.response
     route = await get_route_by_id(session, route_id, current_user.id)
     if not route:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Маршрут не найден",
         )
-    
-    route_upload_dir = settings.upload_dir / route_id
-    route_processed_dir = settings.processed_dir / route_id
     
     processed_files = []
     
-    # Загружаем метаданные о файлах
-    metadata_file = route_upload_dir / "metadata.json"
-    metadata = {}
-    if metadata_file.exists():
-        try:
-            with open(metadata_file, "r", encoding="utf-8") as f:
-                metadata = json.load(f)
-        except:
-            metadata = {}
-    
-    # Сканируем директорию с обработанными изображениями
-    if route_processed_dir.exists():
-        for processed_file in route_processed_dir.glob("*_processed.jpg"):
-            # Извлекаем file_id из имени файла (формат: {file_id}_processed.jpg)
-            file_id = processed_file.stem.replace("_processed", "")
-            
-            # Проверяем, что обработанный файл действительно существует
-            if not processed_file.exists():
-                continue
-            
-            # Получаем оригинальное имя из метаданных
-            original_name = f"image_{file_id}"  # Значение по умолчанию
-            file_meta = metadata.get(file_id, {})
-            if "original_name" in file_meta:
-                original_name = file_meta["original_name"]
-            
-            # Проверяем, существует ли оригинальный файл
-            original_files = list(route_upload_dir.glob(f"{file_id}.*"))
-            if original_files and any(f.exists() for f in original_files):
-                file_data = {
-                    "original": original_name,
-                    "processed_id": file_id,
-                    "processed_path": f"/api/routes/{route_id}/files/{file_id}/processed"
-                }
-                
-                # Добавляем информацию о детекциях из метаданных
-                if file_id in metadata:
-                    meta = metadata[file_id]
-                    if "green_detection_count" in meta:
-                        file_data["green_detection_count"] = meta.get("green_detection_count", 0)
-                    if "red_detection_count" in meta:
-                        file_data["red_detection_count"] = meta.get("red_detection_count", 0)
-                    if "has_green_detections" in meta:
-                        file_data["has_green_detections"] = meta.get("has_green_detections", False)
-                    if "has_red_detections" in meta:
-                        file_data["has_red_detections"] = meta.get("has_red_detections", False)
-                    if "total_detections" in meta:
-                        file_data["total_detections"] = meta.get("total_detections", 0)
-                
-                processed_files.append(file_data)
+    # Метаданные берем из БД, без сканирования директорий
+    for route_file in await get_route_files(session, route_id, processed_only=True):
+        file_id = route_file.id
+        processed_files.append({
+            "original": route_file.original_name,
+            "processed_id": file_id,
+            "processed_path": f"/api/routes/{route_id}/files/{file_id}/processed",
+            "green_detection_count": route_file.green_detection_count,
+            "red_detection_count": route_file.red_detection_count,
+            "has_green_detections": route_file.has_green_detections,
+            "has_red_detections": route_file.has_red_detections,
+            "total_detections": route_file.total_detections,
+            "model_version": route_file.model_version,
+        })
 
-    return {
+    return cached.store(ORJSONResponse({
         "files": processed_files,
-    }
+    }))
 
 
-@router.get("/{route_id}/stats")
+@router.get("/{route_id}/stats", response_class=ORJSONResponse)
 async def get_route_stats(
     route_id: str,
+    request: Request,
     current_user: User = Depends(get_current_user),
     session: AsyncSession = Depends(get_db),
-) -> dict:
+) -> ORJSONResponse:
     """Получить статистику по маршруту"""
+    cached = await cached_read(request, session, current_user.id, route_scope(route_id))
+    if cached.response is not None:
+        return cached.response
     route = await get_route_by_id(session, route_id, current_user.id)
     if not route:
         raise HTTPException(
@@ -408,58 +895,6 @@ async def get_route_stats(
             detail="Маршрут не найден",
         )
     
-    route_upload_dir = settings.upload_dir / route_id
-    route_processed_dir = settings.processed_dir / route_id
-    
-    # Загружаем метаданные о файлах
-    metadata_file = route_upload_dir / "metadata.json"
-    metadata = {}
-    if metadata_file.exists():
-        try:
-            with open(metadata_file, "r", encoding="utf-8") as f:
-                metadata = json.load(f)
-        except:
-            metadata = {}
-    
-    # Подсчитываем статистику
-    total_processed = 0
-    with_green_detections = 0  # Изображения с зелеными детекциями (без красных)
-    with_red_detections = 0    # Изображения с красными детекциями
-    
-    # Сканируем директорию с обработанными изображениями
-    if route_processed_dir.exists():
-        for processed_file in route_processed_dir.glob("*_processed.jpg"):
-            file_id = processed_file.stem.replace("_processed", "")
-            
-            # Проверяем, что обработанный файл действительно существует
-            if not processed_file.exists():
-                continue
-            
-            # Проверяем, существует ли оригинальный файл
-            original_files = list(route_upload_dir.glob(f"{file_id}.*"))
-            if original_files and any(f.exists() for f in original_files):
-                total_processed += 1
-                
-                # Проверяем метаданные на наличие информации о детекциях
-                if file_id in metadata:
-                    has_red = metadata[file_id].get('has_red_detections', False)
-                    has_green = metadata[file_id].get('has_green_detections', False)
-                    total_detections = metadata[file_id].get('total_detections', 0)
-                    
-                    # Если есть детекции (любые)
-                    if total_detections > 0:
-                        if has_red:
-                            # Если есть красные детекции, считаем это изображение с дефектами
-                            with_red_detections += 1
-                        elif has_green:
-                            # Если есть только зеленые детекции (без красных), считаем это изображение без дефектов
-                            with_green_detections += 1
-                    # Если нет детекций (total_detections == 0), не считаем ни в одну категорию
-                # Если нет метаданных, не считаем ни в одну категорию
-    
-    return {
-        "total_processed": total_processed,
-        "with_green_detections": with_green_detections,
-        "with_red_detections": with_red_detections,
-    }
-
+    # Изображения с красными детекциями считаются дефектными,
+    # изображения только с зелеными детекциями — без дефектов
+    return cached.store(ORJSONResponse(await get_route_file_stats(session, route_id)))
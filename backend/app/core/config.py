@@ -1,4 +1,5 @@
 from pathlib import Path
+from typing import Literal
 from pydantic_settings import BaseSettings
 
 
@@ -11,6 +12,93 @@ class Settings(BaseSettings):
     access_token_expire_minutes: int = 60
     upload_dir: Path = Path("./uploads")
     processed_dir: Path = Path("./uploads/processed")
+    # Хранилище содержимого файлов по хешу; директории маршрутов остаются для файлов
+    # в процессе загрузки и для данных, еще не перенесенных app.services.storage_migrate
+    storage_dir: Path = Path("./uploads/blobs")
+    # Сборка мусора не трогает объекты хранилища без ссылок моложе этого срока (секунды):
+    # их может сейчас сохранять загрузка
+    storage_gc_grace_seconds: int = 3600
+    # Отчет о повреждениях: кэш миниатюр вырезок, их размер (px), потоки для подготовки вырезок
+    # и шрифт с кириллицей для PDF (по умолчанию ищется DejaVuSans)
+    crop_cache_dir: Path = Path("./uploads/crops")
+    report_crop_size: int = 160
+    report_crop_workers: int = 4
+    report_font_path: Path | None = None
+    # Сжатие ответов JSON, HTML и CSV: brotli или gzip по Accept-Encoding;
+    # ответы меньше порога (байт) не сжимаются, 0 — не сжимать
+    compression_min_size: int = 1024
+    compression_gzip_level: int = 5
+    compression_brotli_quality: int = 4
+    # Кэш ответов GET (файлы и статистика маршрута, список маршрутов, сводка) в памяти каждого
+    # воркера, МБ; 0 — без кэша (ETag и ответы 304 работают и без него)
+    response_cache_mb: int = 64
+    # Обработанные изображения: формат (jpeg или webp), качество и параметры JPEG
+    processed_format: Literal["jpeg", "webp"] = "jpeg"
+    processed_quality: int = 95
+    jpeg_progressive: bool = False
+    jpeg_optimize: bool = False
+    # Кадры JPEG без детекций сохраняются без перекодирования (с исходным качеством, без EXIF,
+    # XMP и комментариев); false — перекодируются с processed_quality, как остальные
+    jpeg_passthrough: bool = True
+    # SQLite: ожидание блокировки записи и период сжатия журнала WAL (секунды)
+    sqlite_busy_timeout: float = 30.0
+    sqlite_checkpoint_interval: float = 60.0
+    # Реестр моделей: директория с версиями *.onnx (по умолчанию ai/ в корне проекта) и версия
+    # по умолчанию; выбранная версия записывается в файл ACTIVE этой директории
+    models_dir: Path | None = None
+    default_model_file: str = "best.onnx"
+    # Как часто проверять смену активной модели (секунды, 0 — не следить); новая версия
+    # загружается в фоне и подменяет текущую без перезапуска
+    models_watch_interval: float = 10.0
+    # Повторная попытка загрузить модель после ошибки — не раньше чем через (секунды)
+    models_retry_seconds: float = 30.0
+    # Токен администрирования для /api/admin (заголовок X-Admin-Token); пусто — выключено
+    admin_token: str | None = None
+    # Потоки ONNX Runtime на один инференс (0 — по умолчанию ORT)
+    inference_threads: int = 0
+    # Инференс через IOBinding ORT с заранее выделенными буферами входа и выходов
+    inference_io_binding: bool = True
+    # Отдельный сервер инференса (python -m app.services.inference_server): адреса unix:///path
+    # или tcp://host:port через запятую; пусто — инференс в процессе воркера
+    inference_server_url: str | None = None
+    inference_server_timeout: float = 30.0
+    # Общий токен воркеров и сервера инференса; обязателен, если сервер слушает TCP вне localhost
+    inference_server_token: str | None = None
+    # Тензоры через разделяемую память, если сервер на том же хосте (unix-сокет)
+    inference_shared_memory: bool = True
+    # Сервер инференса: адрес по умолчанию, наибольший батч и сколько ждать его заполнения (мс)
+    inference_server_listen: str = "unix:///tmp/rbx-inference.sock"
+    inference_batch_size: int = 8
+    inference_batch_wait_ms: float = 2.0
+    # Загружать модель в фоне сразу после старта (иначе — при первой загрузке изображений)
+    preload_model: bool = True
+    # Сколько секунд воркер ждет завершения запросов и инференса при остановке
+    shutdown_timeout: float = 30.0
+    # Повторная обработка маршрутов новой моделью
+    reprocess_workers: int = 2
+    reprocess_batch_size: int = 16
+    reprocess_throttle_seconds: float = 0.5
+    # Через сколько секунд без heartbeat блокировка маршрута и задача считаются брошенными
+    # остановленным процессом (задача обновляет heartbeat каждые route_lock_timeout / 4)
+    route_lock_timeout: float = 300.0
+    # Конвейер загрузки: потоки на стадиях декодирования, инференса и кодирования — общие для всех
+    # загрузок воркера; окно одной загрузки — pipeline_queue_size заданий на стадию и на выдачу
+    pipeline_decode_workers: int = 2
+    pipeline_inference_workers: int = 1
+    pipeline_encode_workers: int = 2
+    pipeline_queue_size: int = 4
+    # Допуск загрузок к обработке (на каждый воркер): изображений и мегабайт в обработке,
+    # доля лимитов одного пользователя и Retry-After по умолчанию (секунды); 0 — без ограничения.
+    # Потоки пула запросов загрузки не держат, поэтому лимиты подбираются только по памяти
+    admission_max_images: int = 256
+    admission_max_queued_mb: int = 2048
+    admission_user_share: float = 0.5
+    admission_retry_after: int = 5
+    # Каскадный режим: дешевый проход отсеивает кадры без объектов до полной обработки.
+    # cascade_model_path — меньшая модель для дешевого прохода; без нее каскад не включается
+    cascade_enabled: bool = False
+    cascade_model_path: Path | None = None
+    cascade_threshold: float = 0.1
 
     class Config:
         env_file = ".env"
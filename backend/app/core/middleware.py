@@ -0,0 +1,191 @@
+import gzip
+import re
+import zlib
+
+import brotli
+from jose import JWTError
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import settings
+from app.core.security import decode_token
+from app.services.admission import AdmissionRejected, get_admission_controller
+
+# Типы ответов, которые стоит сжимать (изображения и ZIP уже сжаты)
+_COMPRESSIBLE_TYPES = ("application/json", "text/html", "text/csv", "text/plain", "application/javascript")
+# Тело больше этого размера сжимается в пуле потоков, чтобы не блокировать цикл событий
+_THREADED_COMPRESSION_SIZE = 256 * 1024
+
+
+class UploadAdmissionMiddleware:
+    """
+    Отклоняет загрузку файлов в маршрут до приема тела запроса, если на нее заведомо нет места
+
+    Размер берется из Content-Length, пользователь — из токена. Точная проверка по числу
+    изображений выполняется в обработчике; здесь лишь не даем клиенту передавать сотни мегабайт,
+    которые все равно будут отклонены.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._upload_path = re.compile(rf"^{re.escape(settings.api_v1_prefix)}/routes/[^/]+/files(/stream)?/?$")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["method"] == "POST" and self._upload_path.match(scope["path"]):
+            headers = Headers(scope=scope)
+            user_key = _token_subject(headers.get("authorization"))
+            length = headers.get("content-length", "")
+            # Без токена или размера пропускаем: ответ даст обработчик
+            if user_key and length.isdigit():
+                try:
+                    get_admission_controller().check(user_key, int(length))
+                except AdmissionRejected as e:
+                    response = JSONResponse(
+                        {"detail": e.detail},
+                        status_code=e.status_code,
+                        headers={"Retry-After": str(e.retry_after)},
+                    )
+                    await response(scope, receive, send)
+                    return
+        await self.app(scope, receive, send)
+
+
+def _token_subject(authorization: str | None) -> str | None:
+    if not authorization or not authorization.startswith("Bearer "):
+        return None
+    try:
+        return decode_token(authorization[7:])
+    except JWTError:
+        return None
+
+
+def _accepted_encoding(accept_encoding: str) -> str | None:
+    """Кодировка из Accept-Encoding: brotli, если клиент его принимает, иначе gzip"""
+    accepted = set()
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q=") and params[2:] in ("0", "0.0", "0.00", "0.000"):
+            continue
+        accepted.add(name.strip())
+    if "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+class CompressionMiddleware:
+    """
+    Сжимает ответы JSON, HTML и CSV (brotli или gzip по Accept-Encoding)
+
+    Ответы меньше compression_min_size не сжимаются. Не трогаются ответы с Content-Encoding,
+    части файлов (Range: их смещения относятся к несжатому телу) и события SSE — компрессор
+    задерживал бы их в буфере. Потоковые ответы (отчеты) сжимаются по частям.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and settings.compression_min_size > 0:
+            encoding = _accepted_encoding(Headers(scope=scope).get("accept-encoding", ""))
+            if encoding is not None:
+                await _CompressionResponder(self.app, encoding)(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+class _CompressionResponder:
+    def __init__(self, app: ASGIApp, encoding: str):
+        self.app = app
+        self.encoding = encoding
+        self.send: Send | None = None
+        self.start_message: Message | None = None
+        # None — решение еще не принято (ждем первый блок тела)
+        self.compress: bool | None = None
+        self.compressor = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    def _eligible(self, message: Message) -> bool:
+        headers = Headers(raw=message["headers"])
+        content_type = headers.get("content-type", "").lower()
+        return (
+            message["status"] not in (204, 206, 304)
+            and "content-encoding" not in headers
+            and "content-range" not in headers
+            and content_type.startswith(_COMPRESSIBLE_TYPES)
+        )
+
+    def _compress_body(self, body: bytes) -> bytes:
+        if self.encoding == "br":
+            return brotli.compress(body, quality=settings.compression_brotli_quality)
+        return gzip.compress(body, compresslevel=settings.compression_gzip_level, mtime=0)
+
+    def _start_stream(self) -> None:
+        if self.encoding == "br":
+            self.compressor = brotli.Compressor(quality=settings.compression_brotli_quality)
+        else:
+            # wbits 31 — формат gzip
+            self.compressor = zlib.compressobj(settings.compression_gzip_level, zlib.DEFLATED, 31)
+
+    def _compress_chunk(self, chunk: bytes, last: bool) -> bytes:
+        if self.encoding == "br":
+            data = self.compressor.process(chunk)
+            return data + (self.compressor.finish() if last else self.compressor.flush())
+        data = self.compressor.compress(chunk)
+        # Каждая часть потока уходит клиенту сразу, а не копится в компрессоре
+        return data + self.compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+    def _set_encoding_headers(self, length: int | None) -> None:
+        headers = MutableHeaders(raw=self.start_message["headers"])
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        if length is None:
+            del headers["Content-Length"]
+        else:
+            headers["Content-Length"] = str(length)
+
+    async def send_compressed(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            # Заголовки отправим, когда станет ясно, сжимается ли тело
+            self.start_message = message
+            if not self._eligible(message):
+                self.compress = False
+                await self.send(message)
+            return
+        if message["type"] != "http.response.body" or self.compress is False:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.compress is None:
+            if not more_body:
+                self.compress = len(body) >= settings.compression_min_size
+                if self.compress:
+                    if len(body) > _THREADED_COMPRESSION_SIZE:
+                        body = await run_in_threadpool(self._compress_body, body)
+                    else:
+                        body = self._compress_body(body)
+                    self._set_encoding_headers(len(body))
+                    message = {**message, "body": body}
+                await self.send(self.start_message)
+                await self.send(message)
+                return
+            # Потоковый ответ: размер заранее неизвестен, сжимаем по частям
+            self.compress = True
+            self._start_stream()
+            self._set_encoding_headers(None)
+            await self.send(self.start_message)
+
+        if len(body) > _THREADED_COMPRESSION_SIZE:
+            data = await run_in_threadpool(self._compress_chunk, body, not more_body)
+        else:
+            data = self._compress_chunk(body, not more_body)
+        await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
@@ -0,0 +1,131 @@
+from collections import Counter
+from pathlib import Path
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.session import dialect_insert
+from app.models.blob import Blob
+from app.services.storage import get_storage
+
+# Строк в одном INSERT ... ON CONFLICT, чтобы не упереться в лимит параметров SQLite
+_UPSERT_CHUNK_SIZE = 100
+_IN_CHUNK_SIZE = 500
+
+
+async def add_blob_refs(session: AsyncSession, blobs: list[tuple[str, Path]], keep_source: bool = False) -> None:
+    """
+    Добавляет ссылки на объекты хранилища и переносит в него подготовленные файлы
+
+    Файлы переносятся после UPSERT, то есть под блокировкой записи транзакции: удаление файлов
+    освобожденных объектов (delete_blob_files) не может удалить объект между переносом и фиксацией
+    ссылки. Если транзакция откатится, перенесенный файл останется в хранилище без записи — его
+    уберет сборка мусора; уже учтенные объекты при этом не трогаются. Транзакцию фиксирует
+    вызывающий код.
+
+    Args:
+        blobs: пары (хеш, путь к подготовленному файлу)
+        keep_source: копировать файл, а не перемещать (перенос существующих данных)
+    """
+    if not blobs:
+        return
+    counts = Counter(digest for digest, _ in blobs)
+    sources = dict(blobs)
+    rows = [
+        {"digest": digest, "size": sources[digest].stat().st_size, "ref_count": count}
+        for digest, count in counts.items()
+    ]
+    insert = dialect_insert(session)
+    table = Blob.__table__
+    for i in range(0, len(rows), _UPSERT_CHUNK_SIZE):
+        stmt = insert(table).values(rows[i:i + _UPSERT_CHUNK_SIZE])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["digest"],
+            set_={"ref_count": table.c.ref_count + stmt.excluded.ref_count},
+        )
+        await session.execute(stmt)
+
+    storage = get_storage()
+    for digest, source in sources.items():
+        storage.put(digest, source, keep_source=keep_source)
+    if not keep_source:
+        # Одинаковые файлы одного пакета: в хранилище попал один, остальные копии не нужны
+        for digest, source in blobs:
+            if source != sources[digest]:
+                source.unlink(missing_ok=True)
+
+
+async def release_blob_refs(session: AsyncSession, digests: list[str | None]) -> list[str]:
+    """
+    Снимает ссылки на объекты хранилища и удаляет записи объектов, на которые больше никто не ссылается
+
+    Файлы объектов не трогаются: если транзакция вызывающего кода откатится, записи вернутся,
+    а файлы должны остаться на месте. После фиксации их удаляет delete_blob_files.
+
+    Returns:
+        list: хеши освобожденных объектов
+    """
+    counts = Counter(digest for digest in digests if digest)
+    if not counts:
+        return []
+    # Обычно каждый объект теряет одну ссылку — одно UPDATE на каждое значение уменьшения
+    by_count: dict[int, list[str]] = {}
+    for digest, count in counts.items():
+        by_count.setdefault(count, []).append(digest)
+    for count, group in by_count.items():
+        for i in range(0, len(group), _IN_CHUNK_SIZE):
+            await session.execute(
+                update(Blob)
+                .where(Blob.digest.in_(group[i:i + _IN_CHUNK_SIZE]))
+                .values(ref_count=Blob.ref_count - count)
+            )
+
+    freed: list[str] = []
+    names = list(counts)
+    for i in range(0, len(names), _IN_CHUNK_SIZE):
+        result = await session.execute(
+            delete(Blob)
+            .where(Blob.digest.in_(names[i:i + _IN_CHUNK_SIZE]), Blob.ref_count <= 0)
+            .returning(Blob.digest)
+        )
+        freed.extend(result.scalars().all())
+    return freed
+
+
+async def delete_blob_files(session: AsyncSession, digests: list[str]) -> int:
+    """
+    Удаляет файлы объектов, освобожденных release_blob_refs, после фиксации той транзакции
+
+    Работает в своей транзакции: первая запись берет блокировку записи, поэтому загрузка того же
+    содержимого (add_blob_refs) ждет ее, а объекты, на которые уже снова сослались, пропускаются.
+    Если процесс прервется до удаления, файлы без записей уберет сборка мусора
+    (python -m app.services.storage_migrate --gc).
+
+    Returns:
+        int: сколько файлов удалено
+    """
+    if not digests:
+        return 0
+    referenced: set[str] = set()
+    for i in range(0, len(digests), _IN_CHUNK_SIZE):
+        chunk = digests[i:i + _IN_CHUNK_SIZE]
+        await session.execute(delete(Blob).where(Blob.digest.in_(chunk), Blob.ref_count <= 0))
+        result = await session.execute(select(Blob.digest).where(Blob.digest.in_(chunk)))
+        referenced.update(result.scalars().all())
+    storage = get_storage()
+    deleted = 0
+    for digest in digests:
+        if digest not in referenced:
+            storage.delete(digest)
+            deleted += 1
+    await session.commit()
+    return deleted
+
+
+async def get_blob_digests(session: AsyncSession, digests: list[str]) -> set[str]:
+    """Какие из объектов учтены в таблице blobs"""
+    found: set[str] = set()
+    for i in range(0, len(digests), _IN_CHUNK_SIZE):
+        result = await session.execute(select(Blob.digest).where(Blob.digest.in_(digests[i:i + _IN_CHUNK_SIZE])))
+        found.update(result.scalars().all())
+    return found
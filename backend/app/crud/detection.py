@@ -0,0 +1,158 @@
+from collections import Counter, defaultdict
+
+from sqlalchemy import and_, delete, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.detection import Detection
+from app.models.route import Route
+from app.models.route_file import RouteFile
+from app.services.classes import DEFECT_CLASS_IDS
+from app.services.geo import cell_ranges, haversine_m
+
+# Ограничение на число параметров в одном IN (...) для SQLite
+_IN_CHUNK_SIZE = 500
+# Кандидатов из описанных прямоугольников на страницу при поиске в круге
+_CIRCLE_PAGE_SIZE = 2000
+
+
+def add_detections(session: AsyncSession, route_file: RouteFile, detections: list[dict]) -> None:
+    """Добавляет детекции файла в сессию (без commit); координаты берутся из EXIF кадра"""
+    session.add_all([
+        Detection(
+            file_id=route_file.id,
+            route_id=route_file.route_id,
+            class_id=detection["class_id"],
+            confidence=detection["conf"],
+            x1=float(detection["bbox"][0]),
+            y1=float(detection["bbox"][1]),
+            x2=float(detection["bbox"][2]),
+            y2=float(detection["bbox"][3]),
+            latitude=route_file.latitude,
+            longitude=route_file.longitude,
+            geo_cell=route_file.geo_cell,
+        )
+        for detection in detections
+    ])
+
+
+async def delete_detections_of_files(session: AsyncSession, file_ids: list[str]) -> None:
+    """Удаляет детекции файлов (без commit)"""
+    for i in range(0, len(file_ids), _IN_CHUNK_SIZE):
+        await session.execute(
+            delete(Detection).where(Detection.file_id.in_(file_ids[i:i + _IN_CHUNK_SIZE]))
+        )
+
+
+async def count_detections_by_class(session: AsyncSession, file_ids: list[str]) -> dict[str, Counter]:
+    """Количество детекций каждого класса по файлам"""
+    counts: defaultdict[str, Counter] = defaultdict(Counter)
+    for i in range(0, len(file_ids), _IN_CHUNK_SIZE):
+        result = await session.execute(
+            select(Detection.file_id, Detection.class_id, func.count(Detection.id))
+            .where(Detection.file_id.in_(file_ids[i:i + _IN_CHUNK_SIZE]))
+            .group_by(Detection.file_id, Detection.class_id)
+        )
+        for file_id, class_id, count in result:
+            counts[file_id][class_id] = count
+    return counts
+
+
+async def get_route_detections(session: AsyncSession, route_id: str) -> list[Detection]:
+    """Детекции маршрута, сгруппированные по файлам"""
+    result = await session.execute(
+        select(Detection).where(Detection.route_id == route_id).order_by(Detection.file_id, Detection.id)
+    )
+    return list(result.scalars().all())
+
+
+async def get_route_defects_page(
+    session: AsyncSession,
+    route_id: str,
+    after_id: int = 0,
+    limit: int = 500,
+) -> list[tuple[Detection, RouteFile]]:
+    """
+    Страница детекций повреждений маршрута вместе с файлами, по возрастанию ID детекции
+
+    Детекции одного кадра добавляются вместе, поэтому идут подряд. Следующая страница —
+    after_id = ID последней детекции.
+    """
+    result = await session.execute(
+        select(Detection, RouteFile)
+        .join(RouteFile, Detection.file_id == RouteFile.id)
+        .where(
+            Detection.route_id == route_id,
+            Detection.class_id.in_(DEFECT_CLASS_IDS),
+            Detection.id > after_id,
+        )
+        .order_by(Detection.id)
+        .limit(limit)
+    )
+    return list(result.tuples().all())
+
+
+async def delete_detections_of_route(session: AsyncSession, route_id: str) -> None:
+    await session.execute(delete(Detection).where(Detection.route_id == route_id))
+
+
+async def search_detections(
+    session: AsyncSession,
+    user_id: str,
+    boxes: list[tuple[float, float, float, float]],
+    class_ids: list[int] | None = None,
+    route_id: str | None = None,
+    limit: int = 1000,
+    circle: tuple[float, float, float] | None = None,
+) -> list[tuple[Detection, RouteFile]]:
+    """
+    Детекции пользователя внутри прямоугольников координат (min_lat, min_lon, max_lat, max_lon)
+
+    Кандидаты выбираются по индексу ячеек сетки, затем отсекаются точным сравнением координат.
+    Если задан круг (широта, долгота, радиус в метрах), прямоугольники его покрывают, а точки
+    дальше радиуса отбрасываются здесь: кандидаты читаются страницами по ID, пока не наберется
+    limit детекций внутри круга.
+    """
+    inside_boxes = []
+    for min_lat, min_lon, max_lat, max_lon in boxes:
+        condition = and_(
+            Detection.latitude.between(min_lat, max_lat),
+            Detection.longitude.between(min_lon, max_lon),
+        )
+        ranges = cell_ranges(min_lat, min_lon, max_lat, max_lon)
+        if ranges is not None:
+            condition = and_(condition, or_(*(and_(Detection.geo_cell >= first, Detection.geo_cell <= last)
+                                              for first, last in ranges)))
+        inside_boxes.append(condition)
+
+    stmt = (
+        select(Detection, RouteFile)
+        .join(RouteFile, RouteFile.id == Detection.file_id)
+        .join(Route, Route.id == Detection.route_id)
+        .where(Route.user_id == user_id, or_(*inside_boxes))
+    )
+    if class_ids:
+        stmt = stmt.where(Detection.class_id.in_(class_ids))
+    if route_id is not None:
+        stmt = stmt.where(Detection.route_id == route_id)
+
+    if circle is None:
+        result = await session.execute(stmt.order_by(Detection.id).limit(limit))
+        return list(result.tuples().all())
+
+    latitude, longitude, radius_m = circle
+    page_size = max(limit, _CIRCLE_PAGE_SIZE)
+    rows: list[tuple[Detection, RouteFile]] = []
+    after_id = 0
+    while True:
+        result = await session.execute(
+            stmt.where(Detection.id > after_id).order_by(Detection.id).limit(page_size)
+        )
+        page = result.tuples().all()
+        for detection, route_file in page:
+            if haversine_m(latitude, longitude, detection.latitude, detection.longitude) <= radius_m:
+                rows.append((detection, route_file))
+                if len(rows) == limit:
+                    return rows
+        if len(page) < page_size:
+            return rows
+        after_id = page[-1][0].id
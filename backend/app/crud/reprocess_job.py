@@ -0,0 +1,147 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.utils import generate_uuid
+from app.db.session import dialect_insert
+from app.models.reprocess_job import ReprocessJob, RouteLock
+
+ACTIVE_STATUSES = ("pending", "running")
+# Сколько завершенных задач пользователя хранится для просмотра
+_KEPT_FINISHED_JOBS = 50
+
+
+def _stale_before() -> datetime:
+    return datetime.utcnow() - timedelta(seconds=settings.route_lock_timeout)
+
+
+async def expire_stale_jobs(session: AsyncSession) -> None:
+    """
+    Снимает блокировки без heartbeat и помечает прерванными их задачи
+
+    Такие блокировки оставил процесс, остановленный посреди обработки. Запись выполняется
+    только если брошенные блокировки или задачи есть, поэтому чтение списка задач обычно
+    не берет блокировку записи.
+    """
+    cutoff = _stale_before()
+    stale_jobs = await session.scalar(
+        select(ReprocessJob.id)
+        .where(ReprocessJob.status.in_(ACTIVE_STATUSES), ReprocessJob.heartbeat_at < cutoff)
+        .limit(1)
+    )
+    stale_locks = await session.scalar(select(RouteLock.route_id).where(RouteLock.heartbeat_at < cutoff).limit(1))
+    if stale_jobs is None and stale_locks is None:
+        return
+    await session.execute(delete(RouteLock).where(RouteLock.heartbeat_at < cutoff))
+    await session.execute(
+        update(ReprocessJob)
+        .where(ReprocessJob.status.in_(ACTIVE_STATUSES), ReprocessJob.heartbeat_at < cutoff)
+        .values(status="failed", error="Задача прервана: процесс остановлен", finished_at=datetime.utcnow())
+    )
+    await session.commit()
+
+
+async def acquire_route_locks(session: AsyncSession, owner: str, route_ids: list[str]) -> bool:
+    """
+    Блокирует маршруты для owner (без commit)
+
+    Returns:
+        bool: False, если часть маршрутов уже заблокирована; тогда транзакцию нужно откатить
+    """
+    route_ids = sorted(set(route_ids))
+    if not route_ids:
+        return True
+    insert = dialect_insert(session)
+    stmt = (
+        insert(RouteLock)
+        .values([{"route_id": route_id, "owner": owner, "heartbeat_at": datetime.utcnow()} for route_id in route_ids])
+        .on_conflict_do_nothing(index_elements=["route_id"])
+        .returning(RouteLock.route_id)
+    )
+    acquired = (await session.execute(stmt)).scalars().all()
+    return len(acquired) == len(route_ids)
+
+
+async def touch_route_locks(session: AsyncSession, owner: str) -> int:
+    """Обновляет heartbeat блокировок owner (без commit); 0 — блокировки сняты как брошенные"""
+    result = await session.execute(
+        update(RouteLock).where(RouteLock.owner == owner).values(heartbeat_at=datetime.utcnow())
+    )
+    return result.rowcount
+
+
+async def release_route_locks(session: AsyncSession, owner: str) -> None:
+    """Снимает блокировки owner (без commit)"""
+    await session.execute(delete(RouteLock).where(RouteLock.owner == owner))
+
+
+async def create_reprocess_job(
+    session: AsyncSession,
+    user_id: str,
+    route_ids: list[str],
+    file_ids: list[str] | None = None,
+    file_filter: str | None = None,
+) -> ReprocessJob | None:
+    """
+    Создает задачу и блокирует ее маршруты одной транзакцией
+
+    Returns:
+        ReprocessJob или None, если часть маршрутов уже обрабатывается
+    """
+    await expire_stale_jobs(session)
+    job = ReprocessJob(
+        id=generate_uuid(),
+        user_id=user_id,
+        route_ids=route_ids,
+        file_ids=file_ids,
+        file_filter=file_filter,
+        status="pending",
+        total=0,
+        processed=0,
+        skipped=0,
+        failed=0,
+        heartbeat_at=datetime.utcnow(),
+    )
+    if not await acquire_route_locks(session, job.id, route_ids):
+        await session.rollback()
+        return None
+    session.add(job)
+
+    # Старые завершенные задачи пользователя больше не показываются
+    kept = (
+        select(ReprocessJob.id)
+        .where(ReprocessJob.user_id == user_id, ReprocessJob.status.not_in(ACTIVE_STATUSES))
+        .order_by(ReprocessJob.created_at.desc())
+        .limit(_KEPT_FINISHED_JOBS)
+    )
+    await session.execute(
+        delete(ReprocessJob).where(
+            ReprocessJob.user_id == user_id,
+            ReprocessJob.status.not_in(ACTIVE_STATUSES),
+            ReprocessJob.id.not_in(kept),
+        )
+    )
+    await session.commit()
+    return job
+
+
+async def update_reprocess_job(session: AsyncSession, job_id: str, **values) -> None:
+    """Сохраняет состояние задачи и обновляет ее heartbeat (без commit)"""
+    await session.execute(
+        update(ReprocessJob).where(ReprocessJob.id == job_id).values(heartbeat_at=datetime.utcnow(), **values)
+    )
+
+
+async def get_reprocess_job(session: AsyncSession, job_id: str, user_id: str) -> ReprocessJob | None:
+    return await session.scalar(
+        select(ReprocessJob).where(ReprocessJob.id == job_id, ReprocessJob.user_id == user_id)
+    )
+
+
+async def list_reprocess_jobs(session: AsyncSession, user_id: str) -> list[ReprocessJob]:
+    result = await session.execute(
+        select(ReprocessJob).where(ReprocessJob.user_id == user_id).order_by(ReprocessJob.created_at)
+    )
+    return list(result.scalars().all())
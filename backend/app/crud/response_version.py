@@ -0,0 +1,40 @@
+from collections.abc import Iterable
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.session import dialect_insert
+from app.models.response_version import ResponseVersion
+
+
+def route_scope(route_id: str) -> str:
+    return f"route:{route_id}"
+
+
+def user_scope(user_id: str) -> str:
+    return f"user:{user_id}"
+
+
+async def bump_response_versions(session: AsyncSession, user_id: str, route_ids: Iterable[str] = ()) -> None:
+    """
+    Меняет версии ответов пользователя и перечисленных маршрутов (без commit)
+
+    Вызывается в транзакции, которая меняет данные: закэшированные ответы и выданные ETag
+    перестают совпадать с версией сразу после фиксации.
+    """
+    # Одинаковый порядок строк во всех транзакциях — без взаимных блокировок в PostgreSQL
+    scopes = sorted({user_scope(user_id), *(route_scope(route_id) for route_id in route_ids)})
+    insert = dialect_insert(session)
+    table = ResponseVersion.__table__
+    stmt = insert(table).values([{"scope": scope, "version": 1} for scope in scopes])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["scope"],
+        set_={"version": table.c.version + 1},
+    )
+    await session.execute(stmt)
+
+
+async def get_response_version(session: AsyncSession, scope: str) -> int:
+    """Текущая версия; 0 — данные не менялись с появления версий"""
+    version = await session.scalar(select(ResponseVersion.version).where(ResponseVersion.scope == scope))
+    return version or 0
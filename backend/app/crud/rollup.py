@@ -0,0 +1,245 @@
+from collections import Counter, defaultdict
+from datetime import date, datetime
+
+from sqlalchemy import case, delete, distinct, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.crud.response_version import bump_response_versions
+from app.db.session import dialect_insert
+from app.models.detection import Detection
+from app.models.rollup import ClassDayRollup, RouteDayRollup
+from app.models.route import Route
+from app.models.route_file import RouteFile
+
+# Строк в одном INSERT ... ON CONFLICT, чтобы не упереться в лимит параметров SQLite
+_UPSERT_CHUNK_SIZE = 100
+
+_ROUTE_COUNTERS = ("image_count", "processed_count", "defect_image_count", "detection_count")
+_CLASS_COUNTERS = ("detection_count", "image_count")
+
+
+def rollup_day(route_file: RouteFile) -> date:
+    """День, к которому относится файл в сводках: дата съемки из EXIF, иначе дата загрузки"""
+    if route_file.created_at is None:
+        # Проставляем время загрузки заранее, чтобы день в сводке совпал с сохраненным значением
+        route_file.created_at = datetime.utcnow()
+    return (route_file.taken_at or route_file.created_at).date()
+
+
+class RollupDelta:
+    """Изменения сводок пользователя, накопленные за транзакцию"""
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.days: defaultdict[tuple[str, date], list[int]] = defaultdict(lambda: [0] * len(_ROUTE_COUNTERS))
+        self.classes: defaultdict[tuple[str, date, int], list[int]] = defaultdict(
+            lambda: [0] * len(_CLASS_COUNTERS)
+        )
+
+    def add(self, route_file: RouteFile, class_counts: dict[int, int], sign: int = 1) -> None:
+        """Учитывает файл (sign=1) или снимает его вклад (sign=-1) с текущими значениями полей"""
+        day = rollup_day(route_file)
+        counters = self.days[(route_file.route_id, day)]
+        counters[0] += sign
+        counters[1] += sign if route_file.is_processed else 0
+        counters[2] += sign if (route_file.red_detection_count or 0) > 0 else 0
+        counters[3] += sign * (route_file.total_detections or 0)
+        for class_id, count in class_counts.items():
+            if count:
+                class_counters = self.classes[(route_file.route_id, day, class_id)]
+                class_counters[0] += sign * count
+                class_counters[1] += sign
+
+    def remove(self, route_file: RouteFile, class_counts: dict[int, int]) -> None:
+        self.add(route_file, class_counts, sign=-1)
+
+
+def count_classes(detections: list[dict]) -> Counter:
+    """Количество детекций по классам для результата обработки изображения"""
+    return Counter(detection["class_id"] for detection in detections)
+
+
+async def _upsert(session: AsyncSession, model, keys: tuple[str, ...], counters: tuple[str, ...],
+                  rows: list[dict]) -> None:
+    insert = dialect_insert(session)
+    table = model.__table__
+    for i in range(0, len(rows), _UPSERT_CHUNK_SIZE):
+        stmt = insert(table).values(rows[i:i + _UPSERT_CHUNK_SIZE])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={name: table.c[name] + stmt.excluded[name] for name in counters},
+        )
+        await session.execute(stmt)
+
+
+async def apply_rollup_delta(session: AsyncSession, delta: RollupDelta) -> None:
+    """Применяет накопленные изменения к сводкам и меняет версии ответов затронутых маршрутов (без commit)"""
+    day_rows = [
+        {"route_id": route_id, "day": day, "user_id": delta.user_id, **dict(zip(_ROUTE_COUNTERS, counters))}
+        for (route_id, day), counters in delta.days.items()
+        if any(counters)
+    ]
+    class_rows = [
+        {"route_id": route_id, "day": day, "class_id": class_id, "user_id": delta.user_id,
+         **dict(zip(_CLASS_COUNTERS, counters))}
+        for (route_id, day, class_id), counters in delta.classes.items()
+        if any(counters)
+    ]
+    if day_rows:
+        await _upsert(session, RouteDayRollup, ("route_id", "day"), _ROUTE_COUNTERS, day_rows)
+    if class_rows:
+        await _upsert(session, ClassDayRollup, ("route_id", "day", "class_id"), _CLASS_COUNTERS, class_rows)
+
+    # Через сводки проходит любое изменение файлов: здесь же меняются версии кэшируемых ответов
+    route_ids = {route_id for route_id, _ in delta.days} | {route_id for route_id, _, _ in delta.classes}
+    if route_ids:
+        await bump_response_versions(session, delta.user_id, route_ids)
+
+    # Дни и классы, из которых ушли все изображения, больше не нужны
+    for route_id in {route_id for route_id, _ in delta.days}:
+        await session.execute(
+            delete(RouteDayRollup).where(RouteDayRollup.route_id == route_id, RouteDayRollup.image_count <= 0)
+        )
+    for route_id in {route_id for route_id, _, _ in delta.classes}:
+        await session.execute(
+            delete(ClassDayRollup).where(ClassDayRollup.route_id == route_id, ClassDayRollup.image_count <= 0)
+        )
+
+
+async def delete_rollups_of_route(session: AsyncSession, route_id: str) -> None:
+    await session.execute(delete(ClassDayRollup).where(ClassDayRollup.route_id == route_id))
+    await session.execute(delete(RouteDayRollup).where(RouteDayRollup.route_id == route_id))
+
+
+async def rollups_need_rebuild(session: AsyncSession) -> bool:
+    """Сводки пусты, хотя файлы уже есть — база создана до появления сводок"""
+    has_rollups = await session.scalar(select(RouteDayRollup.route_id).limit(1))
+    if has_rollups is not None:
+        return False
+    return await session.scalar(select(RouteFile.id).limit(1)) is not None
+
+
+async def rebuild_rollups(session: AsyncSession) -> None:
+    """Пересчитывает все сводки по таблицам route_files и detections"""
+    await session.execute(delete(ClassDayRollup))
+    await session.execute(delete(RouteDayRollup))
+
+    day = func.date(func.coalesce(RouteFile.taken_at, RouteFile.created_at))
+    result = await session.execute(
+        select(
+            Route.user_id,
+            RouteFile.route_id,
+            day,
+            func.count(RouteFile.id),
+            func.sum(case((RouteFile.is_processed.is_(True), 1), else_=0)),
+            func.sum(case((RouteFile.red_detection_count > 0, 1), else_=0)),
+            func.sum(RouteFile.total_detections),
+        )
+        .join(Route, Route.id == RouteFile.route_id)
+        .group_by(Route.user_id, RouteFile.route_id, day)
+    )
+    day_rows = [
+        {"user_id": user_id, "route_id": route_id, "day": date.fromisoformat(str(row_day)),
+         **dict(zip(_ROUTE_COUNTERS, counters))}
+        for user_id, route_id, row_day, *counters in result.all()
+    ]
+
+    result = await session.execute(
+        select(
+            Route.user_id,
+            Detection.route_id,
+            day,
+            Detection.class_id,
+            func.count(Detection.id),
+            func.count(distinct(Detection.file_id)),
+        )
+        .join(RouteFile, RouteFile.id == Detection.file_id)
+        .join(Route, Route.id == Detection.route_id)
+        .group_by(Route.user_id, Detection.route_id, day, Detection.class_id)
+    )
+    class_rows = [
+        {"user_id": user_id, "route_id": route_id, "day": date.fromisoformat(str(row_day)), "class_id": class_id,
+         **dict(zip(_CLASS_COUNTERS, counters))}
+        for user_id, route_id, row_day, class_id, *counters in result.all()
+    ]
+
+    for i in range(0, len(day_rows), _UPSERT_CHUNK_SIZE):
+        await session.execute(RouteDayRollup.__table__.insert(), day_rows[i:i + _UPSERT_CHUNK_SIZE])
+    for i in range(0, len(class_rows), _UPSERT_CHUNK_SIZE):
+        await session.execute(ClassDayRollup.__table__.insert(), class_rows[i:i + _UPSERT_CHUNK_SIZE])
+    await session.commit()
+
+
+async def get_user_summary(
+    session: AsyncSession,
+    user_id: str,
+    date_from: date | None = None,
+    date_to: date | None = None,
+    top_routes: int = 10,
+) -> dict:
+    """
+    Сводка по всем маршрутам пользователя, собранная из предагрегированных таблиц
+
+    Стоимость запроса зависит от числа маршрутов и дней, а не от числа изображений.
+    """
+    day_filter = [RouteDayRollup.user_id == user_id]
+    class_filter = [ClassDayRollup.user_id == user_id]
+    if date_from is not None:
+        day_filter.append(RouteDayRollup.day >= date_from)
+        class_filter.append(ClassDayRollup.day >= date_from)
+    if date_to is not None:
+        day_filter.append(RouteDayRollup.day <= date_to)
+        class_filter.append(ClassDayRollup.day <= date_to)
+
+    sums = [func.coalesce(func.sum(getattr(RouteDayRollup, name)), 0) for name in _ROUTE_COUNTERS]
+
+    totals = (await session.execute(select(*sums).where(*day_filter))).one()
+    route_count = await session.scalar(select(func.count(Route.id)).where(Route.user_id == user_id))
+
+    daily = (
+        await session.execute(
+            select(RouteDayRollup.day, *sums)
+            .where(*day_filter)
+            .group_by(RouteDayRollup.day)
+            .order_by(RouteDayRollup.day)
+        )
+    ).all()
+
+    defect_images = sums[2]
+    routes = (
+        await session.execute(
+            select(Route.id, Route.name, *sums)
+            .select_from(RouteDayRollup)
+            .join(Route, Route.id == RouteDayRollup.route_id)
+            .where(*day_filter)
+            .group_by(Route.id, Route.name)
+            .order_by(defect_images.desc(), Route.name)
+            .limit(top_routes)
+        )
+    ).all()
+
+    classes = (
+        await session.execute(
+            select(
+                ClassDayRollup.class_id,
+                func.sum(ClassDayRollup.detection_count),
+                func.sum(ClassDayRollup.image_count),
+            )
+            .where(*class_filter)
+            .group_by(ClassDayRollup.class_id)
+            .order_by(ClassDayRollup.class_id)
+        )
+    ).all()
+
+    return {
+        "route_count": route_count or 0,
+        "totals": dict(zip(_ROUTE_COUNTERS, totals)),
+        "classes": [
+            {"class_id": class_id, "detection_count": detection_count, "image_count": image_count}
+            for class_id, detection_count, image_count in classes
+        ],
+        "daily": [{"day": row[0], **dict(zip(_ROUTE_COUNTERS, row[1:]))} for row in daily],
+        "top_routes": [
+            {"route_id": row[0], "name": row[1], **dict(zip(_ROUTE_COUNTERS, row[2:]))} for row in routes
+        ],
+    }
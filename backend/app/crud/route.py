@@ -1,8 +1,16 @@
-from sqlalchemy import select
+from datetime import datetime
+
+from sqlalchemy import case, func, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.utils import generate_uuid
+from app.crud.response_version import bump_response_versions
+from app.crud.blob import delete_blob_files
+from app.crud.route_file import delete_files_of_route
 from app.models.route import Route
+from app.models.route_file import RouteFile
+
+ROUTE_SORT_FIELDS = ("name", "file_count", "defect_count", "last_upload_at")
 
 
 async def create_route(session: AsyncSession, name: str, user_id: str, description: str | None = None) -> Route:
@@ -13,6 +21,7 @@ async def create_route(session: AsyncSession, name: str, user_id: str, descripti
         user_id=user_id,
     )
     session.add(route)
+    await bump_response_versions(session, user_id)
     await session.commit()
     await session.refresh(route)
     return route
@@ -25,6 +34,65 @@ async def get_routes_by_user(session: AsyncSession, user_id: str) -> list[Route]
     return list(result.scalars().all())
 
 
+async def get_routes_with_stats(
+    session: AsyncSession,
+    user_id: str,
+    limit: int | None = None,
+    offset: int = 0,
+    sort: str = "name",
+) -> tuple[list[tuple[Route, int, int, datetime | None]], int]:
+    """
+    Маршруты пользователя со сводкой по файлам, посчитанной одним агрегирующим запросом
+
+    Returns:
+        Tuple содержащий:
+        - список (route, file_count, defect_count, last_upload_at)
+        - общее количество маршрутов пользователя
+    """
+    descending = sort.startswith("-")
+    field = sort.lstrip("-")
+    if field not in ROUTE_SORT_FIELDS:
+        raise ValueError(f"Недопустимое поле сортировки: {sort}")
+
+    file_count = func.count(RouteFile.id).label("file_count")
+    defect_count = func.coalesce(
+        func.sum(case((RouteFile.red_detection_count > 0, 1), else_=0)), 0
+    ).label("defect_count")
+    last_upload_at = func.max(RouteFile.created_at).label("last_upload_at")
+    total = func.count().over().label("total")
+
+    order_column = {
+        "name": Route.name,
+        "file_count": file_count,
+        "defect_count": defect_count,
+        "last_upload_at": last_upload_at,
+    }[field]
+    order_by = order_column.desc() if descending else order_column.asc()
+
+    stmt = (
+        select(Route, file_count, defect_count, last_upload_at, total)
+        .outerjoin(RouteFile, RouteFile.route_id == Route.id)
+        .where(Route.user_id == user_id)
+        .group_by(Route.id)
+        .order_by(order_by, Route.id)
+        .offset(offset)
+    )
+    if limit is not None:
+        stmt = stmt.limit(limit)
+
+    rows = (await session.execute(stmt)).all()
+    if rows:
+        total_count = rows[0].total
+    elif offset:
+        total_count = await session.scalar(
+            select(func.count(Route.id)).where(Route.user_id == user_id)
+        )
+    else:
+        total_count = 0
+
+    return [(row[0], row[1], row[2], row[3]) for row in rows], total_count
+
+
 async def get_route_by_id(session: AsyncSession, route_id: str, user_id: str) -> Route | None:
     result = await session.execute(
         select(Route).where(Route.id == route_id, Route.user_id == user_id)
@@ -48,6 +116,7 @@ async def update_route(
     if description is not None:
         route.description = description
     
+    await bump_response_versions(session, user_id)
     await session.commit()
     await session.refresh(route)
     return route
@@ -56,8 +125,11 @@ async def update_route(
 async def delete_route(session: AsyncSession, route_id: str, user_id: str) -> bool:
     route = await get_route_by_id(session, route_id, user_id)
     if route:
+        freed = await delete_files_of_route(session, route_id)
         await session.delete(route)
+        # Версия удаленного маршрута остается: выданные ETag больше не совпадут
+        await bump_response_versions(session, user_id, [route_id])
         await session.commit()
+        await delete_blob_files(session, freed)
         return True
     return False
-
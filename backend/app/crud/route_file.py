@@ -0,0 +1,317 @@
+from sqlalchemy import case, delete, func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.crud.blob import add_blob_refs, delete_blob_files, release_blob_refs
+from app.crud.detection import (
+    add_detections,
+    count_detections_by_class,
+    delete_detections_of_files,
+    delete_detections_of_route,
+)
+from app.crud.rollup import RollupDelta, apply_rollup_delta, count_classes, delete_rollups_of_route
+from app.models.route import Route
+from app.models.route_file import RouteFile
+from app.services.storage import staged_blobs
+
+# Ограничение на число параметров в одном IN (...) для SQLite
+_IN_CHUNK_SIZE = 500
+
+
+async def get_route_files(session: AsyncSession, route_id: str, processed_only: bool = False) -> list[RouteFile]:
+    stmt = select(RouteFile).where(RouteFile.route_id == route_id)
+    if processed_only:
+        stmt = stmt.where(RouteFile.is_processed.is_(True))
+    result = await session.execute(stmt.order_by(RouteFile.created_at, RouteFile.id))
+    return list(result.scalars().all())
+
+
+async def replace_route_file(
+    session: AsyncSession,
+    route_file: RouteFile,
+    user_id: str,
+    detections: list[dict] | None = None,
+) -> list[tuple[str, str]]:
+    """
+    Сохраняет файл маршрута и его детекции, удаляя в той же транзакции запись с тем же именем
+
+    Транзакция начинается с DELETE, поэтому SQLite сразу берет блокировку записи
+    и параллельные загрузки одного и того же имени выполняются по очереди.
+    Сводки пользователя и ссылки на объекты хранилища обновляются в той же транзакции:
+    файлы записей с хешами переносятся из директории маршрута в хранилище.
+
+    Returns:
+        list: пары (file_id, file_ext) замененных записей — их файлы нужно удалить с диска
+    """
+    return await replace_route_files(session, [(route_file, detections or [])], user_id)
+
+
+async def replace_route_files(
+    session: AsyncSession,
+    items: list[tuple[RouteFile, list[dict]]],
+    user_id: str,
+) -> list[tuple[str, str]]:
+    """
+    Пакетный вариант replace_route_file: все файлы одного маршрута сохраняются одной транзакцией
+
+    Returns:
+        list: пары (file_id, file_ext) замененных записей — их файлы нужно удалить с диска
+    """
+    if not items:
+        return []
+    route_id = items[0][0].route_id
+    # Из одноименных файлов пакета остается последний
+    by_name = {route_file.original_name: (route_file, detections) for route_file, detections in items}
+    names = list(by_name)
+
+    replaced_rows = []
+    for i in range(0, len(names), _IN_CHUNK_SIZE):
+        result = await session.execute(
+            delete(RouteFile)
+            .where(RouteFile.route_id == route_id, RouteFile.original_name.in_(names[i:i + _IN_CHUNK_SIZE]))
+            .returning(
+                RouteFile.id,
+                RouteFile.file_ext,
+                RouteFile.created_at,
+                RouteFile.taken_at,
+                RouteFile.is_processed,
+                RouteFile.red_detection_count,
+                RouteFile.total_detections,
+                RouteFile.original_hash,
+                RouteFile.processed_hash,
+            )
+        )
+        replaced_rows.extend(result.all())
+
+    delta = RollupDelta(user_id)
+    if replaced_rows:
+        replaced_ids = [row.id for row in replaced_rows]
+        class_counts = await count_detections_by_class(session, replaced_ids)
+        await delete_detections_of_files(session, replaced_ids)
+        for row in replaced_rows:
+            delta.remove(RouteFile(route_id=route_id, **row._asdict()), class_counts.get(row.id, {}))
+
+    blobs = []
+    for route_file, detections in by_name.values():
+        session.add(route_file)
+        if detections:
+            add_detections(session, route_file, detections)
+        delta.add(route_file, count_classes(detections))
+        blobs.extend(staged_blobs(route_file))
+    await apply_rollup_delta(session, delta)
+    # Сначала новые ссылки, затем снятие старых: повторная загрузка того же содержимого
+    # не удаляет и не переносит объект заново
+    await add_blob_refs(session, blobs)
+    freed = await release_blob_refs(session, _file_hashes(replaced_rows))
+    await session.commit()
+    await delete_blob_files(session, freed)
+
+    # Одноименные файлы внутри пакета тоже заменены — их файлы на диске не нужны
+    kept = {route_file.id for route_file, _ in by_name.values()}
+    dropped = [(route_file.id, route_file.file_ext) for route_file, _ in items if route_file.id not in kept]
+    return [(row.id, row.file_ext) for row in replaced_rows] + dropped
+
+
+def _file_hashes(rows) -> list[str | None]:
+    return [digest for row in rows for digest in (row.original_hash, row.processed_hash)]
+
+
+async def get_route_file_names(session: AsyncSession, route_id: str, processed_only: bool = False) -> set[str]:
+    """Имена файлов маршрута без загрузки самих записей"""
+    stmt = select(RouteFile.original_name).where(RouteFile.route_id == route_id)
+    if processed_only:
+        stmt = stmt.where(RouteFile.is_processed.is_(True))
+    return set((await session.scalars(stmt)).all())
+
+
+async def get_route_file(session: AsyncSession, route_id: str, file_id: str) -> RouteFile | None:
+    result = await session.execute(
+        select(RouteFile).where(RouteFile.id == file_id, RouteFile.route_id == route_id)
+    )
+    return result.scalar_one_or_none()
+
+
+async def delete_route_file(session: AsyncSession, route_id: str, file_id: str, user_id: str) -> RouteFile | None:
+    route_file = await get_route_file(session, route_id, file_id)
+    if route_file:
+        class_counts = await count_detections_by_class(session, [route_file.id])
+        await delete_detections_of_files(session, [route_file.id])
+        delta = RollupDelta(user_id)
+        delta.remove(route_file, class_counts.get(route_file.id, {}))
+        await apply_rollup_delta(session, delta)
+        await session.delete(route_file)
+        freed = await release_blob_refs(session, _file_hashes([route_file]))
+        await session.commit()
+        await delete_blob_files(session, freed)
+    return route_file
+
+
+async def lock_route_files(session: AsyncSession, file_ids: list[str]) -> set[str]:
+    """
+    Какие из файлов еще существуют; начинает транзакцию записи (без commit)
+
+    UPDATE без изменений берет блокировку записи SQLite, поэтому до commit файлы
+    не удалит и не заменит параллельная загрузка.
+    """
+    found: set[str] = set()
+    for i in range(0, len(file_ids), _IN_CHUNK_SIZE):
+        result = await session.execute(
+            update(RouteFile)
+            .where(RouteFile.id.in_(file_ids[i:i + _IN_CHUNK_SIZE]))
+            .values(id=RouteFile.id)
+            .returning(RouteFile.id)
+            .execution_options(synchronize_session=False)
+        )
+        found.update(result.scalars().all())
+    return found
+
+
+async def select_route_files(
+    session: AsyncSession,
+    route_id: str,
+    file_ids: list[str] | None = None,
+    file_filter: str | None = None,
+    model_version: str | None = None,
+) -> list[RouteFile]:
+    """
+    Файлы маршрута по списку идентификаторов или по именованному фильтру
+
+    model_version — текущая версия модели, нужна для фильтра outdated_model.
+    """
+    if file_ids is not None:
+        route_files: list[RouteFile] = []
+        unique_ids = list(dict.fromkeys(file_ids))
+        for i in range(0, len(unique_ids), _IN_CHUNK_SIZE):
+            result = await session.execute(
+                select(RouteFile).where(
+                    RouteFile.route_id == route_id,
+                    RouteFile.id.in_(unique_ids[i:i + _IN_CHUNK_SIZE]),
+                )
+            )
+            route_files.extend(result.scalars().all())
+        return route_files
+
+    stmt = select(RouteFile).where(RouteFile.route_id == route_id)
+    if file_filter == "no_detections":
+        stmt = stmt.where(RouteFile.is_processed.is_(True), RouteFile.total_detections == 0)
+    elif file_filter == "no_defects":
+        stmt = stmt.where(RouteFile.is_processed.is_(True), RouteFile.red_detection_count == 0)
+    elif file_filter == "with_defects":
+        stmt = stmt.where(RouteFile.red_detection_count > 0)
+    elif file_filter == "unprocessed":
+        stmt = stmt.where(RouteFile.is_processed.is_(False))
+    elif file_filter == "outdated_model":
+        if model_version is None:
+            raise ValueError("Модель не загружена: текущая версия неизвестна")
+        stmt = stmt.where(
+            RouteFile.is_processed.is_(True),
+            or_(RouteFile.model_version.is_(None), RouteFile.model_version != model_version),
+        )
+    elif file_filter != "all":
+        raise ValueError(f"Неизвестный фильтр файлов: {file_filter}")
+    result = await session.execute(stmt.order_by(RouteFile.created_at, RouteFile.id))
+    return list(result.scalars().all())
+
+
+async def delete_route_files(
+    session: AsyncSession,
+    route_id: str,
+    route_files: list[RouteFile],
+    user_id: str,
+) -> None:
+    """Удаляет записи о файлах маршрута, их вклад в сводки и ссылки на хранилище одной транзакцией"""
+    file_ids = [route_file.id for route_file in route_files]
+    class_counts = await count_detections_by_class(session, file_ids)
+    delta = RollupDelta(user_id)
+    for route_file in route_files:
+        delta.remove(route_file, class_counts.get(route_file.id, {}))
+    await delete_detections_of_files(session, file_ids)
+    for i in range(0, len(file_ids), _IN_CHUNK_SIZE):
+        await session.execute(
+            delete(RouteFile).where(
+                RouteFile.route_id == route_id,
+                RouteFile.id.in_(file_ids[i:i + _IN_CHUNK_SIZE]),
+            )
+        )
+    await apply_rollup_delta(session, delta)
+    freed = await release_blob_refs(session, _file_hashes(route_files))
+    await session.commit()
+    await delete_blob_files(session, freed)
+
+
+async def delete_duplicate_route_files(session: AsyncSession) -> list[tuple[str, str, str]]:
+    """
+    Удаляет одноименные файлы маршрутов, оставляя последний загруженный
+
+    Нужно перед созданием уникального индекса (route_id, original_name) в базе, где он
+    не применялся. Сводки и ссылки на хранилище обновляются как при обычном удалении.
+
+    Returns:
+        list: тройки (route_id, file_id, file_ext) удаленных записей — их файлы нужно удалить с диска
+    """
+    result = await session.execute(
+        select(RouteFile.route_id, RouteFile.original_name, Route.user_id)
+        .join(Route, Route.id == RouteFile.route_id)
+        .group_by(RouteFile.route_id, RouteFile.original_name, Route.user_id)
+        .having(func.count() > 1)
+    )
+    removed: list[tuple[str, str, str]] = []
+    for route_id, original_name, user_id in result.all():
+        rows = await session.execute(
+            select(RouteFile)
+            .where(RouteFile.route_id == route_id, RouteFile.original_name == original_name)
+            .order_by(RouteFile.created_at.desc(), RouteFile.id.desc())
+        )
+        stale = list(rows.scalars().all())[1:]
+        await delete_route_files(session, route_id, stale, user_id)
+        removed.extend((route_id, route_file.id, route_file.file_ext) for route_file in stale)
+    return removed
+
+
+async def delete_files_of_route(session: AsyncSession, route_id: str) -> list[str]:
+    """
+    Удаляет файлы маршрута без commit
+
+    Returns:
+        list: хеши освобожденных объектов — их файлы удаляет delete_blob_files после фиксации
+    """
+    await delete_rollups_of_route(session, route_id)
+    await delete_detections_of_route(session, route_id)
+    result = await session.execute(
+        delete(RouteFile)
+        .where(RouteFile.route_id == route_id)
+        .returning(RouteFile.original_hash, RouteFile.processed_hash)
+    )
+    return await release_blob_refs(session, _file_hashes(result.all()))
+
+
+async def get_route_file_stats(session: AsyncSession, route_id: str) -> dict[str, int]:
+    """Статистика по обработанным изображениям маршрута одним запросом"""
+    with_detections = RouteFile.total_detections > 0
+    result = await session.execute(
+        select(
+            func.count(RouteFile.id),
+            func.coalesce(
+                func.sum(case((with_detections & (RouteFile.red_detection_count > 0), 1), else_=0)), 0
+            ),
+            func.coalesce(
+                func.sum(
+                    case(
+                        (
+                            with_detections
+                            & (RouteFile.red_detection_count == 0)
+                            & (RouteFile.green_detection_count > 0),
+                            1,
+                        ),
+                        else_=0,
+                    )
+                ),
+                0,
+            ),
+        ).where(RouteFile.route_id == route_id, RouteFile.is_processed.is_(True))
+    )
+    total_processed, with_red, with_green = result.one()
+    return {
+        "total_processed": total_processed,
+        "with_green_detections": with_green,
+        "with_red_detections": with_red,
+    }
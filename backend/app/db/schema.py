@@ -0,0 +1,57 @@
+from sqlalchemy import Index, inspect, text
+from sqlalchemy.engine import Connection
+
+from app.db.base import Base
+
+# Индексы, замененные индексами с другим именем: (таблица, имя)
+_OBSOLETE_INDEXES = [
+    ("route_files", "ix_route_files_route_id_original_name"),
+]
+
+
+def sync_schema(connection: Connection) -> list[Index]:
+    """
+    Создает недостающие таблицы, а в существующих — недостающие колонки и индексы
+
+    Миграций в проекте нет, поэтому новые колонки добавляются через ALTER TABLE ADD COLUMN.
+    Такие колонки должны быть nullable или иметь server_default.
+
+    Returns:
+        list: недостающие уникальные индексы существующих таблиц — их создает create_indexes
+            после удаления нарушающих их строк
+    """
+    existing_tables = set(inspect(connection).get_table_names())
+    Base.metadata.create_all(connection)
+
+    for table_name, index_name in _OBSOLETE_INDEXES:
+        if table_name in existing_tables:
+            connection.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+
+    pending: list[Index] = []
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_type = column.type.compile(dialect=connection.dialect)
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+            if column.server_default is not None:
+                ddl += f" DEFAULT {column.server_default.arg}"
+            connection.execute(text(ddl))
+
+        existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            if index.unique:
+                pending.append(index)
+            else:
+                index.create(connection)
+    return pending
+
+
+def create_indexes(connection: Connection, indexes: list[Index]) -> None:
+    for index in indexes:
+        index.create(connection)
+
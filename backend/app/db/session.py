@@ -1,5 +1,6 @@
 from collections.abc import AsyncIterator
 
+from sqlalchemy import event, text
 from sqlalchemy.ext.asyncio import (
     AsyncSession,
     async_sessionmaker,
@@ -17,9 +18,38 @@ AsyncSessionLocal = async_sessionmaker(
     expire_on_commit=False,
 )
 
+is_sqlite = engine.dialect.name == "sqlite"
+
+if is_sqlite:
+    @event.listens_for(engine.sync_engine, "connect")
+    def _configure_sqlite(dbapi_connection, connection_record) -> None:
+        # WAL: коммит — это дозапись в журнал, читатели не блокируют писателей,
+        # а fsync выполняется пачками при checkpoint (synchronous=NORMAL).
+        # busy_timeout позволяет воркерам дождаться блокировки записи, а не падать.
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout * 1000)}")
+        cursor.close()
+
+
+def dialect_insert(session: AsyncSession):
+    """insert() с поддержкой ON CONFLICT для диалекта сессии"""
+    if session.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+async def checkpoint_wal() -> None:
+    """Переносит журнал WAL в основной файл БД и обрезает журнал"""
+    if not is_sqlite:
+        return
+    async with engine.connect() as conn:
+        await conn.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
+
 
 async def get_db() -> AsyncIterator[AsyncSession]:
     async with AsyncSessionLocal() as session:
         yield session
-
-
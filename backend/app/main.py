@@ -1,11 +1,25 @@
+import asyncio
+
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 
 from app import models
 from app.api.routes import api_router
 from app.core.config import settings
-from app.db.base import Base
-from app.db.session import engine
+from app.core.middleware import CompressionMiddleware, UploadAdmissionMiddleware
+from app.crud.rollup import rebuild_rollups, rollups_need_rebuild
+from app.crud.route_file import delete_duplicate_route_files
+from app.db.schema import create_indexes, sync_schema
+from app.db.session import AsyncSessionLocal, checkpoint_wal, engine, is_sqlite
+from app.services.legacy_metadata import import_legacy_metadata
+from app.services.storage import remove_file_data
+from app.services.model_loader import (
+    get_loaded_image_processor,
+    load_model_in_background,
+    loaded_image_processors,
+    watch_model_updates,
+)
 
 app = FastAPI(
     title=settings.project_name,
@@ -14,6 +28,10 @@ app = FastAPI(
     redoc_url="/redoc",
 )
 
+# Сжатие — ближе всех к приложению: ответы 429/503 короткие, сжимать их незачем
+app.add_middleware(CompressionMiddleware)
+# Добавлен до CORS, чтобы ответы 429/503 проходили через CORS
+app.add_middleware(UploadAdmissionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -23,10 +41,69 @@ app.add_middleware(
 )
 
 
+async def init_database() -> None:
+    """Создает таблицы и переносит старые метаданные; повторный вызов безопасен"""
+    async with engine.begin() as conn:
+        pending_indexes = await conn.run_sync(sync_schema)
+
+    if pending_indexes:
+        # Уникальность имени файла в маршруте раньше не проверялась БД: дубликаты удаляются
+        async with AsyncSessionLocal() as session:
+            removed = await delete_duplicate_route_files(session)
+        for route_id, file_id, file_ext in removed:
+            remove_file_data(route_id, file_id, file_ext)
+        if removed:
+            print(f"🧹 Удалено одноименных файлов маршрутов: {len(removed)}")
+        async with engine.begin() as conn:
+            await conn.run_sync(create_indexes, pending_indexes)
+
+    async with AsyncSessionLocal() as session:
+        imported = await import_legacy_metadata(session)
+        if imported or await rollups_need_rebuild(session):
+            # Сводки по старым данным строятся один раз, дальше они обновляются вместе с файлами
+            await rebuild_rollups(session)
+            print("📊 Сводки по маршрутам пересчитаны")
+    if imported:
+        print(f"📦 Импортировано записей из metadata.json: {imported}")
+
+
+async def checkpoint_loop() -> None:
+    """Фоновое сжатие журнала WAL, чтобы checkpoint не выполнялся внутри запросов"""
+    while True:
+        await asyncio.sleep(settings.sqlite_checkpoint_interval)
+        try:
+            await checkpoint_wal()
+        except Exception as e:
+            print(f"⚠️ Не удалось выполнить checkpoint БД: {e}")
+
+
+_background_tasks: list[asyncio.Task] = []
+
+
 @app.on_event("startup")
 async def on_startup() -> None:
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    await init_database()
+    if is_sqlite and settings.sqlite_checkpoint_interval > 0:
+        _background_tasks.append(asyncio.create_task(checkpoint_loop()))
+    if settings.preload_model and get_loaded_image_processor() is None:
+        # Сервер принимает запросы сразу, готовность модели — в /api/health/ready
+        _background_tasks.append(asyncio.create_task(load_model_in_background()))
+    if settings.models_watch_interval > 0:
+        _background_tasks.append(asyncio.create_task(watch_model_updates()))
+
+
+@app.on_event("shutdown")
+async def on_shutdown() -> None:
+    for task in _background_tasks:
+        task.cancel()
+
+    # HTTP-запросы к этому моменту уже завершены сервером; дожидаемся фонового инференса,
+    # в том числе на замененных версиях модели
+    for processor in loaded_image_processors():
+        if processor.inflight:
+            print(f"⏳ Ожидание завершения инференса ({processor.model_version}): {processor.inflight}")
+            if not await run_in_threadpool(processor.wait_idle, settings.shutdown_timeout):
+                print("⚠️ Инференс не завершился за отведенное время")
 
 
 @app.get("/", summary="Root endpoint")
@@ -1,6 +1,21 @@
 from app.models.user import User
 from app.models.route import Route
+from app.models.route_file import RouteFile
+from app.models.detection import Detection
+from app.models.rollup import ClassDayRollup, RouteDayRollup
+from app.models.blob import Blob
+from app.models.response_version import ResponseVersion
+from app.models.reprocess_job import ReprocessJob, RouteLock
 
-__all__ = ["User", "Route"]
-
-
+__all__ = [
+    "User",
+    "Route",
+    "RouteFile",
+    "Detection",
+    "RouteDayRollup",
+    "ClassDayRollup",
+    "Blob",
+    "ResponseVersion",
+    "ReprocessJob",
+    "RouteLock",
+]
@@ -0,0 +1,20 @@
+from datetime import datetime
+
+from sqlalchemy import BigInteger, Column, DateTime, Integer, String
+
+from app.db.base import Base
+
+
+class Blob(Base):
+    """Объект хранилища по хешу содержимого: сколько файлов маршрутов на него ссылается"""
+
+    __tablename__ = "blobs"
+
+    digest = Column(String(64), primary_key=True)
+    size = Column(BigInteger, nullable=False, default=0)
+    ref_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(
+        DateTime(timezone=True),
+        default=datetime.utcnow,
+        nullable=False,
+    )
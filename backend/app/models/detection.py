@@ -0,0 +1,28 @@
+from sqlalchemy import Column, Float, ForeignKey, Index, Integer, String
+from sqlalchemy.orm import relationship
+
+from app.db.base import Base
+
+
+class Detection(Base):
+    __tablename__ = "detections"
+    __table_args__ = (
+        Index("ix_detections_geo_cell_class_id", "geo_cell", "class_id"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    file_id = Column(String(36), ForeignKey("route_files.id"), nullable=False, index=True)
+    route_id = Column(String(36), ForeignKey("routes.id"), nullable=False, index=True)
+    class_id = Column(Integer, nullable=False)
+    confidence = Column(Float, nullable=False)
+    # Бокс в координатах полного изображения
+    x1 = Column(Float, nullable=False)
+    y1 = Column(Float, nullable=False)
+    x2 = Column(Float, nullable=False)
+    y2 = Column(Float, nullable=False)
+    # Координаты детекции — точка съемки кадра из EXIF
+    latitude = Column(Float, nullable=True)
+    longitude = Column(Float, nullable=True)
+    geo_cell = Column(Integer, nullable=True)
+
+    file = relationship("RouteFile", back_populates="detections")
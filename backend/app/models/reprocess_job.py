@@ -0,0 +1,65 @@
+from datetime import datetime
+
+from sqlalchemy import JSON, Column, DateTime, ForeignKey, Integer, String, Text
+
+from app.db.base import Base
+
+
+class ReprocessJob(Base):
+    """
+    Задача повторной обработки маршрутов
+
+    Состояние хранится в БД, а не в памяти воркера: при нескольких воркерах прогресс задачи
+    читается в любом из них. Задачу выполняет воркер, который ее создал; heartbeat_at он
+    обновляет, пока задача жива.
+    """
+
+    __tablename__ = "reprocess_jobs"
+
+    id = Column(String(36), primary_key=True, index=True)
+    user_id = Column(String(36), ForeignKey("users.id"), nullable=False, index=True)
+    route_ids = Column(JSON, nullable=False)
+    # Выбор файлов: явный список ID или фильтр (FileFilter)
+    file_ids = Column(JSON, nullable=True)
+    file_filter = Column(String(32), nullable=True)
+    # pending, running, completed, failed
+    status = Column(String(16), nullable=False, default="pending")
+    total = Column(Integer, nullable=False, default=0)
+    processed = Column(Integer, nullable=False, default=0)
+    skipped = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    current_route_id = Column(String(36), nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(
+        DateTime(timezone=True),
+        default=datetime.utcnow,
+        nullable=False,
+    )
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    heartbeat_at = Column(
+        DateTime(timezone=True),
+        default=datetime.utcnow,
+        nullable=False,
+    )
+
+
+class RouteLock(Base):
+    """
+    Маршрут, файлы которого сейчас переписывает задача повторной обработки или пакетная загрузка
+
+    Первичный ключ по маршруту не дает двум задачам (в разных воркерах или процессах)
+    обрабатывать один маршрут одновременно. Блокировка без обновления heartbeat_at дольше
+    route_lock_timeout считается брошенной остановленным процессом.
+    """
+
+    __tablename__ = "route_locks"
+
+    route_id = Column(String(36), primary_key=True)
+    # ID задачи повторной обработки или batch:<uuid> для пакетной загрузки
+    owner = Column(String(64), nullable=False, index=True)
+    heartbeat_at = Column(
+        DateTime(timezone=True),
+        default=datetime.utcnow,
+        nullable=False,
+    )
@@ -0,0 +1,18 @@
+from sqlalchemy import Column, Integer, String
+
+from app.db.base import Base
+
+
+class ResponseVersion(Base):
+    """
+    Версия данных, из которых собираются кэшируемые ответы GET
+
+    scope — route:<id> (файлы и статистика маршрута) или user:<id> (список маршрутов и сводка
+    пользователя). Версия меняется в той же транзакции, что и данные, поэтому воркеры и отдельные
+    процессы (пакетная загрузка, повторная обработка) видят изменение без обмена сообщениями.
+    """
+
+    __tablename__ = "response_versions"
+
+    scope = Column(String(48), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,36 @@
+from sqlalchemy import Column, Date, ForeignKey, Index, Integer, String
+
+from app.db.base import Base
+
+
+class RouteDayRollup(Base):
+    """Сводка по изображениям маршрута за день, обновляется при каждой загрузке и удалении"""
+
+    __tablename__ = "route_day_rollups"
+    __table_args__ = (
+        Index("ix_route_day_rollups_user_id_day", "user_id", "day"),
+    )
+
+    route_id = Column(String(36), ForeignKey("routes.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    user_id = Column(String(36), ForeignKey("users.id"), nullable=False)
+    image_count = Column(Integer, nullable=False, default=0)
+    processed_count = Column(Integer, nullable=False, default=0)
+    defect_image_count = Column(Integer, nullable=False, default=0)
+    detection_count = Column(Integer, nullable=False, default=0)
+
+
+class ClassDayRollup(Base):
+    """Сводка по детекциям одного класса на маршруте за день"""
+
+    __tablename__ = "class_day_rollups"
+    __table_args__ = (
+        Index("ix_class_day_rollups_user_id_class_id", "user_id", "class_id"),
+    )
+
+    route_id = Column(String(36), ForeignKey("routes.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    class_id = Column(Integer, primary_key=True)
+    user_id = Column(String(36), ForeignKey("users.id"), nullable=False)
+    detection_count = Column(Integer, nullable=False, default=0)
+    image_count = Column(Integer, nullable=False, default=0)
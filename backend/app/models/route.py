@@ -13,5 +13,6 @@ class Route(Base):
     user_id = Column(String(36), ForeignKey("users.id"), nullable=False)
 
     user = relationship("User", back_populates="routes")
+    files = relationship("RouteFile", back_populates="route")
 
 
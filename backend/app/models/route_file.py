@@ -0,0 +1,58 @@
+from datetime import datetime
+
+from sqlalchemy import BigInteger, Boolean, Column, DateTime, Float, ForeignKey, Index, Integer, String
+from sqlalchemy.orm import relationship
+
+from app.db.base import Base
+
+
+class RouteFile(Base):
+    __tablename__ = "route_files"
+    __table_args__ = (
+        # Прежний неуникальный индекс ix_route_files_route_id_original_name удаляет sync_schema
+        Index("uq_route_files_route_id_original_name", "route_id", "original_name", unique=True),
+    )
+
+    id = Column(String(36), primary_key=True, index=True)
+    route_id = Column(String(36), ForeignKey("routes.id"), nullable=False, index=True)
+    original_name = Column(String(255), nullable=False)
+    file_ext = Column(String(32), nullable=False, default="")
+    is_processed = Column(Boolean, nullable=False, default=False)
+    red_detection_count = Column(Integer, nullable=False, default=0)
+    green_detection_count = Column(Integer, nullable=False, default=0)
+    total_detections = Column(Integer, nullable=False, default=0)
+    # Формат обработанного изображения (jpeg, webp); NULL — JPEG из старых версий
+    processed_format = Column(String(8), nullable=True)
+    # SHA-256 оригинала и обработанного изображения в хранилище (app.services.storage);
+    # NULL — файл лежит в директории маршрута (загружается сейчас или еще не перенесен)
+    original_hash = Column(String(64), nullable=True)
+    processed_hash = Column(String(64), nullable=True)
+    # Размер и CRC-32 обработанного изображения — заголовки ZIP при экспорте без чтения файлов
+    processed_size = Column(BigInteger, nullable=True)
+    processed_crc32 = Column(BigInteger, nullable=True)
+    # Версия модели, которой получен результат; NULL — обработано до учета версий
+    model_version = Column(String(64), nullable=True, index=True)
+    # Данные EXIF: координаты съемки, высота, направление камеры и время
+    latitude = Column(Float, nullable=True)
+    longitude = Column(Float, nullable=True)
+    altitude = Column(Float, nullable=True)
+    heading = Column(Float, nullable=True)
+    taken_at = Column(DateTime(timezone=True), nullable=True)
+    # Ячейка сеточного пространственного индекса (см. app.services.geo)
+    geo_cell = Column(Integer, nullable=True, index=True)
+    created_at = Column(
+        DateTime(timezone=True),
+        default=datetime.utcnow,
+        nullable=False,
+    )
+
+    route = relationship("Route", back_populates="files")
+    detections = relationship("Detection", back_populates="file")
+
+    @property
+    def has_red_detections(self) -> bool:
+        return (self.red_detection_count or 0) > 0
+
+    @property
+    def has_green_detections(self) -> bool:
+        return (self.green_detection_count or 0) > 0
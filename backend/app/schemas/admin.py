@@ -0,0 +1,7 @@
+from pydantic import BaseModel
+
+
+class ModelActivation(BaseModel):
+    """Выбор активной версии модели: имя файла *.onnx в директории моделей"""
+
+    name: str
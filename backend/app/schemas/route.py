@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from pydantic import BaseModel
 
 
@@ -14,7 +16,9 @@ class RouteRead(RouteBase):
     id: str
     user_id: str
     files: list[str] = []
+    file_count: int = 0
+    defect_count: int = 0
+    last_upload_at: datetime | None = None
 
     class Config:
         from_attributes = True
-
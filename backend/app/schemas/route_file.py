@@ -0,0 +1,31 @@
+from typing import Literal
+
+from pydantic import BaseModel, model_validator
+
+# outdated_model — обработанные не текущей версией модели (или до учета версий)
+FileFilter = Literal["all", "no_detections", "no_defects", "with_defects", "unprocessed", "outdated_model"]
+
+
+class BulkFileSelection(BaseModel):
+    """Выбор файлов маршрута: явный список идентификаторов или фильтр"""
+
+    file_ids: list[str] | None = None
+    filter: FileFilter | None = None
+
+    @model_validator(mode="after")
+    def check_selection(self) -> "BulkFileSelection":
+        if (self.file_ids is None) == (self.filter is None):
+            raise ValueError("Укажите либо file_ids, либо filter")
+        return self
+
+
+class BulkFileResult(BaseModel):
+    file_id: str
+    status: Literal["deleted", "not_found", "error"]
+    original: str | None = None
+    error: str | None = None
+
+
+class BulkDeleteResponse(BaseModel):
+    deleted: int
+    results: list[BulkFileResult]
@@ -0,0 +1,157 @@
+"""
+Продакшн-запуск: несколько воркеров uvicorn с моделью, загруженной до fork
+
+Приложение и ONNX модель импортируются и загружаются в родительском процессе,
+после чего воркеры создаются через fork и разделяют веса модели copy-on-write.
+Все воркеры слушают один сокет, открытый родителем.
+
+    python -m app.server --workers 4 --port 8000
+"""
+import argparse
+import asyncio
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+import uvicorn
+
+from app.core.config import settings
+
+
+def default_workers() -> int:
+    return max(1, os.cpu_count() or 1)
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Продакшн-запуск бекенда RBX")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=default_workers(),
+        help="Количество воркеров (по умолчанию — число ядер)",
+    )
+    parser.add_argument(
+        "--no-preload-model",
+        action="store_true",
+        help="Не загружать модель до fork (каждый воркер загрузит ее в фоне после старта)",
+    )
+    return parser.parse_args(argv)
+
+
+def preload(load_model: bool):
+    """Импортирует приложение, готовит БД и загружает модель в родительском процессе"""
+    from app.main import app, init_database
+    from app.db.session import engine
+    from app.services.model_loader import get_image_processor
+
+    async def prepare_database() -> None:
+        await init_database()
+        # Соединения нельзя наследовать через fork — каждый воркер откроет свои
+        await engine.dispose()
+
+    asyncio.run(prepare_database())
+
+    if load_model:
+        # Пул потоков ORT не переживает fork, поэтому в режиме prefork инференс однопоточный,
+        # а параллелизм дают воркеры
+        if settings.inference_threads <= 0:
+            settings.inference_threads = 1
+        started = time.monotonic()
+        try:
+            get_image_processor()
+            print(f"✅ Модель загружена за {time.monotonic() - started:.2f} с")
+        except Exception as e:
+            print(f"⚠️ Модель не загружена, воркеры будут работать без ИИ: {e}")
+
+    return app
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock: socket.socket) -> None:
+    """Тело воркера: обычный uvicorn.Server на унаследованном сокете"""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    config = uvicorn.Config(
+        app,
+        lifespan="on",
+        timeout_graceful_shutdown=int(settings.shutdown_timeout),
+    )
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+
+
+def spawn_worker(app, sock: socket.socket) -> int:
+    pid = os.fork()
+    if pid == 0:
+        exit_code = 0
+        try:
+            run_worker(app, sock)
+        except BaseException as e:
+            print(f"❌ Воркер {os.getpid()} завершился с ошибкой: {e}")
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+    return pid
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    if sys.platform == "win32":
+        raise SystemExit("Режим prefork недоступен в Windows, используйте uvicorn --workers")
+
+    app = preload(load_model=not args.no_preload_model)
+    sock = bind_socket(args.host, args.port)
+
+    # Объекты, созданные при загрузке, больше не трогаются сборщиком мусора,
+    # поэтому их страницы остаются общими между воркерами
+    gc.collect()
+    gc.freeze()
+
+    workers: set[int] = set()
+    shutting_down = False
+
+    def handle_stop(signum, frame) -> None:
+        nonlocal shutting_down
+        shutting_down = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, handle_stop)
+    signal.signal(signal.SIGINT, handle_stop)
+
+    for _ in range(args.workers):
+        workers.add(spawn_worker(app, sock))
+    print(f"🚀 Запущено воркеров: {args.workers} на {args.host}:{args.port}")
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        workers.discard(pid)
+        if not shutting_down:
+            print(f"⚠️ Воркер {pid} неожиданно завершился (status={status}), перезапускаем")
+            workers.add(spawn_worker(app, sock))
+
+    sock.close()
+    print("👋 Все воркеры остановлены")
+
+
+if __name__ == "__main__":
+    main()
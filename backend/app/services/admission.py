@@ -0,0 +1,214 @@
+"""
+Допуск загрузок к обработке ИИ
+
+Ограничивает число изображений и объем данных, которые одновременно находятся в обработке
+в этом процессе, и долю одного пользователя. Загрузка сверх лимита сразу получает отказ
+с подсказкой, через сколько повторить, а не ждет в очереди за чужими загрузками.
+Освобождение идет по мере обработки файлов, а не в конце загрузки.
+
+Лимиты ограничивают память и очередь к модели, а не потоки: загрузка ждет конвейер
+(app.services.pipeline) в event loop и не занимает потоки пула run_in_threadpool, поэтому
+и без ограничения (0) одновременные загрузки не исчерпывают пул, общий с запросами к БД.
+"""
+import math
+import threading
+import time
+from typing import Optional
+
+from app.core.config import settings
+
+# Сглаживание оценки времени обработки одного изображения
+_EWMA_ALPHA = 0.2
+# Retry-After не больше этого значения, какой бы длинной ни была очередь
+_MAX_RETRY_AFTER = 120
+
+
+class AdmissionRejected(Exception):
+    """Загрузка не допущена: 429 — превышена доля пользователя, 503 — сервер перегружен"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """
+    Разрешение на обработку одной загрузки
+
+    Держит не больше, чем доля пользователя: загрузка крупнее лимита допускается, только
+    когда у пользователя ничего не обрабатывается, и занимает всю его долю, пока остаток
+    не станет меньше.
+    """
+
+    def __init__(self, controller: "AdmissionController", user_key: str, images: int, nbytes: int):
+        self._controller = controller
+        self.user_key = user_key
+        self.remaining_images = images
+        self.remaining_bytes = nbytes
+        self.held_images = 0
+        self.held_bytes = 0
+
+    def release(self, images: int = 1, nbytes: int = 0) -> None:
+        """Отмечает обработанные файлы и возвращает освободившуюся часть лимита"""
+        self._controller._update(
+            self,
+            max(0, self.remaining_images - images),
+            max(0, self.remaining_bytes - nbytes),
+            completed=images,
+        )
+
+    def close(self) -> None:
+        """Возвращает весь остаток (загрузка завершена или прервана); повторный вызов безопасен"""
+        self._controller._update(self, 0, 0)
+
+    def __enter__(self) -> "AdmissionTicket":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class AdmissionController:
+    """Лимиты на изображения и байты в обработке; 0 — без ограничения"""
+
+    def __init__(self, max_images: int, max_bytes: int, user_share: float, retry_after: int):
+        self.max_images = max_images
+        self.max_bytes = max_bytes
+        self.user_share = min(1.0, max(0.0, user_share)) or 1.0
+        self.retry_after = max(1, retry_after)
+        self.images = 0
+        self.bytes = 0
+        self.admitted = 0
+        self.rejected_user = 0
+        self.rejected_overload = 0
+        self._users: dict[str, list[int]] = {}
+        self._seconds_per_image: Optional[float] = None
+        self._last_completed_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _share(limit: int, share: float) -> float:
+        return max(1, int(limit * share)) if limit > 0 else math.inf
+
+    def _user_limits(self) -> tuple[float, float]:
+        return self._share(self.max_images, self.user_share), self._share(self.max_bytes, self.user_share)
+
+    def _estimate_retry_after(self, excess_images: float) -> int:
+        # Пока темп обработки неизвестен (или превышен только лимит байт) — значение из настроек
+        if self._seconds_per_image is None or not math.isfinite(excess_images) or excess_images <= 0:
+            return self.retry_after
+        return min(_MAX_RETRY_AFTER, max(1, math.ceil(excess_images * self._seconds_per_image)))
+
+    def _check(self, user_key: str, images: float, nbytes: float) -> None:
+        user_images_limit, user_bytes_limit = self._user_limits()
+        user_images, user_bytes = self._users.get(user_key, (0, 0))
+        images = min(images, user_images_limit)
+        nbytes = min(nbytes, user_bytes_limit)
+
+        if user_images + images > user_images_limit or user_bytes + nbytes > user_bytes_limit:
+            self.rejected_user += 1
+            raise AdmissionRejected(
+                429,
+                "Слишком много изображений пользователя в обработке, повторите позже",
+                self._estimate_retry_after(user_images + images - user_images_limit),
+            )
+        max_images = self.max_images or math.inf
+        max_bytes = self.max_bytes or math.inf
+        if self.images + images > max_images or self.bytes + nbytes > max_bytes:
+            self.rejected_overload += 1
+            raise AdmissionRejected(
+                503,
+                "Сервер перегружен обработкой изображений, повторите позже",
+                self._estimate_retry_after(self.images + images - max_images),
+            )
+
+    def check(self, user_key: str, nbytes: int) -> None:
+        """
+        Быстрая проверка до приема тела запроса: есть ли место хотя бы для одного изображения
+        и для nbytes данных. Ничего не резервирует.
+        """
+        with self._lock:
+            self._check(user_key, 1, nbytes)
+
+    def admit(self, user_key: str, images: int, nbytes: int) -> AdmissionTicket:
+        """Резервирует место под загрузку или выбрасывает AdmissionRejected"""
+        with self._lock:
+            self._check(user_key, images, nbytes)
+            self.admitted += 1
+            ticket = AdmissionTicket(self, user_key, images, nbytes)
+            self._hold(ticket)
+        return ticket
+
+    def _hold(self, ticket: AdmissionTicket) -> None:
+        user_images_limit, user_bytes_limit = self._user_limits()
+        held_images = min(ticket.remaining_images, user_images_limit)
+        held_bytes = min(ticket.remaining_bytes, user_bytes_limit)
+        delta_images = held_images - ticket.held_images
+        delta_bytes = held_bytes - ticket.held_bytes
+        ticket.held_images, ticket.held_bytes = held_images, held_bytes
+
+        self.images += delta_images
+        self.bytes += delta_bytes
+        usage = self._users.setdefault(ticket.user_key, [0, 0])
+        usage[0] += delta_images
+        usage[1] += delta_bytes
+        if usage[0] <= 0 and usage[1] <= 0:
+            del self._users[ticket.user_key]
+
+    def _update(self, ticket: AdmissionTicket, images: int, nbytes: int, completed: int = 0) -> None:
+        with self._lock:
+            ticket.remaining_images = images
+            ticket.remaining_bytes = nbytes
+            self._hold(ticket)
+            if completed > 0:
+                now = time.monotonic()
+                if self._last_completed_at is not None:
+                    interval = (now - self._last_completed_at) / completed
+                    self._seconds_per_image = (
+                        interval if self._seconds_per_image is None
+                        else self._seconds_per_image + _EWMA_ALPHA * (interval - self._seconds_per_image)
+                    )
+                self._last_completed_at = now
+            if self.images == 0:
+                # Простой между загрузками не должен попадать в оценку темпа
+                self._last_completed_at = None
+
+    def stats(self) -> dict:
+        """Текущая нагрузка: сколько занято из лимитов и сколько пользователей сейчас загружают"""
+        with self._lock:
+            utilization = max(
+                self.images / self.max_images if self.max_images else 0.0,
+                self.bytes / self.max_bytes if self.max_bytes else 0.0,
+            )
+            return {
+                "inflight_images": self.images,
+                "max_images": self.max_images or None,
+                "queued_bytes": self.bytes,
+                "max_bytes": self.max_bytes or None,
+                "active_users": len(self._users),
+                "utilization": round(utilization, 3),
+                "saturated": utilization >= 1.0,
+                "seconds_per_image": round(self._seconds_per_image, 3) if self._seconds_per_image else None,
+                "retry_after": self._estimate_retry_after(self.images - (self.max_images or math.inf) + 1),
+                "admitted": self.admitted,
+                "rejected_user": self.rejected_user,
+                "rejected_overload": self.rejected_overload,
+            }
+
+
+_admission_controller: Optional[AdmissionController] = None
+
+
+def get_admission_controller() -> AdmissionController:
+    """Контроллер допуска этого процесса (при prefork лимиты действуют на каждый воркер)"""
+    global _admission_controller
+    if _admission_controller is None:
+        _admission_controller = AdmissionController(
+            max_images=settings.admission_max_images,
+            max_bytes=settings.admission_max_queued_mb * 1024 * 1024,
+            user_share=settings.admission_user_share,
+            retry_after=settings.admission_retry_after,
+        )
+    return _admission_controller
@@ -0,0 +1,314 @@
+"""
+Пакетная загрузка изображений из директории в маршрут без HTTP
+
+Изображения обрабатываются пулом процессов, в каждом процессе — своя сессия ONNX Runtime.
+Воркеры сами копируют оригиналы и пишут обработанные изображения в директорию маршрута
+и считают их хеши, родительский процесс пакетами записывает файлы и детекции в БД
+и переносит файлы в хранилище по хешу.
+
+Повторный запуск продолжает с места остановки: уже обработанные файлы маршрута
+(по имени) пропускаются. На время загрузки маршрут блокируется в БД, как при повторной
+обработке: пока идет загрузка, повторная обработка маршрута не запускается, и наоборот.
+
+Запуск из директории backend:
+    python -m app.services.batch /data/flight-2023-06 --route <route_id> --workers 16
+"""
+import argparse
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import signal
+import sys
+import time
+import uuid
+from pathlib import Path
+
+from app.core.config import settings
+from app.services.storage import (
+    checksum_file,
+    is_image_filename,
+    original_path,
+    processed_path,
+    remove_files_data,
+    route_processed_dir,
+    route_upload_dir,
+)
+
+# Процессор изображений воркера пула; создается один раз при запуске процесса
+_processor = None
+# Ошибка загрузки модели в воркере. Исключение из initializer пул не передает родителю,
+# а бесконечно пересоздает процесс, поэтому ошибку возвращает первая же задача
+_init_error: str | None = None
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Пакетная обработка изображений из директории в маршрут")
+    parser.add_argument("directory", type=Path, help="Директория с изображениями")
+    parser.add_argument("--route", required=True, help="ID маршрута")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=max(1, os.cpu_count() or 1),
+        help="Количество процессов (по умолчанию — число ядер)",
+    )
+    parser.add_argument("--threads", type=int, default=1, help="Потоки ONNX Runtime в каждом процессе")
+    parser.add_argument("--batch-size", type=int, default=64, help="Сколько файлов записывать в БД за транзакцию")
+    parser.add_argument("--recursive", action="store_true", help="Искать изображения во вложенных директориях")
+    parser.add_argument("--force", action="store_true", help="Обработать заново и уже загруженные файлы")
+    return parser.parse_args(argv)
+
+
+def find_images(directory: Path, recursive: bool) -> list[tuple[Path, str]]:
+    """Пары (путь, имя файла в маршруте); во вложенных директориях имя — относительный путь"""
+    paths = directory.rglob("*") if recursive else directory.iterdir()
+    return sorted(
+        (path, path.relative_to(directory).as_posix())
+        for path in paths
+        if path.is_file() and is_image_filename(path.name)
+    )
+
+
+def _init_worker(threads: int) -> None:
+    global _processor, _init_error
+    # Прерывание обрабатывает родитель, воркеры останавливаются через terminate
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    settings.inference_threads = threads
+
+    from app.services.model_loader import get_image_processor
+
+    try:
+        _processor = get_image_processor()
+    except Exception as e:
+        _init_error = str(e)
+
+
+def _process_file(task: tuple[str, str, str]) -> dict:
+    """Копирует оригинал в хранилище, обрабатывает его и возвращает все, что нужно для записи в БД"""
+    from app.services.exif import extract_image_meta
+
+    route_id, source, name = task
+    if _init_error is not None:
+        return {"name": name, "fatal": _init_error}
+    started = time.perf_counter()
+    file_id = str(uuid.uuid4())
+    file_ext = Path(name).suffix
+    item = {
+        "file_id": file_id,
+        "name": name,
+        "file_ext": file_ext,
+        "bytes": 0,
+        "stored": False,
+        "meta": None,
+        "original_hash": None,
+        "processed_checksums": None,
+        "result": None,
+        "error": None,
+    }
+    try:
+        with open(source, "rb") as f:
+            content = f.read()
+        item["bytes"] = len(content)
+        with open(original_path(route_id, file_id, file_ext), "wb") as f:
+            f.write(content)
+        item["stored"] = True
+        item["original_hash"] = hashlib.sha256(content).hexdigest()
+        item["meta"] = extract_image_meta(content)
+
+        output_path = processed_path(route_id, file_id, settings.processed_format)
+        result = _processor.process_image(content, output_path=output_path)
+        # Результат без хешей не записать в хранилище: файл считается необработанным
+        item["processed_checksums"] = checksum_file(output_path)
+        item["result"] = {key: value for key, value in result.items() if key != "image_bytes"}
+    except Exception as e:
+        item["error"] = str(e)
+        item["processed_checksums"] = None
+        processed_path(route_id, file_id, settings.processed_format).unlink(missing_ok=True)
+    item["seconds"] = time.perf_counter() - started
+    return item
+
+
+def _build_route_file(route_id: str, item: dict):
+    from app.models.route_file import RouteFile
+    from app.services.exif import apply_image_meta
+
+    route_file = RouteFile(
+        id=item["file_id"],
+        route_id=route_id,
+        original_name=item["name"],
+        file_ext=item["file_ext"],
+        original_hash=item["original_hash"],
+    )
+    if item["meta"]:
+        apply_image_meta(route_file, item["meta"])
+    result = item["result"]
+    if result is not None:
+        route_file.is_processed = True
+        route_file.processed_format = result["format"]
+        route_file.model_version = result["model_version"]
+        route_file.red_detection_count = result["red_detection_count"]
+        route_file.green_detection_count = result["green_detection_count"]
+        route_file.total_detections = result["total_detections"]
+        route_file.processed_hash, route_file.processed_crc32, route_file.processed_size = item["processed_checksums"]
+    return route_file, (result or {}).get("detections", [])
+
+
+async def _prepare(route_id: str, owner: str, force: bool) -> tuple[str, set[str]]:
+    """Готовит БД, блокирует маршрут и возвращает его владельца и имена уже обработанных файлов"""
+    from app.crud.reprocess_job import acquire_route_locks, expire_stale_jobs
+    from app.crud.route_file import get_route_file_names
+    from app.db.session import AsyncSessionLocal, engine
+    from app.main import init_database
+    from app.models.route import Route
+
+    await init_database()
+    try:
+        async with AsyncSessionLocal() as session:
+            route = await session.get(Route, route_id)
+            if route is None:
+                raise SystemExit(f"❌ Маршрут не найден: {route_id}")
+            await expire_stale_jobs(session)
+            if not await acquire_route_locks(session, owner, [route_id]):
+                raise SystemExit(f"❌ Маршрут сейчас обрабатывается другой задачей: {route_id}")
+            await session.commit()
+            done = set() if force else await get_route_file_names(session, route_id, processed_only=True)
+            return route.user_id, done
+    finally:
+        # Соединения нельзя наследовать через fork — пул процессов создается после
+        await engine.dispose()
+
+
+async def _store(route_id: str, user_id: str, owner: str, items: list[dict]) -> None:
+    from app.crud.reprocess_job import touch_route_locks
+    from app.crud.route_file import replace_route_files
+    from app.db.session import AsyncSessionLocal
+
+    async with AsyncSessionLocal() as session:
+        replaced = await replace_route_files(
+            session, [_build_route_file(route_id, item) for item in items], user_id
+        )
+        await touch_route_locks(session, owner)
+        await session.commit()
+    if replaced:
+        remove_files_data(route_id, replaced)
+
+
+def run(args: argparse.Namespace) -> int:
+    directory: Path = args.directory
+    route_id: str = args.route
+    if not directory.is_dir():
+        print(f"❌ Директория не найдена: {directory}")
+        return 1
+
+    loop = asyncio.new_event_loop()
+    owner = f"batch:{uuid.uuid4()}"
+    try:
+        user_id, done = loop.run_until_complete(_prepare(route_id, owner, args.force))
+        return _run(args, loop, route_id, owner, user_id, done)
+    finally:
+        loop.run_until_complete(_finish(owner))
+        loop.close()
+
+
+def _run(
+    args: argparse.Namespace,
+    loop: asyncio.AbstractEventLoop,
+    route_id: str,
+    owner: str,
+    user_id: str,
+    done: set[str],
+) -> int:
+    images = find_images(args.directory, args.recursive)
+    pending = [(path, name) for path, name in images if name not in done]
+    skipped = len(images) - len(pending)
+    print(f"📂 Изображений: {len(images)}, уже обработано: {skipped}, к обработке: {len(pending)}")
+    if not pending:
+        return 0
+
+    route_upload_dir(route_id).mkdir(parents=True, exist_ok=True)
+    route_processed_dir(route_id).mkdir(parents=True, exist_ok=True)
+
+    processed = failed = detections = defect_frames = 0
+    read_bytes = 0
+    worker_seconds = 0.0
+    batch: list[dict] = []
+    fatal: str | None = None
+    started = time.perf_counter()
+
+    def flush() -> None:
+        if batch:
+            loop.run_until_complete(_store(route_id, user_id, owner, batch))
+            batch.clear()
+
+    tasks = [(route_id, str(path), name) for path, name in pending]
+    workers = max(1, min(args.workers, len(tasks)))
+    pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(args.threads,))
+    try:
+        for item in pool.imap_unordered(_process_file, tasks, chunksize=4):
+            if "fatal" in item:
+                fatal = item["fatal"]
+                break
+            worker_seconds += item["seconds"]
+            read_bytes += item["bytes"]
+            if not item["stored"]:
+                # Оригинал не сохранен — записывать в маршрут нечего
+                failed += 1
+                print(f"⚠️ {item['name']}: {item['error']}")
+                continue
+            if item["result"] is None:
+                failed += 1
+                print(f"⚠️ {item['name']}: {item['error']}")
+            else:
+                processed += 1
+                detections += item["result"]["total_detections"]
+                defect_frames += int(item["result"]["red_detection_count"] > 0)
+
+            batch.append(item)
+            if len(batch) >= args.batch_size:
+                flush()
+                done_count = processed + failed
+                elapsed = time.perf_counter() - started
+                print(f"⏳ {done_count}/{len(tasks)} — {done_count / elapsed:.1f} изобр./с")
+        if fatal is not None:
+            print(f"❌ Воркер не загрузил модель: {fatal}")
+            pool.terminate()
+        else:
+            pool.close()
+    except KeyboardInterrupt:
+        print("⏹ Остановка: уже обработанные файлы будут сохранены, повторный запуск продолжит")
+        pool.terminate()
+    finally:
+        pool.join()
+        flush()
+
+    elapsed = time.perf_counter() - started
+    total = processed + failed
+    print(f"✅ Обработано: {processed}, с ошибками: {failed}, пропущено: {skipped}")
+    print(f"   Детекций: {detections}, кадров с дефектами: {defect_frames}")
+    if total and elapsed > 0:
+        print(
+            f"   Время: {elapsed:.1f} с, {total / elapsed:.2f} изобр./с, "
+            f"{read_bytes / elapsed / 1024 / 1024:.1f} МБ/с, "
+            f"{worker_seconds / total * 1000:.0f} мс на изображение в воркере, "
+            f"загрузка воркеров {worker_seconds / (elapsed * workers):.0%}"
+        )
+    return 1 if failed or fatal is not None else 0
+
+
+async def _finish(owner: str) -> None:
+    """Снимает блокировку маршрута и закрывает соединения с БД"""
+    from app.crud.reprocess_job import release_route_locks
+    from app.db.session import AsyncSessionLocal, engine
+
+    async with AsyncSessionLocal() as session:
+        await release_route_locks(session, owner)
+        await session.commit()
+    await engine.dispose()
+
+
+def main(argv: list[str] | None = None) -> int:
+    return run(parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
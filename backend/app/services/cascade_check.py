@@ -0,0 +1,116 @@
+"""
+Проверка полноты каскадного режима на наборе изображений
+
+Каждое изображение обрабатывается в обычном режиме (эталон) и проходит дешевый проход каскада.
+Для нескольких порогов считается, какая доля кадров была бы отсеяна, сколько кадров и детекций
+с объектами каскад потерял бы и какая доля времени была бы сэкономлена.
+
+Запуск из директории backend:
+    python -m app.services.cascade_check /path/to/images --cascade-model ../ai/small.onnx
+    python -m app.services.cascade_check /path/to/images --cascade-model ../ai/small.onnx --threshold 0.05 0.1 0.2
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+from app.services.image_processor import DEFECT_CLASS_IDS, ImageProcessor
+from app.services.storage import is_image_filename
+
+
+def _measure(directory: Path, processor: ImageProcessor, limit: int | None) -> list[dict]:
+    frames = []
+    paths = sorted(p for p in directory.rglob("*") if p.is_file() and is_image_filename(p.name))
+    for path in paths[:limit]:
+        image_bytes = path.read_bytes()
+
+        started = time.perf_counter()
+        result = processor.process_image(image_bytes)
+        full_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        score = processor.cascade_score(image_bytes)
+        cascade_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        processor.render_empty(image_bytes)
+        empty_seconds = time.perf_counter() - started
+
+        detections = result["detections"]
+        frames.append({
+            "name": str(path.relative_to(directory)),
+            "score": score,
+            "detections": len(detections),
+            "defects": sum(1 for d in detections if d["class_id"] in DEFECT_CLASS_IDS),
+            "full_seconds": full_seconds,
+            "cascade_seconds": cascade_seconds,
+            "empty_seconds": empty_seconds,
+        })
+        print(f"  {path.name}: детекций {len(detections)}, кандидат {score:.3f}", file=sys.stderr)
+    return frames
+
+
+def _evaluate(frames: list[dict], threshold: float) -> dict:
+    empty = [f for f in frames if f["score"] <= threshold]
+    kept = [f for f in frames if f["score"] > threshold]
+    with_objects = [f for f in frames if f["detections"]]
+    missed = [f for f in empty if f["detections"]]
+
+    total_detections = sum(f["detections"] for f in frames)
+    total_defects = sum(f["defects"] for f in frames)
+    baseline = sum(f["full_seconds"] for f in frames)
+    spent = (
+        sum(f["cascade_seconds"] for f in frames)
+        + sum(f["full_seconds"] for f in kept)
+        + sum(f["empty_seconds"] for f in empty)
+    )
+    return {
+        "threshold": threshold,
+        "empty_fraction": len(empty) / len(frames),
+        "frame_recall": 1 - len(missed) / len(with_objects) if with_objects else 1.0,
+        "detection_recall": 1 - sum(f["detections"] for f in missed) / total_detections if total_detections else 1.0,
+        "defect_recall": 1 - sum(f["defects"] for f in missed) / total_defects if total_defects else 1.0,
+        "compute_saved": 1 - spent / baseline if baseline else 0.0,
+        "missed": [f["name"] for f in missed],
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Полнота каскадного режима относительно полной обработки")
+    parser.add_argument("directory", type=Path, help="Директория с изображениями")
+    parser.add_argument("--model", type=Path, default=None, help="Основная модель (по умолчанию ai/best.onnx)")
+    parser.add_argument("--cascade-model", type=Path, required=True, help="Меньшая модель для дешевого прохода")
+    parser.add_argument("--threshold", type=float, nargs="+", default=[0.05, 0.1, 0.15, 0.25],
+                        help="Пороги уверенности дешевого прохода")
+    parser.add_argument("--limit", type=int, default=None, help="Проверить только первые N изображений")
+    parser.add_argument("--threads", type=int, default=0, help="Потоки ONNX Runtime на инференс")
+    args = parser.parse_args()
+
+    processor = ImageProcessor(
+        args.model,
+        intra_op_num_threads=args.threads,
+        cascade=True,
+        cascade_model_path=args.cascade_model,
+    )
+    print(f"🔍 Обработка {args.directory}...", file=sys.stderr)
+    frames = _measure(args.directory, processor, args.limit)
+    if not frames:
+        print(f"❌ В {args.directory} нет изображений", file=sys.stderr)
+        return 1
+
+    with_objects = sum(1 for f in frames if f["detections"])
+    print(f"Кадров: {len(frames)}, с объектами: {with_objects}")
+    print(f"{'порог':>6} {'отсеяно':>8} {'кадры':>7} {'детекции':>9} {'дефекты':>8} {'экономия':>9}")
+    for threshold in args.threshold:
+        report = _evaluate(frames, threshold)
+        print(
+            f"{threshold:>6.2f} {report['empty_fraction']:>8.1%} {report['frame_recall']:>7.1%} "
+            f"{report['detection_recall']:>9.1%} {report['defect_recall']:>8.1%} {report['compute_saved']:>9.1%}"
+        )
+        for name in report["missed"]:
+            print(f"         пропущен: {name}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,14 @@
+# Названия классов
+CLASS_NAMES = {
+    0: "vibration_damper",
+    1: "festoon_insulators",
+    2: "traverse",
+    3: "nest",
+    4: "safety_sign+",
+    5: "bad_insulator",
+    6: "damaged_insulator",
+    7: "polymer_insulators"
+}
+
+# Классы повреждений (bad_insulator, damaged_insulator) — красные детекции
+DEFECT_CLASS_IDS = {5, 6}
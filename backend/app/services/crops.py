@@ -0,0 +1,115 @@
+"""
+Миниатюры вырезок детекций для отчетов
+
+Вырезки берутся из обработанных изображений и кэшируются на диске, поэтому повторный отчет
+по тому же маршруту изображения не декодирует. Ключ кэша — хеш обработанного изображения:
+после повторной обработки у файла новый хеш, и старые вырезки просто перестают использоваться
+(их удаляет python -m app.services.storage_migrate --gc).
+"""
+import math
+import os
+import shutil
+import uuid
+from collections.abc import Iterator
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+from app.core.config import settings
+from app.services.storage import file_processed_path
+
+if TYPE_CHECKING:
+    from app.models.route_file import RouteFile
+
+# Поля вокруг бокса, доля его размера: видно, где находится изолятор
+_CROP_MARGIN = 0.15
+_CROP_QUALITY = 85
+
+Box = tuple[float, float, float, float]
+
+
+class CropCache:
+    """Кэш миниатюр на диске: <root>/ab/<ключ изображения>/<x1>_<y1>_<x2>_<y2>_<размер>.jpg"""
+
+    def __init__(self, root: Path, size: int):
+        self.root = root
+        self.size = max(16, size)
+
+    @staticmethod
+    def image_key(route_file: "RouteFile") -> str:
+        # Файлы, не перенесенные в хранилище, различаем по ID — их содержимое без повторной
+        # обработки не меняется, а повторная обработка дает хеш
+        return route_file.processed_hash or route_file.id
+
+    def crop_path(self, key: str, box: Box) -> Path:
+        x1, y1, x2, y2 = (int(round(value)) for value in box)
+        return self.root / key[:2] / key / f"{x1}_{y1}_{x2}_{y2}_{self.size}.jpg"
+
+    def get_crops(self, route_file: "RouteFile", boxes: list[Box]) -> list[Optional[Path]]:
+        """
+        Миниатюры боксов одного изображения; недостающие вырезаются за одно декодирование
+
+        Returns:
+            list: пути к миниатюрам в порядке boxes; None — обработанного изображения нет
+        """
+        key = self.image_key(route_file)
+        paths = [self.crop_path(key, box) for box in boxes]
+        missing = [i for i, path in enumerate(paths) if not path.exists()]
+        if missing:
+            try:
+                self._render(file_processed_path(route_file), [boxes[i] for i in missing], [paths[i] for i in missing])
+            except OSError as e:
+                print(f"⚠️ Не удалось подготовить вырезки {route_file.original_name}: {e}")
+                return [path if path.exists() else None for path in paths]
+        return paths
+
+    def _render(self, source: Path, boxes: list[Box], targets: list[Path]) -> None:
+        from PIL import Image
+
+        with Image.open(source) as image:
+            width, height = image.size
+            regions = [_with_margin(box, width, height) for box in boxes]
+            # JPEG можно декодировать сразу в 1/2–1/8 размера: миниатюре не нужны лишние пиксели
+            reduction = min(max(x2 - x1, y2 - y1) / self.size for x1, y1, x2, y2 in regions)
+            if reduction >= 2:
+                image.draft("RGB", (math.ceil(width / reduction), math.ceil(height / reduction)))
+            scale = image.size[0] / width
+            image = image.convert("RGB")
+
+            targets[0].parent.mkdir(parents=True, exist_ok=True)
+            for (x1, y1, x2, y2), target in zip(regions, targets):
+                crop = image.crop((int(x1 * scale), int(y1 * scale), math.ceil(x2 * scale), math.ceil(y2 * scale)))
+                crop.thumbnail((self.size, self.size))
+                tmp_path = target.with_name(f"{target.name}.{uuid.uuid4().hex}.tmp")
+                crop.save(tmp_path, "JPEG", quality=_CROP_QUALITY)
+                os.replace(tmp_path, target)
+
+    def iter_keys(self) -> Iterator[tuple[str, float]]:
+        """Ключи изображений в кэше и время последнего изменения — для сборки мусора"""
+        for path in self.root.glob("??/*"):
+            if path.is_dir():
+                yield path.name, path.stat().st_mtime
+
+    def purge(self, key: str) -> None:
+        shutil.rmtree(self.root / key[:2] / key, ignore_errors=True)
+
+
+def _with_margin(box: Box, width: int, height: int) -> Box:
+    x1, y1, x2, y2 = box
+    margin_x = max(1.0, (x2 - x1) * _CROP_MARGIN)
+    margin_y = max(1.0, (y2 - y1) * _CROP_MARGIN)
+    return (
+        max(0.0, x1 - margin_x),
+        max(0.0, y1 - margin_y),
+        min(float(width), x2 + margin_x),
+        min(float(height), y2 + margin_y),
+    )
+
+
+_crop_cache: Optional[CropCache] = None
+
+
+def get_crop_cache() -> CropCache:
+    global _crop_cache
+    if _crop_cache is None:
+        _crop_cache = CropCache(settings.crop_cache_dir, settings.report_crop_size)
+    return _crop_cache
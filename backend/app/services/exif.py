@@ -0,0 +1,110 @@
+from datetime import datetime
+from io import BytesIO
+from typing import Optional
+
+from app.models.route_file import RouteFile
+from app.services.geo import geo_cell
+
+# Теги EXIF
+_TAG_ORIENTATION = 0x0112
+_TAG_DATETIME = 0x0132
+_TAG_DATETIME_ORIGINAL = 0x9003
+_IFD_EXIF = 0x8769
+_IFD_GPS = 0x8825
+
+# Теги внутри GPS IFD
+_GPS_LATITUDE_REF = 1
+_GPS_LATITUDE = 2
+_GPS_LONGITUDE_REF = 3
+_GPS_LONGITUDE = 4
+_GPS_ALTITUDE_REF = 5
+_GPS_ALTITUDE = 6
+_GPS_IMG_DIRECTION = 17
+
+
+def _to_degrees(value) -> Optional[float]:
+    """(градусы, минуты, секунды) -> десятичные градусы"""
+    try:
+        degrees, minutes, seconds = (float(part) for part in value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    return degrees + minutes / 60.0 + seconds / 3600.0
+
+
+def _to_float(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+
+
+def _parse_datetime(value) -> Optional[datetime]:
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.strptime(value.strip("\x00 "), "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        return None
+
+
+def extract_image_meta(image_bytes: bytes) -> dict:
+    """
+    Извлекает из EXIF ориентацию, координаты GPS, высоту, направление съемки и время
+
+    Читаются только заголовки файла, пиксели не декодируются.
+
+    Returns:
+        dict: orientation, latitude, longitude, altitude, heading, taken_at
+        (отсутствующие значения — None)
+    """
+    meta = {
+        "orientation": None,
+        "latitude": None,
+        "longitude": None,
+        "altitude": None,
+        "heading": None,
+        "taken_at": None,
+    }
+    try:
+        from PIL import Image
+
+        exif = Image.open(BytesIO(image_bytes)).getexif()
+    except Exception:
+        return meta
+
+    meta["orientation"] = exif.get(_TAG_ORIENTATION)
+    meta["taken_at"] = _parse_datetime(
+        exif.get_ifd(_IFD_EXIF).get(_TAG_DATETIME_ORIGINAL) or exif.get(_TAG_DATETIME)
+    )
+
+    gps = exif.get_ifd(_IFD_GPS)
+    if not gps:
+        return meta
+
+    latitude = _to_degrees(gps.get(_GPS_LATITUDE))
+    longitude = _to_degrees(gps.get(_GPS_LONGITUDE))
+    if latitude is not None and longitude is not None:
+        if gps.get(_GPS_LATITUDE_REF) == "S":
+            latitude = -latitude
+        if gps.get(_GPS_LONGITUDE_REF) == "W":
+            longitude = -longitude
+        if -90 <= latitude <= 90 and -180 <= longitude <= 180:
+            meta["latitude"] = latitude
+            meta["longitude"] = longitude
+
+    altitude = _to_float(gps.get(_GPS_ALTITUDE))
+    if altitude is not None and gps.get(_GPS_ALTITUDE_REF) in (1, b"\x01"):
+        altitude = -altitude
+    meta["altitude"] = altitude
+    meta["heading"] = _to_float(gps.get(_GPS_IMG_DIRECTION))
+    return meta
+
+
+def apply_image_meta(route_file: RouteFile, meta: dict) -> None:
+    """Переносит данные EXIF в запись о файле и вычисляет ячейку пространственного индекса"""
+    route_file.latitude = meta["latitude"]
+    route_file.longitude = meta["longitude"]
+    route_file.altitude = meta["altitude"]
+    route_file.heading = meta["heading"]
+    route_file.taken_at = meta["taken_at"]
+    route_file.geo_cell = geo_cell(meta["latitude"], meta["longitude"])
@@ -0,0 +1,155 @@
+"""
+Экспорт маршрута для передачи результатов: ZIP с обработанными изображениями
+и описанием детекций (detections.csv и manifest.json)
+"""
+import csv
+import hashlib
+import io
+import json
+from datetime import datetime
+from pathlib import PurePosixPath
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.detection import Detection
+from app.models.route import Route
+from app.models.route_file import RouteFile
+from app.services.classes import CLASS_NAMES
+from app.services.storage import PROCESSED_FORMATS, checksum_file, file_processed_path
+from app.services.zip_stream import ZipEntry, ZipStream
+
+DETECTIONS_CSV_NAME = "detections.csv"
+MANIFEST_NAME = "manifest.json"
+_CSV_COLUMNS = (
+    "file", "original_name", "class_id", "class_name", "confidence",
+    "x1", "y1", "x2", "y2", "latitude", "longitude",
+)
+
+
+async def ensure_export_checksums(session: AsyncSession, route_files: list[RouteFile]) -> None:
+    """
+    Дополняет размер и CRC-32 обработанных изображений, сохраненных до их учета при загрузке
+
+    Считается один раз: значения сохраняются в БД, следующие экспорты файлы не читают.
+    """
+    missing = [f for f in route_files if f.processed_crc32 is None or f.processed_size is None]
+    for route_file in missing:
+        path = file_processed_path(route_file)
+        if path.exists():
+            _, route_file.processed_crc32, route_file.processed_size = await run_in_threadpool(checksum_file, path)
+    if missing:
+        await session.commit()
+
+
+def _entry_name(route_file: RouteFile, used: set[str]) -> str:
+    """Имя изображения в архиве: исходное имя (с подкаталогами) и расширение обработанного формата"""
+    suffix = PROCESSED_FORMATS[route_file.processed_format or "jpeg"][0]
+    parts = [
+        part for part in PurePosixPath(route_file.original_name.replace("\\", "/")).parts
+        if part not in ("/", ".", "..")
+    ]
+    stem = str(PurePosixPath(*parts).with_suffix("")) if parts else route_file.id
+    name = f"images/{stem}{suffix}"
+    if name in used:
+        # a.jpg и a.png дают одно имя — различаем по ID файла
+        name = f"images/{stem}_{route_file.id[:8]}{suffix}"
+    used.add(name)
+    return name
+
+
+def _isoformat(value: datetime | None) -> str | None:
+    return value.isoformat() if value else None
+
+
+def build_route_export(
+    route: Route,
+    route_files: list[RouteFile],
+    detections: list[Detection],
+) -> tuple[ZipStream, str]:
+    """
+    Собирает раскладку архива маршрута
+
+    Архив детерминирован для одного и того же состояния маршрута, поэтому повторный запрос
+    с Range продолжает ту же последовательность байт.
+
+    Returns:
+        (архив, ETag)
+    """
+    by_file: dict[str, list[Detection]] = {}
+    for detection in detections:
+        by_file.setdefault(detection.file_id, []).append(detection)
+
+    entries: list[ZipEntry] = []
+    used: set[str] = set()
+    csv_buffer = io.StringIO()
+    writer = csv.writer(csv_buffer)
+    writer.writerow(_CSV_COLUMNS)
+    manifest_files = []
+    for route_file in route_files:
+        if route_file.processed_size is None or route_file.processed_crc32 is None:
+            # Обработанного изображения нет на диске
+            continue
+        name = _entry_name(route_file, used)
+        entries.append(ZipEntry(
+            name,
+            route_file.processed_size,
+            route_file.processed_crc32,
+            route_file.created_at,
+            path=file_processed_path(route_file),
+        ))
+        file_detections = by_file.get(route_file.id, [])
+        for detection in file_detections:
+            writer.writerow((
+                name,
+                route_file.original_name,
+                detection.class_id,
+                CLASS_NAMES.get(detection.class_id, f"class_{detection.class_id}"),
+                round(detection.confidence, 4),
+                round(detection.x1, 1),
+                round(detection.y1, 1),
+                round(detection.x2, 1),
+                round(detection.y2, 1),
+                detection.latitude,
+                detection.longitude,
+            ))
+        manifest_files.append({
+            "file": name,
+            "file_id": route_file.id,
+            "original_name": route_file.original_name,
+            "taken_at": _isoformat(route_file.taken_at),
+            "latitude": route_file.latitude,
+            "longitude": route_file.longitude,
+            "altitude": route_file.altitude,
+            "heading": route_file.heading,
+            "red_detection_count": route_file.red_detection_count,
+            "green_detection_count": route_file.green_detection_count,
+            "total_detections": route_file.total_detections,
+            "detections": [
+                {
+                    "class_id": detection.class_id,
+                    "class_name": CLASS_NAMES.get(detection.class_id, f"class_{detection.class_id}"),
+                    "confidence": round(detection.confidence, 4),
+                    "bbox": [round(detection.x1, 1), round(detection.y1, 1),
+                             round(detection.x2, 1), round(detection.y2, 1)],
+                }
+                for detection in file_detections
+            ],
+        })
+
+    manifest = {
+        "route": {"id": route.id, "name": route.name, "description": route.description},
+        "file_count": len(manifest_files),
+        "files": manifest_files,
+    }
+    # Время описаний — время последнего файла, чтобы архив не менялся между запросами
+    modified = max((route_file.created_at for route_file in route_files), default=datetime(1980, 1, 1))
+    entries.append(ZipEntry.from_bytes(DETECTIONS_CSV_NAME, csv_buffer.getvalue().encode("utf-8-sig"), modified))
+    entries.append(ZipEntry.from_bytes(
+        MANIFEST_NAME, json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8"), modified
+    ))
+
+    fingerprint = hashlib.sha256()
+    for entry in entries:
+        fingerprint.update(f"{entry.name}\0{entry.size}\0{entry.crc32}\0{entry.modified.isoformat()}\n".encode())
+    return ZipStream(entries), f'"{fingerprint.hexdigest()[:32]}"'
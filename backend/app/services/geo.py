@@ -0,0 +1,90 @@
+import math
+
+# Размер ячейки сеточного пространственного индекса (~1.1 км по широте).
+# Значение хранится в БД в виде номера ячейки, поэтому менять его без переиндексации нельзя.
+GEO_CELL_DEGREES = 0.01
+_GRID_COLUMNS = math.ceil(360 / GEO_CELL_DEGREES)
+
+# Если прямоугольник запроса покрывает больше строк сетки, выгоднее фильтр по координатам
+MAX_CELL_ROWS = 256
+
+EARTH_RADIUS_M = 6_371_000.0
+
+
+def _row(latitude: float) -> int:
+    return int(math.floor((latitude + 90.0) / GEO_CELL_DEGREES))
+
+
+def _column(longitude: float) -> int:
+    return min(int(math.floor((longitude + 180.0) / GEO_CELL_DEGREES)), _GRID_COLUMNS - 1)
+
+
+def geo_cell(latitude: float | None, longitude: float | None) -> int | None:
+    """Номер ячейки сетки для точки"""
+    if latitude is None or longitude is None:
+        return None
+    return _row(latitude) * _GRID_COLUMNS + _column(longitude)
+
+
+def cell_ranges(min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> list[tuple[int, int]] | None:
+    """
+    Диапазоны номеров ячеек, покрывающие прямоугольник: по одному на строку сетки
+
+    Returns:
+        list: пары (первая ячейка, последняя ячейка) или None, если прямоугольник слишком большой
+    """
+    first_row, last_row = _row(min_lat), _row(max_lat)
+    if last_row - first_row + 1 > MAX_CELL_ROWS:
+        return None
+    first_column, last_column = _column(min_lon), _column(max_lon)
+    return [
+        (row * _GRID_COLUMNS + first_column, row * _GRID_COLUMNS + last_column)
+        for row in range(first_row, last_row + 1)
+    ]
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Расстояние между точками по поверхности Земли, в метрах"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def bbox_for_radius(latitude: float, longitude: float, radius_m: float) -> list[tuple[float, float, float, float]]:
+    """
+    Прямоугольники (min_lat, min_lon, max_lat, max_lon), покрывающие круг
+
+    Обычно один; если круг пересекает меридиан ±180°, по долготе он делится на два.
+    Если круг захватывает полюс, по долготе берется вся окружность.
+    """
+    d_lat = math.degrees(radius_m / EARTH_RADIUS_M)
+    min_lat, max_lat = max(latitude - d_lat, -90.0), min(latitude + d_lat, 90.0)
+    if min_lat <= -90.0 or max_lat >= 90.0:
+        return [(min_lat, -180.0, max_lat, 180.0)]
+    # Наибольшее отклонение по долготе у точек касания меридианов с кругом
+    ratio = math.sin(radius_m / EARTH_RADIUS_M) / math.cos(math.radians(latitude))
+    if ratio >= 1.0:
+        return [(min_lat, -180.0, max_lat, 180.0)]
+    d_lon = math.degrees(math.asin(ratio))
+    min_lon, max_lon = longitude - d_lon, longitude + d_lon
+    if min_lon < -180.0:
+        min_lon += 360.0
+    if max_lon > 180.0:
+        max_lon -= 360.0
+    return split_bbox(min_lat, min_lon, max_lat, max_lon)
+
+
+def split_bbox(
+    min_lat: float, min_lon: float, max_lat: float, max_lon: float
+) -> list[tuple[float, float, float, float]]:
+    """
+    Прямоугольник запроса в виде прямоугольников без перехода через меридиан ±180°
+
+    min_lon > max_lon означает прямоугольник, пересекающий меридиан ±180° (от min_lon на восток
+    до max_lon): он делится на части до 180° и от -180°.
+    """
+    if min_lon > max_lon:
+        return [(min_lat, min_lon, max_lat, 180.0), (min_lat, -180.0, max_lat, max_lon)]
+    return [(min_lat, min_lon, max_lat, max_lon)]
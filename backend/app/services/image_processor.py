@@ -1,49 +1,286 @@
+import threading
+import time
 import numpy as np
 import cv2
 from io import BytesIO
 from pathlib import Path
-from typing import Tuple, Optional
-from PIL import Image
+from typing import Tuple, Optional, Union
+from PIL import Image, ImageOps
 import onnxruntime as ort
 
+from app.core.config import settings
+from app.services.classes import CLASS_NAMES, DEFECT_CLASS_IDS
+from app.services.storage import PROCESSED_FORMATS, is_image_filename
+
+# Маркеры JPEG с метаданными, которые не попадают в обработанный кадр:
+# APP1 (EXIF с координатами GPS, XMP), APP13 (IPTC) и комментарий
+_JPEG_METADATA_MARKERS = {0xE1, 0xED, 0xFE}
+# Тег ориентации EXIF
+_EXIF_ORIENTATION = 0x0112
+
+# Типы тензоров ONNX, для которых буферы выделяются заранее
+_ORT_NUMPY_TYPES = {
+    'tensor(float)': np.float32,
+    'tensor(uint8)': np.uint8,
+    'tensor(float16)': np.float16,
+    'tensor(double)': np.float64,
+    'tensor(int64)': np.int64,
+    'tensor(int32)': np.int32,
+}
+
+
+class _SessionBinding:
+    """
+    IOBinding одной сессии для одного потока: буферы выходов выделяются один раз
+    
+    Выходы ORT пишет в заранее выделенные массивы, поэтому повторные запуски не выделяют
+    память под тензоры. Вход в нужном формате (тип входа модели, непрерывный — как после
+    preprocess_image) привязывается без копирования; остальное приводится в собственный
+    буфер входа. Выходы с неизвестной заранее формой (кроме размера батча) ORT выделяет
+    сам на каждый запуск.
+    """
+    
+    def __init__(self, session: ort.InferenceSession, input_shape: Tuple[int, ...]):
+        self.session = session
+        self.binding = session.io_binding()
+        model_input = session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.input_dtype = _ORT_NUMPY_TYPES.get(model_input.type, np.float32)
+        self.input_shape = input_shape
+        self._input: Optional[np.ndarray] = None
+        self._input_value: Optional[ort.OrtValue] = None
+        
+        self.outputs: Optional[list[np.ndarray]] = None
+        outputs = session.get_outputs()
+        shapes = [self._output_shape(output.shape, input_shape[0]) for output in outputs]
+        if all(shape is not None and output.type in _ORT_NUMPY_TYPES for shape, output in zip(shapes, outputs)):
+            self.outputs = [
+                np.empty(shape, dtype=_ORT_NUMPY_TYPES[output.type]) for shape, output in zip(shapes, outputs)
+            ]
+            self._output_values = [ort.OrtValue.ortvalue_from_numpy(array) for array in self.outputs]
+            for output, value in zip(outputs, self._output_values):
+                self.binding.bind_ortvalue_output(output.name, value)
+        else:
+            for output in outputs:
+                self.binding.bind_output(output.name, 'cpu')
+    
+    @staticmethod
+    def _output_shape(shape: list, batch_size: int) -> Optional[Tuple[int, ...]]:
+        # Символьная первая размерность — батч, она равна батчу входа
+        resolved = [batch_size if i == 0 and not isinstance(dim, int) else dim for i, dim in enumerate(shape)]
+        if not all(isinstance(dim, int) and dim > 0 for dim in resolved):
+            return None
+        return tuple(resolved)
+    
+    def run(self, preprocessed: np.ndarray) -> list[np.ndarray]:
+        """
+        Инференс; возвращаемые массивы перезаписываются следующим запуском в этом потоке,
+        поэтому результат нужно разобрать до него
+        """
+        if preprocessed.dtype == self.input_dtype and preprocessed.flags.c_contiguous:
+            self.binding.bind_cpu_input(self.input_name, preprocessed)
+        else:
+            if self._input is None:
+                self._input = np.empty(self.input_shape, dtype=self.input_dtype)
+                self._input_value = ort.OrtValue.ortvalue_from_numpy(self._input)
+            np.copyto(self._input, preprocessed)
+            self.binding.bind_ortvalue_input(self.input_name, self._input_value)
+        try:
+            self.session.run_with_iobinding(self.binding)
+        finally:
+            # Привязка не должна держать указатель на чужой массив после запуска
+            self.binding.clear_binding_inputs()
+        if self.outputs is None:
+            return self.binding.copy_outputs_to_cpu()
+        return self.outputs
+
 
 class ImageProcessor:
     """Класс для обработки изображений через ONNX модель"""
     
-    def __init__(self, model_path: Optional[Path] = None):
+    def __init__(
+        self,
+        model_path: Optional[Path] = None,
+        model_version: Optional[str] = None,
+        intra_op_num_threads: int = 0,
+        cascade: bool = False,
+        cascade_model_path: Optional[Path] = None,
+        cascade_threshold: float = 0.1,
+        inference_server: Optional[str] = None,
+    ):
         """
         Инициализация процессора изображений
         
         Args:
             model_path: Путь к ONNX модели. Если None, используется путь по умолчанию.
+            model_version: Версия модели, сохраняется с результатами. Если None — имя файла модели.
+            intra_op_num_threads: Число потоков ONNX Runtime на один инференс (0 — по умолчанию ORT).
+            cascade: Каскадный режим — сначала дешевый проход, пустые кадры дальше не обрабатываются.
+            cascade_model_path: Меньшая модель для дешевого прохода. Без нее (и без модели каскада
+                на сервере инференса) каскад выключается: проход основной моделью ничего не экономит.
+            cascade_threshold: Минимальная уверенность кандидата в дешевом проходе.
+            inference_server: Адреса сервера инференса (app.services.inference_server). Если задан,
+                сессии ONNX (и модель каскада) — на сервере, model_path и cascade_model_path не нужны.
         """
         if model_path is None:
             # Путь к модели относительно корня проекта
             root_dir = Path(__file__).parent.parent.parent.parent
             model_path = root_dir / "ai" / "best.onnx"
         
+        session_options = ort.SessionOptions()
+        if intra_op_num_threads > 0:
+            session_options.intra_op_num_threads = intra_op_num_threads
+        
+        remote_cascade = None
+        if inference_server:
+            from app.services.inference_rpc import connect_inference_server
+            
+            self.session, remote_cascade = connect_inference_server(inference_server)
+            self.model_version = model_version or self.session.version
+        else:
+            self.session = self._create_session(model_path, session_options)
+            self.model_version = model_version or model_path.stem
+        
+        # Получаем размер и формат входного изображения из модели
+        self.uint8_input, self.input_height, self.input_width = self._input_layout(self.session, (640, 640))
+        
+        # Каскад: отдельная сессия меньшей модели
+        self.cascade_threshold = cascade_threshold
+        self.cascade_session = self.session
+        if cascade and remote_cascade is not None:
+            self.cascade_session = remote_cascade
+        elif cascade and cascade_model_path is not None and not inference_server:
+            self.cascade_session = self._create_session(cascade_model_path, session_options)
+        elif cascade:
+            # Дешевый проход той же моделью стоил бы второго полного инференса на каждом непустом кадре
+            print("⚠️ Каскадный режим выключен: не задана меньшая модель для дешевого прохода (cascade_model_path)")
+            cascade = False
+        self.cascade = cascade
+        self.cascade_uint8_input, self.cascade_height, self.cascade_width = self._input_layout(
+            self.cascade_session, (self.input_height, self.input_width)
+        )
+        self._cascade_lock = threading.Lock()
+        self._cascade_frames = 0
+        self._cascade_empty = 0
+        self._cascade_seconds = 0.0
+        self._full_frames = 0
+        self._full_seconds = 0.0
+        
+        # Счетчик выполняющихся инференсов — нужен для корректной остановки воркера
+        self._inflight = 0
+        self._inflight_cond = threading.Condition()
+        
+        # IOBinding не потокобезопасен: у каждого потока свои привязки и буферы на каждую сессию
+        # Удаленные сессии выделяют буферы сами (в разделяемой памяти соединения)
+        self.io_binding = settings.inference_io_binding and not inference_server
+        self._thread_bindings = threading.local()
+    
+    @staticmethod
+    def _input_layout(session: ort.InferenceSession, default_size: Tuple[int, int]) -> Tuple[bool, int, int]:
+        """
+        Формат входа модели: (uint8 NHWC, высота, ширина)
+        
+        Обычная модель принимает float32 NCHW RGB в [0, 1]. Вариант с предобработкой в графе
+        (app.services.model_fuse) принимает кадр после letterbox как есть: uint8 NHWC BGR.
+        """
+        model_input = session.get_inputs()[0]
+        shape = model_input.shape
+        if model_input.type == 'tensor(uint8)':
+            height = shape[1] if len(shape) > 1 and isinstance(shape[1], int) else default_size[0]
+            width = shape[2] if len(shape) > 2 and isinstance(shape[2], int) else default_size[1]
+            return True, height, width
+        height = shape[2] if len(shape) > 2 else default_size[0]
+        width = shape[3] if len(shape) > 3 else default_size[1]
+        return False, height, width
+    
+    @staticmethod
+    def _create_session(model_path: Path, session_options: ort.SessionOptions) -> ort.InferenceSession:
         if not model_path.exists():
             raise FileNotFoundError(f"Модель не найдена: {model_path}")
         
         # Определяем провайдер (CUDA если доступно, иначе CPU)
         providers = ['CUDAExecutionProvider', 'CPUExecutionProvider']
         try:
-            self.session = ort.InferenceSession(str(model_path), providers=providers)
+            return ort.InferenceSession(str(model_path), session_options, providers=providers)
         except Exception as e:
             # Если CUDA недоступен, используем только CPU
-            self.session = ort.InferenceSession(str(model_path), providers=['CPUExecutionProvider'])
+            return ort.InferenceSession(
+                str(model_path), session_options, providers=['CPUExecutionProvider']
+            )
+    
+    def _session_binding(self, session: ort.InferenceSession, input_shape: Tuple[int, ...]) -> _SessionBinding:
+        bindings = getattr(self._thread_bindings, 'items', None)
+        if bindings is None:
+            bindings = self._thread_bindings.items = {}
+        key = (id(session), input_shape)
+        binding = bindings.get(key)
+        if binding is None:
+            binding = bindings[key] = _SessionBinding(session, input_shape)
+        return binding
+    
+    def _run_session(self, preprocessed: np.ndarray, session: Optional[ort.InferenceSession] = None) -> list:
+        """
+        Запускает инференс, учитывая его в счетчике выполняющихся
         
-        # Получаем размер входного изображения из модели
-        input_shape = self.session.get_inputs()[0].shape
-        self.input_height = input_shape[2] if len(input_shape) > 2 else 640
-        self.input_width = input_shape[3] if len(input_shape) > 3 else 640
+        С IOBinding выходы — буферы потока, которые перезапишет следующий инференс в этом
+        потоке: вызывающий код разбирает их сразу (postprocess, cascade_score).
+        """
+        session = session or self.session
+        with self._inflight_cond:
+            self._inflight += 1
+        try:
+            if self.io_binding:
+                return self._session_binding(session, preprocessed.shape).run(preprocessed)
+            input_name = session.get_inputs()[0].name
+            return session.run(None, {input_name: preprocessed})
+        finally:
+            with self._inflight_cond:
+                self._inflight -= 1
+                self._inflight_cond.notify_all()
+    
+    @property
+    def inflight(self) -> int:
+        """Количество выполняющихся сейчас инференсов"""
+        return self._inflight
+    
+    def wait_idle(self, timeout: float) -> bool:
+        """
+        Ждет завершения всех выполняющихся инференсов
+        
+        Returns:
+            bool: True, если процессор освободился до истечения таймаута
+        """
+        deadline = time.monotonic() + timeout
+        with self._inflight_cond:
+            while self._inflight > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._inflight_cond.wait(remaining)
+        return True
     
-    def preprocess_image(self, image: Image.Image) -> Tuple[np.ndarray, Tuple[int, int], float, Tuple[int, int, int, int]]:
+    def warmup(self) -> None:
+        """Прогоняет пустой кадр, чтобы ORT заранее выделил память и подготовил ядра"""
+        if self.uint8_input:
+            dummy = np.zeros((1, self.input_height, self.input_width, 3), dtype=np.uint8)
+        else:
+            dummy = np.zeros((1, 3, self.input_height, self.input_width), dtype=np.float32)
+        self._run_session(dummy)
+    
+    def preprocess_image(
+        self,
+        image: np.ndarray,
+        input_size: Optional[Tuple[int, int]] = None,
+        uint8_input: Optional[bool] = None,
+    ) -> Tuple[np.ndarray, Tuple[int, int], float, Tuple[int, int, int, int]]:
         """
         Предобработка изображения для модели
         
         Args:
-            image: PIL изображение
+            image: изображение в формате OpenCV (BGR, HWC, uint8)
+            input_size: (width, height) входа модели; по умолчанию — основной модели
+            uint8_input: модель с предобработкой в графе — вернуть кадр после letterbox
+                (uint8 NHWC BGR) без нормализации; по умолчанию — как у основной модели
             
         Returns:
             Tuple содержащий:
@@ -52,66 +289,176 @@ class ImageProcessor:
             - scale: коэффициент масштабирования
             - padding: (left, top, right, bottom)
         """
-        orig_size = image.size  # (width, height)
-        img_w, img_h = orig_size
+        input_width, input_height = input_size or (self.input_width, self.input_height)
+        img_h, img_w = image.shape[:2]
+        orig_size = (img_w, img_h)
         
         # Вычисляем масштаб для сохранения пропорций
-        scale = min(self.input_width / img_w, self.input_height / img_h)
+        scale = min(input_width / img_w, input_height / img_h)
         new_w = int(img_w * scale)
         new_h = int(img_h * scale)
         
-        # Изменяем размер изображения
-        resized = image.resize((new_w, new_h), Image.Resampling.LANCZOS)
-        
-        # Создаем новое изображение с padding (серый фон)
-        padded = Image.new('RGB', (self.input_width, self.input_height), (128, 128, 128))
-        
         # Вычисляем отступы для центрирования
-        left_pad = (self.input_width - new_w) // 2
-        top_pad = (self.input_height - new_h) // 2
-        right_pad = self.input_width - new_w - left_pad
-        bottom_pad = self.input_height - new_h - top_pad
+        left_pad = (input_width - new_w) // 2
+        top_pad = (input_height - new_h) // 2
+        right_pad = input_width - new_w - left_pad
+        bottom_pad = input_height - new_h - top_pad
         
-        # Вставляем изображение в центр
-        padded.paste(resized, (left_pad, top_pad))
+        # Изменяем размер изображения
+        interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+        resized = cv2.resize(image, (new_w, new_h), interpolation=interpolation)
         
-        # Конвертируем в numpy array и нормализуем
-        img_array = np.array(padded, dtype=np.float32)
-        img_array = img_array / 255.0  # Нормализация в диапазон [0, 1]
+        # Вставляем изображение в центр холста с padding (серый фон)
+        padded = np.full((input_height, input_width, 3), 128, dtype=np.uint8)
+        padded[top_pad:top_pad + new_h, left_pad:left_pad + new_w] = resized
+        padding = (left_pad, top_pad, right_pad, bottom_pad)
         
-        # Транспонируем в формат CHW (channels, height, width)
-        img_array = np.transpose(img_array, (2, 0, 1))
+        if self.uint8_input if uint8_input is None else uint8_input:
+            # Приведение к float, /255, BGR -> RGB и HWC -> CHW выполняет сам граф модели
+            return padded[np.newaxis], orig_size, scale, padding
         
-        # Добавляем batch dimension
-        img_array = np.expand_dims(img_array, axis=0)
+        # Нормализация в [0, 1], BGR -> RGB, HWC -> CHW и batch dimension за один проход
+        img_array = cv2.dnn.blobFromImage(padded, scalefactor=1.0 / 255.0, swapRB=True)
         
-        return img_array, orig_size, scale, (left_pad, top_pad, right_pad, bottom_pad)
+        return img_array, orig_size, scale, padding
     
-    def process_image(self, image_bytes: bytes) -> dict:
+    def decode_image(self, image_bytes: bytes) -> np.ndarray:
         """
-        Обрабатывает изображение через ONNX модель и рисует детекции
+        Декодирует изображение один раз сразу в буфер BGR, на котором потом рисуются детекции
+        
+        Ориентация из EXIF применяется при декодировании (OpenCV делает это по умолчанию),
+        поэтому повернутые кадры попадают в модель в правильном положении.
         
         Args:
             image_bytes: Байты изображения
             
         Returns:
-            bytes: Байты обработанного изображения с нарисованными детекциями
+            np.ndarray: изображение (BGR, HWC, uint8)
+        """
+        image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            # Форматы, которые OpenCV не читает, декодируем через PIL
+            pil_image = ImageOps.exif_transpose(Image.open(BytesIO(image_bytes))).convert('RGB')
+            image = cv2.cvtColor(np.asarray(pil_image), cv2.COLOR_RGB2BGR)
+        return image
+    
+    @staticmethod
+    def is_jpeg(image_bytes: bytes) -> bool:
+        return image_bytes[:3] == b'\xff\xd8\xff'
+    
+    @staticmethod
+    def strip_jpeg_metadata(image_bytes: bytes) -> Optional[bytes]:
+        """
+        JPEG без сегментов с метаданными (_JPEG_METADATA_MARKERS), данные изображения не трогаются
+        
+        Returns:
+            bytes или None, если кадр повернут по EXIF (без EXIF он отобразится иначе)
+            или заголовок не разбирается
+        """
+        try:
+            orientation = Image.open(BytesIO(image_bytes)).getexif().get(_EXIF_ORIENTATION, 1)
+        except Exception:
+            return None
+        if orientation != 1:
+            return None
+        
+        parts = [image_bytes[:2]]
+        pos = 2
+        # Метаданные идут в сегментах APPn и COM перед таблицами и кадром
+        while pos + 4 <= len(image_bytes) and image_bytes[pos] == 0xFF:
+            marker = image_bytes[pos + 1]
+            if not (0xE0 <= marker <= 0xEF or marker == 0xFE):
+                break
+            end = pos + 2 + int.from_bytes(image_bytes[pos + 2:pos + 4], "big")
+            if end > len(image_bytes):
+                return None
+            if marker not in _JPEG_METADATA_MARKERS:
+                parts.append(image_bytes[pos:end])
+            pos = end
+        else:
+            return None
+        parts.append(image_bytes[pos:])
+        return b"".join(parts)
+    
+    def reduction_factor(self, image_bytes: bytes, input_size: Optional[Tuple[int, int]] = None) -> int:
+        """
+        Наибольший коэффициент уменьшения JPEG (1, 2, 4, 8), при котором
+        уменьшенное изображение все еще не меньше входа модели
+        """
+        input_width, input_height = input_size or (self.input_width, self.input_height)
+        if not self.is_jpeg(image_bytes):
+            return 1
+        try:
+            # PIL читает только заголовок, пиксели не декодируются
+            img_w, img_h = Image.open(BytesIO(image_bytes)).size
+        except Exception:
+            return 1
+        
+        # Учитываем, что EXIF-поворот может поменять ширину и высоту местами
+        scale = max(
+            min(input_width / img_w, input_height / img_h),
+            min(input_width / img_h, input_height / img_w),
+        )
+        for factor in (8, 4, 2):
+            if factor * scale <= 1:
+                return factor
+        return 1
+    
+    def decode_for_model(
+        self,
+        image_bytes: bytes,
+        input_size: Optional[Tuple[int, int]] = None,
+    ) -> Tuple[np.ndarray, bool]:
+        """
+        Декодирует изображение в минимальном разрешении, достаточном для модели
+        
+        Для JPEG используется масштабирование в DCT-области (IMREAD_REDUCED_*),
+        поэтому большая часть работы полного декодирования не выполняется.
+        
+        Returns:
+            Tuple содержащий:
+            - image: изображение (BGR, HWC, uint8)
+            - is_full: True, если изображение декодировано в полном разрешении
         """
-        # Загружаем изображение
-        image = Image.open(BytesIO(image_bytes))
-        original_size = image.size  # (width, height)
+        reduced_flags = {
+            2: cv2.IMREAD_REDUCED_COLOR_2,
+            4: cv2.IMREAD_REDUCED_COLOR_4,
+            8: cv2.IMREAD_REDUCED_COLOR_8,
+        }
+        factor = self.reduction_factor(image_bytes, input_size)
+        if factor > 1:
+            image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), reduced_flags[factor])
+            if image is not None:
+                return image, False
+        return self.decode_image(image_bytes), True
+    
+    @staticmethod
+    def rescale_detections(batch_detections: list[dict], scale_x: float, scale_y: float) -> None:
+        """Переводит боксы детекций из уменьшенного изображения в полное"""
+        for detection in batch_detections:
+            x1, y1, x2, y2 = detection['bbox']
+            detection['bbox'] = [x1 * scale_x, y1 * scale_y, x2 * scale_x, y2 * scale_y]
+    
+    def detect(self, image: np.ndarray) -> list[dict]:
+        """
+        Запускает модель на изображении
         
+        Args:
+            image: изображение (BGR, HWC, uint8)
+            
+        Returns:
+            list: детекции в координатах изображения (bbox, conf, class_id)
+        """
         # Предобрабатываем изображение
         preprocessed, orig_size, scale, padding = self.preprocess_image(image)
         
         # Запускаем инференс
-        input_name = self.session.get_inputs()[0].name
-        outputs = self.session.run(None, {input_name: preprocessed})
-        
-        # Конвертируем изображение в OpenCV формат для рисования
-        img_cv = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-        img_w, img_h = original_size
-        
+        return self.infer(preprocessed, scale, padding)
+    
+    def postprocess(self, outputs: list, scale: float, padding: Tuple[int, int, int, int]) -> list[dict]:
+        """
+        Декодирует выход YOLO, применяет порог уверенности, NMS и переводит боксы в координаты изображения
+        """
         # YOLO ONNX модели возвращают raw predictions
         predictions = outputs[0] if len(outputs) > 0 else None
         
@@ -246,17 +593,13 @@ class ImageProcessor:
                 except Exception as e:
                     print(f"❌ Ошибка в NMS: {e}")
         
-        # Названия классов
-        class_names = {
-            0: "vibration_damper",
-            1: "festoon_insulators",
-            2: "traverse",
-            3: "nest",
-            4: "safety_sign+",
-            5: "bad_insulator",
-            6: "damaged_insulator",
-            7: "polymer_insulators"
-        }
+        return batch_detections
+    
+    def annotate(self, img_cv: np.ndarray, batch_detections: list[dict]) -> None:
+        """
+        Рисует детекции прямо в переданном буфере (BGR), без копирования изображения
+        """
+        img_h, img_w = img_cv.shape[:2]
         
         # Отрисовываем детекции на оригинальном изображении
         for detection in batch_detections:
@@ -281,7 +624,7 @@ class ImageProcessor:
                 continue
             
             # Выбираем цвет в зависимости от класса (красный для повреждений)
-            if class_id in [5, 6]:  # bad_insulator, damaged_insulator
+            if class_id in DEFECT_CLASS_IDS:  # bad_insulator, damaged_insulator
                 color = (0, 0, 255)  # Красный
                 thickness = 3
             else:
@@ -292,7 +635,7 @@ class ImageProcessor:
             cv2.rectangle(img_cv, (int(x1), int(y1)), (int(x2), int(y2)), color, thickness)
             
             # Добавляем текст с классом и уверенностью
-            class_name = class_names.get(class_id, f"Class {class_id}")
+            class_name = CLASS_NAMES.get(class_id, f"Class {class_id}")
             label = f"{class_name}: {conf:.2f}"
             
             # Размер шрифта адаптивный к размеру изображения
@@ -319,59 +662,233 @@ class ImageProcessor:
                 img_cv, label, (text_x, text_y - baseline - 3),
                 cv2.FONT_HERSHEY_SIMPLEX, font_scale, (255, 255, 255), thickness_text
             )
+    
+    def encode_image(self, image: np.ndarray, output_path: Optional[Path] = None) -> Union[np.ndarray, None]:
+        """
+        Кодирует изображение в формат из настроек (JPEG или WebP)
         
-        # Конвертируем обратно в PIL и затем в байты
-        img_rgb = cv2.cvtColor(img_cv, cv2.COLOR_BGR2RGB)
-        processed_image = Image.fromarray(img_rgb)
+        Args:
+            image: изображение (BGR, HWC, uint8)
+            output_path: если указан, закодированный буфер записывается прямо в файл
+            
+        Returns:
+            np.ndarray: закодированный буфер, если output_path не указан
+        """
+        output_format = settings.processed_format
+        if output_format == "webp":
+            params = [cv2.IMWRITE_WEBP_QUALITY, settings.processed_quality]
+        else:
+            params = [
+                cv2.IMWRITE_JPEG_QUALITY, settings.processed_quality,
+                cv2.IMWRITE_JPEG_PROGRESSIVE, int(settings.jpeg_progressive),
+                cv2.IMWRITE_JPEG_OPTIMIZE, int(settings.jpeg_optimize),
+            ]
+        
+        suffix, _ = PROCESSED_FORMATS[output_format]
+        ok, encoded = cv2.imencode(suffix, image, params)
+        if not ok:
+            raise RuntimeError(f"Не удалось закодировать изображение в {output_format}")
         
+        if output_path is None:
+            return encoded
+        
+        # numpy-буфер пишется в файл напрямую, без промежуточного объекта bytes
+        with open(output_path, "wb") as f:
+            f.write(encoded.data)
+        return None
+    
+    @staticmethod
+    def summarize(batch_detections: list[dict]) -> dict:
+        """Статистика детекций для сохранения в метаданных"""
         # Подсчитываем дефекты (классы 5 и 6: bad_insulator, damaged_insulator) - красные детекции
-        red_detections = [det for det in batch_detections if det['class_id'] in [5, 6]]
-        red_count = len(red_detections)
-        has_red_detections = red_count > 0
+        red_count = sum(1 for det in batch_detections if det['class_id'] in DEFECT_CLASS_IDS)
         
         # Подсчитываем зеленые детекции (все остальные классы: 0-4, 7)
-        green_detections = [det for det in batch_detections if det['class_id'] not in [5, 6]]
-        green_count = len(green_detections)
-        has_green_detections = green_count > 0
+        green_count = len(batch_detections) - red_count
         
-        # Сохраняем в байты
-        output_buffer = BytesIO()
-        processed_image.save(output_buffer, format='JPEG', quality=95)
-        
-        # Возвращаем обработанное изображение и статистику
         return {
-            'image_bytes': output_buffer.getvalue(),
             'red_detection_count': red_count,
             'green_detection_count': green_count,
-            'has_red_detections': has_red_detections,
-            'has_green_detections': has_green_detections,
+            'has_red_detections': red_count > 0,
+            'has_green_detections': green_count > 0,
             'total_detections': len(batch_detections)
         }
     
-    def is_image_file(self, filename: str) -> bool:
-        """Проверяет, является ли файл изображением"""
-        image_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif', '.webp'}
-        return any(filename.lower().endswith(ext) for ext in image_extensions)
-
-
-# Глобальный экземпляр процессора (singleton)
-_image_processor: Optional[ImageProcessor] = None
-_processor_error: Optional[str] = None
-
-
-def get_image_processor() -> ImageProcessor:
-    """Получить глобальный экземпляр процессора изображений"""
-    global _image_processor, _processor_error
+    def prepare(self, image_bytes: bytes) -> Tuple[np.ndarray, bool, np.ndarray, float, Tuple[int, int, int, int]]:
+        """
+        Стадия декодирования: изображение для модели и входной тензор
+        
+        Returns:
+            Tuple содержащий:
+            - model_image: изображение, по которому считается инференс (BGR, HWC, uint8)
+            - is_full: True, если model_image декодировано в полном разрешении
+            - preprocessed: входной тензор модели
+            - scale, padding: параметры letterbox для postprocess
+        """
+        # Для модели декодируем в уменьшенном разрешении
+        model_image, is_full = self.decode_for_model(image_bytes)
+        preprocessed, _, scale, padding = self.preprocess_image(model_image)
+        return model_image, is_full, preprocessed, scale, padding
     
-    if _image_processor is None and _processor_error is None:
-        try:
-            _image_processor = ImageProcessor()
-        except Exception as e:
-            _processor_error = str(e)
-            raise RuntimeError(f"Не удалось инициализировать процессор изображений: {e}")
+    def infer(self, preprocessed: np.ndarray, scale: float, padding: Tuple[int, int, int, int]) -> list[dict]:
+        """Стадия инференса: детекции в координатах model_image"""
+        outputs = self._run_session(preprocessed)
+        return self.postprocess(outputs, scale, padding)
+    
+    def render(
+        self,
+        image_bytes: bytes,
+        model_image: Optional[np.ndarray],
+        is_full: bool,
+        batch_detections: list[dict],
+        output_path: Optional[Path] = None,
+    ) -> dict:
+        """
+        Стадия вывода: рисует детекции на изображении полного разрешения и кодирует результат
+        
+        Returns:
+            dict: результат в формате process_image
+        """
+        result = self.summarize(batch_detections)
+        result['format'] = settings.processed_format
+        result['model_version'] = self.model_version
+        result['detections'] = batch_detections
+        
+        # Без детекций рисовать нечего: JPEG сохраняется без декодирования и перекодирования,
+        # но без метаданных оригинала
+        stripped = None
+        if (
+            not batch_detections
+            and settings.jpeg_passthrough
+            and settings.processed_format == "jpeg"
+            and self.is_jpeg(image_bytes)
+        ):
+            stripped = self.strip_jpeg_metadata(image_bytes)
+        if stripped is not None:
+            if output_path is None:
+                result['image_bytes'] = stripped
+            else:
+                with open(output_path, "wb") as f:
+                    f.write(stripped)
+            return result
+        
+        # Полное разрешение нужно только для аннотированного изображения
+        if is_full:
+            img_cv = model_image
+        else:
+            img_cv = self.decode_image(image_bytes)
+            if batch_detections:
+                model_h, model_w = model_image.shape[:2]
+                full_h, full_w = img_cv.shape[:2]
+                self.rescale_detections(batch_detections, full_w / model_w, full_h / model_h)
+        del model_image
+        
+        # Рисуем прямо в декодированном буфере
+        self.annotate(img_cv, batch_detections)
+        
+        encoded = self.encode_image(img_cv, output_path)
+        if encoded is not None:
+            result['image_bytes'] = encoded.tobytes()
+        
+        return result
     
-    if _processor_error:
-        raise RuntimeError(f"Ошибка процессора изображений: {_processor_error}")
+    def process_image(self, image_bytes: bytes, output_path: Optional[Path] = None) -> dict:
+        """
+        Обрабатывает изображение через ONNX модель и рисует детекции
+        
+        Args:
+            image_bytes: Байты изображения
+            output_path: Куда записать обработанное изображение. Если None,
+                закодированное изображение возвращается в 'image_bytes'.
+            
+        Returns:
+            dict: статистика детекций, сами детекции ('detections', координаты полного изображения),
+            'format' обработанного изображения, 'model_version' и 'image_bytes' (только если output_path не указан)
+        """
+        if self.cascade and self.screen(image_bytes):
+            return self.render_empty(image_bytes, output_path)
+        
+        started = time.perf_counter()
+        model_image, is_full, preprocessed, scale, padding = self.prepare(image_bytes)
+        batch_detections = self.infer(preprocessed, scale, padding)
+        del preprocessed
+        result = self.render(image_bytes, model_image, is_full, batch_detections, output_path)
+        self.record_full_pass(time.perf_counter() - started)
+        return result
     
-    return _image_processor
-
+    def cascade_score(self, image_bytes: bytes) -> float:
+        """Максимальная уверенность кандидата по всем классам в дешевом проходе каскада"""
+        input_size = (self.cascade_width, self.cascade_height)
+        image, _ = self.decode_for_model(image_bytes, input_size)
+        preprocessed, _, _, _ = self.preprocess_image(image, input_size, self.cascade_uint8_input)
+        outputs = self._run_session(preprocessed, self.cascade_session)
+        
+        # Для решения достаточно максимальной уверенности по классам, NMS не нужен
+        predictions = outputs[0] if len(outputs) > 0 else None
+        if predictions is None or len(predictions.shape) != 3 or predictions.shape[1] <= 4:
+            # Неизвестный формат выхода — считаем, что кандидаты есть
+            return 1.0
+        return float(predictions[0, 4:].max())
+    
+    def screen(self, image_bytes: bytes) -> bool:
+        """
+        Дешевый проход каскада меньшей моделью (на ее входе, обычно меньшего разрешения)
+        
+        Returns:
+            bool: True, если на кадре нет ни одного кандидата выше порога (кадр пустой)
+        """
+        started = time.perf_counter()
+        empty = self.cascade_score(image_bytes) <= self.cascade_threshold
+        with self._cascade_lock:
+            self._cascade_frames += 1
+            self._cascade_empty += int(empty)
+            self._cascade_seconds += time.perf_counter() - started
+        return empty
+    
+    def render_empty(self, image_bytes: bytes, output_path: Optional[Path] = None) -> dict:
+        """Результат для кадра, отсеянного каскадом: без инференса основной моделью и разметки"""
+        result = self.render(image_bytes, None, False, [], output_path)
+        result['cascade_empty'] = True
+        return result
+    
+    def record_full_pass(self, seconds: float) -> None:
+        """Учитывает длительность полного прохода — по ней оценивается сэкономленное время"""
+        with self._cascade_lock:
+            self._full_frames += 1
+            self._full_seconds += seconds
+    
+    def cascade_stats(self) -> dict:
+        """
+        Статистика каскада с запуска процесса
+        
+        Доля сэкономленного времени оценивается по средней длительности полного прохода:
+        1 - (дешевые проходы + полные проходы) / (все кадры * средний полный проход).
+        Пустые кадры в обоих режимах одинаково копируются как есть, поэтому в оценку не входят.
+        """
+        with self._cascade_lock:
+            frames = self._cascade_frames
+            empty = self._cascade_empty
+            cascade_seconds = self._cascade_seconds
+            full_frames = self._full_frames
+            full_seconds = self._full_seconds
+        
+        saved = None
+        if frames and full_frames:
+            average_full = full_seconds / full_frames
+            baseline = frames * average_full
+            spent = cascade_seconds + (frames - empty) * average_full
+            saved = round(1 - spent / baseline, 3)
+        return {
+            "enabled": self.cascade,
+            "frames": frames,
+            "empty_frames": empty,
+            "empty_fraction": round(empty / frames, 3) if frames else None,
+            "cascade_seconds": round(cascade_seconds, 3),
+            "full_passes": full_frames,
+            "full_seconds": round(full_seconds, 3),
+            "compute_saved": saved,
+        }
+    
+    def is_image_file(self, filename: str) -> bool:
+        """Проверяет, является ли файл изображением"""
+        return is_image_filename(filename)
@@ -0,0 +1,328 @@
+"""
+Клиент отдельного сервера инференса (app.services.inference_server)
+
+Сообщение — заголовок JSON и данные тензоров: 8 байт с длинами заголовка и данных, затем они сами.
+По unix-сокету тензоры передаются через разделяемую память: у каждого соединения свой сегмент,
+клиент пишет в него вход, сервер — выходы, по сокету идут только заголовки. По TCP (другой хост)
+тензоры идут в самом сообщении.
+
+RemoteSession повторяет ту часть ort.InferenceSession, которой пользуется ImageProcessor
+(get_inputs, get_outputs, run), поэтому пред- и постобработка остаются в воркере, а сессии ONNX —
+на сервере. Адресов может быть несколько (через запятую): новые соединения распределяются по ним.
+
+Новое соединение начинается с приветствия с inference_server_token; в ответ сервер выдает префикс,
+с которого должны начинаться имена сегментов разделяемой памяти этого соединения.
+"""
+import itertools
+import json
+import os
+import secrets
+import socket
+import struct
+import threading
+import weakref
+from multiprocessing import shared_memory
+from typing import Any, NamedTuple, Optional
+
+import numpy as np
+
+from app.core.config import settings
+
+# Длина заголовка JSON и длина данных
+FRAME = struct.Struct("!II")
+# Выходы в разделяемой памяти начинаются с границы, удобной для SIMD
+_ALIGNMENT = 64
+# Сколько свободных соединений держать открытыми
+_MAX_IDLE_CONNECTIONS = 16
+
+
+class NodeArg(NamedTuple):
+    """Описание входа или выхода модели, как у onnxruntime.NodeArg"""
+    name: str
+    type: str
+    shape: list
+
+
+def parse_address(address: str) -> tuple[str, Any]:
+    """unix:///path/to.sock или tcp://host:port -> (семейство, адрес сокета)"""
+    address = address.strip()
+    if address.startswith("unix://"):
+        return "unix", address[len("unix://"):]
+    if address.startswith("tcp://"):
+        host, _, port = address[len("tcp://"):].rpartition(":")
+        if not host or not port.isdigit():
+            raise ValueError(f"Ожидается tcp://host:port: {address}")
+        return "tcp", (host.strip("[]"), int(port))
+    raise ValueError(f"Адрес сервера инференса должен начинаться с unix:// или tcp://: {address}")
+
+
+def describe_tensor(array: np.ndarray, offset: int) -> dict:
+    return {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset, "nbytes": array.nbytes}
+
+
+def tensor_from_buffer(buffer, spec: dict) -> np.ndarray:
+    """Массив поверх буфера (без копирования) по описанию из заголовка"""
+    # Не frombuffer().reshape(): вид на вид IOBinding ORT не отпускает, и сегмент потом не закрыть
+    array = np.ndarray(spec["shape"], dtype=np.dtype(spec["dtype"]), buffer=buffer, offset=spec["offset"])
+    if array.nbytes != spec["nbytes"]:
+        raise ValueError("Размер тензора не совпадает с формой")
+    return array
+
+
+def align(size: int) -> int:
+    return (size + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytearray:
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if not count:
+            raise ConnectionError("Сервер инференса закрыл соединение")
+        received += count
+    return data
+
+
+class _Connection:
+    """Соединение с сервером и его сегмент разделяемой памяти (только для unix-сокета)"""
+
+    def __init__(self, address: str, timeout: float):
+        family, target = parse_address(address)
+        self.pid = os.getpid()
+        if family == "unix":
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.sock = socket.socket(socket.AF_INET6 if ":" in target[0] else socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(target)
+        if family == "tcp":
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.local = family == "unix" and settings.inference_shared_memory
+        self.shm: Optional[shared_memory.SharedMemory] = None
+        try:
+            reply, _ = self.call({"op": "hello", "token": settings.inference_server_token})
+        except BaseException:
+            self.sock.close()
+            raise
+        self.shm_prefix: str = reply["shm_prefix"]
+
+    def call(self, header: dict, buffers: tuple = ()) -> tuple[dict, bytearray]:
+        encoded = json.dumps(header).encode()
+        self.sock.sendall(FRAME.pack(len(encoded), sum(memoryview(b).nbytes for b in buffers)) + encoded)
+        for buffer in buffers:
+            self.sock.sendall(buffer)
+        header_size, payload_size = FRAME.unpack(_recv_exactly(self.sock, FRAME.size))
+        reply = json.loads(_recv_exactly(self.sock, header_size))
+        payload = _recv_exactly(self.sock, payload_size) if payload_size else bytearray()
+        if not reply.get("ok"):
+            raise RemoteInferenceError(reply.get("error") or "неизвестная ошибка")
+        return reply, payload
+
+    def segment(self, size: int) -> shared_memory.SharedMemory:
+        """Сегмент не меньше size байт; при нехватке заменяется большим"""
+        if self.shm is None or self.shm.size < size:
+            self._release_segment()
+            self.shm = shared_memory.SharedMemory(create=True, size=size, name=self.shm_prefix + secrets.token_hex(4))
+        return self.shm
+
+    def _release_segment(self) -> None:
+        if self.shm is None:
+            return
+        self.shm.close()
+        # Сегмент принадлежит процессу, который его создал: после fork потомок только закрывает копию
+        if self.pid == os.getpid():
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+        self.shm = None
+
+    def close(self) -> None:
+        try:
+            self.sock.close()
+        finally:
+            self._release_segment()
+
+
+class RemoteInferenceError(RuntimeError):
+    """Сервер инференса выполнил запрос с ошибкой (повторять его бессмысленно)"""
+
+
+class InferenceClient:
+    """
+    Пул соединений с сервером инференса; потокобезопасен
+
+    Каждый вызов берет свободное соединение (или открывает новое), поэтому параллельные
+    инференсы из разных потоков и воркеров приходят на сервер одновременно и собираются им в батчи.
+    """
+
+    def __init__(self, addresses: str, timeout: Optional[float] = None):
+        self.addresses = [address.strip() for address in addresses.split(",") if address.strip()]
+        if not self.addresses:
+            raise ValueError("Не указан адрес сервера инференса")
+        for address in self.addresses:
+            parse_address(address)
+        self.timeout = timeout if timeout is not None else settings.inference_server_timeout
+        self._next_address = itertools.count()
+        self._idle: list[_Connection] = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self.version: Optional[str] = None
+        self.models: dict[str, Optional[dict]] = {}
+        self._finalizer = weakref.finalize(self, _close_connections, self._idle)
+
+    def _acquire(self) -> _Connection:
+        with self._lock:
+            if self._pid != os.getpid():
+                # После fork соединения и сегменты родителя не используем
+                _close_connections(self._idle)
+                self._pid = os.getpid()
+            if self._idle:
+                return self._idle.pop()
+        address = self.addresses[next(self._next_address) % len(self.addresses)]
+        return _Connection(address, self.timeout)
+
+    def _release(self, connection: _Connection) -> None:
+        with self._lock:
+            if connection.pid == os.getpid() and len(self._idle) < _MAX_IDLE_CONNECTIONS:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def _call(self, prepare):
+        """
+        Запрос по свободному соединению; при обрыве повторяется один раз по новому соединению
+        (сервер мог перезапуститься). prepare(connection) возвращает заголовок и данные для этого
+        соединения; ответ разбирается до возврата соединения в пул.
+        """
+        for attempt in range(2):
+            try:
+                connection = self._acquire()
+            except OSError as e:
+                if attempt:
+                    raise RuntimeError(f"Сервер инференса недоступен: {e}")
+                continue
+            try:
+                reply, payload = connection.call(*prepare(connection))
+                result = self._parse(connection, reply, payload)
+            except RemoteInferenceError:
+                self._release(connection)
+                raise
+            except (OSError, ConnectionError, ValueError) as e:
+                connection.close()
+                if attempt:
+                    raise RuntimeError(f"Сервер инференса недоступен: {e}")
+                continue
+            self._release(connection)
+            return result
+
+    @staticmethod
+    def _parse(connection: _Connection, reply: dict, payload: bytearray):
+        if "outputs" not in reply:
+            return reply
+        source = connection.shm.buf if reply.get("shm") else payload
+        # Выходы копируются из сегмента: после возврата в пул его перезапишет другой запрос
+        outputs = [tensor_from_buffer(source, spec).copy() for spec in reply["outputs"]]
+        return reply, outputs
+
+    def info(self) -> dict:
+        """Версия модели на сервере и описание входов и выходов ее сессий"""
+        reply = self._call(lambda connection: ({"op": "info"}, ()))
+        self.version = reply["version"]
+        self.models = reply["models"]
+        return reply
+
+    def run(self, model: str, array: np.ndarray) -> list[np.ndarray]:
+        def prepare(connection: _Connection):
+            header = {"op": "run", "model": model, "version": self.version}
+            if not connection.local:
+                header["input"] = describe_tensor(array, 0)
+                return header, (np.ascontiguousarray(array),)
+            out_offset = align(array.nbytes)
+            segment = connection.segment(out_offset + self._outputs_size(model, array.shape[0]))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+            header["input"] = describe_tensor(array, 0)
+            header["shm"] = segment.name
+            header["out_offset"] = out_offset
+            header["out_capacity"] = segment.size - out_offset
+            return header, ()
+
+        reply, outputs = self._call(prepare)
+        if self.version is not None and reply.get("version") != self.version:
+            raise RemoteInferenceError(f"Сервер ответил версией {reply.get('version')} вместо {self.version}")
+        return outputs
+
+    def _outputs_size(self, model: str, batch_size: int) -> int:
+        """Место под выходы в сегменте; если формы выходов неизвестны, сервер пришлет их в сообщении"""
+        size = 0
+        for output in (self.models.get(model) or {}).get("outputs", []):
+            dims = [batch_size if i == 0 and not isinstance(dim, int) else dim for i, dim in enumerate(output["shape"])]
+            if not all(isinstance(dim, int) and dim > 0 for dim in dims):
+                return 0
+            size += align(int(np.prod(dims)) * _itemsize(output["type"]))
+        return size
+
+    def close(self) -> None:
+        self._finalizer()
+
+
+def _itemsize(onnx_type: str) -> int:
+    from app.services.image_processor import _ORT_NUMPY_TYPES
+
+    return np.dtype(_ORT_NUMPY_TYPES.get(onnx_type, np.float32)).itemsize
+
+
+def _close_connections(connections: list[_Connection]) -> None:
+    while connections:
+        connections.pop().close()
+
+
+class RemoteSession:
+    """Сессия модели на сервере инференса с интерфейсом ort.InferenceSession"""
+
+    def __init__(self, client: InferenceClient, model: str):
+        self.client = client
+        self.model = model
+        description = client.models[model]
+        self._inputs = [NodeArg(**arg) for arg in description["inputs"]]
+        self._outputs = [NodeArg(**arg) for arg in description["outputs"]]
+
+    @property
+    def version(self) -> Optional[str]:
+        return self.client.version
+
+    def get_inputs(self) -> list[NodeArg]:
+        return self._inputs
+
+    def get_outputs(self) -> list[NodeArg]:
+        return self._outputs
+
+    def run(self, output_names, feed: dict) -> list[np.ndarray]:
+        (array,) = feed.values()
+        return self.client.run(self.model, array)
+
+
+def connect_inference_server(addresses: str) -> tuple[RemoteSession, Optional[RemoteSession]]:
+    """
+    Подключается к серверу инференса
+
+    Returns:
+        (основная сессия, отдельная сессия каскада или None, если каскада на сервере нет)
+    """
+    client = InferenceClient(addresses)
+    client.info()
+    cascade = RemoteSession(client, "cascade") if client.models.get("cascade") else None
+    return RemoteSession(client, "main"), cascade
+
+
+def remote_model_version(addresses: str) -> Optional[str]:
+    """Версия модели на сервере инференса; None — сервер недоступен"""
+    client = InferenceClient(addresses)
+    try:
+        return client.info()["version"]
+    except RuntimeError:
+        return None
+    finally:
+        client.close()
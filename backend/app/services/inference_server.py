@@ -0,0 +1,456 @@
+"""
+Отдельный сервер инференса
+
+Сессии ONNX живут в этом процессе, воркеры API обращаются к нему через app.services.inference_rpc
+(настройка inference_server_url). Так инференс масштабируется отдельно от API, а падение модели
+не роняет воркеры: загрузки продолжают сохраняться, только без обработки ИИ.
+
+Запросы от всех соединений собираются в батчи: первый запрос ждет попутчиков не дольше
+inference_batch_wait_ms, батч — не больше inference_batch_size кадров. Если размер батча у модели
+не зафиксирован, кадры склеиваются в один тензор и идут одним запуском, иначе выполняются подряд
+одним заданием пула. Активная версия модели выбирается и заменяется так же, как в воркерах API
+(ai/ACTIVE, наблюдатель); запросы, начатые на прежней версии, дорабатывают на ней.
+
+Несколько серверов: разные адреса через запятую в inference_server_url у воркеров или несколько
+процессов на одном TCP-порту (SO_REUSEPORT).
+
+Соединение начинается с приветствия: клиент передает inference_server_token, сервер выдает
+префикс имен сегментов разделяемой памяти этого соединения — чужие сегменты сервер не открывает.
+Unix-сокет доступен только пользователю сервера; TCP-адрес вне localhost требует токена.
+
+Запуск из директории backend:
+    python -m app.services.inference_server --listen unix:///tmp/rbx-inference.sock
+    python -m app.services.inference_server --listen tcp://127.0.0.1:8765 --batch-size 16
+    inference_server_token=... python -m app.services.inference_server --listen tcp://10.0.0.5:8765
+"""
+import argparse
+import asyncio
+import hmac
+import ipaddress
+import json
+import os
+import secrets
+import signal
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Optional
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.inference_rpc import FRAME, align, describe_tensor, parse_address, tensor_from_buffer
+
+if TYPE_CHECKING:
+    from app.services.image_processor import ImageProcessor
+
+# Сколько версий модели держать для запросов, начатых до замены
+_KEPT_VERSIONS = 2
+
+
+async def _read_message(reader: asyncio.StreamReader) -> tuple[dict, bytes]:
+    header_size, payload_size = FRAME.unpack(await reader.readexactly(FRAME.size))
+    header = json.loads(await reader.readexactly(header_size))
+    payload = await reader.readexactly(payload_size) if payload_size else b""
+    return header, payload
+
+
+def _write_message(writer: asyncio.StreamWriter, header: dict, buffers: list = ()) -> None:
+    encoded = json.dumps(header).encode()
+    writer.write(FRAME.pack(len(encoded), sum(memoryview(b).nbytes for b in buffers)) + encoded)
+    for buffer in buffers:
+        writer.write(buffer)
+
+
+def _describe_session(session) -> dict:
+    return {
+        "inputs": [{"name": arg.name, "type": arg.type, "shape": arg.shape} for arg in session.get_inputs()],
+        "outputs": [{"name": arg.name, "type": arg.type, "shape": arg.shape} for arg in session.get_outputs()],
+    }
+
+
+class _Request:
+    """Кадр в очереди батча; deliver выполняется в потоке инференса и готовит ответ"""
+
+    __slots__ = ("array", "deliver", "future")
+
+    def __init__(self, array: np.ndarray, deliver: Callable[[list[np.ndarray]], tuple], future: asyncio.Future):
+        self.array = array
+        self.deliver = deliver
+        self.future = future
+
+
+class _Batcher:
+    """Динамический батчинг запросов к одной сессии одной версии модели"""
+
+    def __init__(self, processor: "ImageProcessor", session, server: "InferenceServer"):
+        self.processor = processor
+        self.session = session
+        self.server = server
+        # Кадры можно склеить, только если размер батча у модели не зафиксирован
+        self.stackable = not isinstance(session.get_inputs()[0].shape[0], int)
+        self.queue: asyncio.Queue[_Request] = asyncio.Queue()
+        self.tasks = [asyncio.create_task(self._loop()) for _ in range(server.workers)]
+
+    async def submit(self, array: np.ndarray, deliver) -> tuple:
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put(_Request(array, deliver, future))
+        return await future
+
+    async def _collect(self) -> list[_Request]:
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + self.server.batch_wait
+        while len(batch) < self.server.batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            # Когда в батче все выполняющиеся запросы, новых попутчиков не будет
+            if len(batch) >= self.server.in_flight:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _loop(self) -> None:
+        while True:
+            await self._process(await self._collect())
+
+    async def _process(self, batch: list[_Request]) -> None:
+        # Отдельная корутина: ссылки на входы (виды на сегменты клиентов) не живут дольше батча
+        batch = [request for request in batch if not request.future.cancelled()]
+        if not batch:
+            return
+        results = await asyncio.get_running_loop().run_in_executor(self.server.executor, self._run, batch)
+        self.server.record_batch(len(batch))
+        for request, (ok, value) in zip(batch, results):
+            if request.future.cancelled():
+                continue
+            if ok:
+                request.future.set_result(value)
+            else:
+                request.future.set_exception(value)
+
+    def _run(self, batch: list[_Request]) -> list[tuple[bool, object]]:
+        """Выполняется в потоке инференса; выходы IOBinding разбираются до следующего запуска"""
+        arrays = [request.array for request in batch]
+        if self.stackable and len(batch) > 1 and len({(a.dtype, a.shape[1:]) for a in arrays}) == 1:
+            try:
+                outputs = self.processor._run_session(np.concatenate(arrays), self.session)
+            except Exception as e:
+                return [(False, e)] * len(batch)
+            results = []
+            start = 0
+            for request in batch:
+                end = start + request.array.shape[0]
+                results.append(self._deliver(request, [output[start:end] for output in outputs]))
+                start = end
+            return results
+
+        results = []
+        for request in batch:
+            try:
+                outputs = self.processor._run_session(request.array, self.session)
+            except Exception as e:
+                results.append((False, e))
+                continue
+            results.append(self._deliver(request, outputs))
+        return results
+
+    @staticmethod
+    def _deliver(request: _Request, outputs: list) -> tuple[bool, object]:
+        try:
+            return True, request.deliver(outputs)
+        except Exception as e:
+            return False, e
+
+    def close(self) -> None:
+        """Останавливает батчер; запросы в очереди получают ошибку, а не ждут таймаута клиента"""
+        for task in self.tasks:
+            task.cancel()
+        while not self.queue.empty():
+            request = self.queue.get_nowait()
+            if not request.future.done():
+                request.future.set_exception(RuntimeError("Версия модели выгружена"))
+
+
+class InferenceServer:
+    def __init__(self, batch_size: int, batch_wait: float, workers: int):
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = max(0.0, batch_wait)
+        self.workers = max(1, workers)
+        self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix="inference")
+        # Последние версии модели и их батчеры: запрос с прежней версией дорабатывает на ней
+        self._processors: OrderedDict[str, "ImageProcessor"] = OrderedDict()
+        self._batchers: dict[tuple[str, str], _Batcher] = {}
+        self.connections = 0
+        # Запросы run, ожидающие ответа, по всем соединениям
+        self.in_flight = 0
+        self._frames = 0
+        self._batches = 0
+
+    def processor(self, version: Optional[str] = None) -> "ImageProcessor":
+        from app.services.model_loader import get_image_processor
+
+        current = get_image_processor()
+        if current.model_version not in self._processors:
+            self._processors[current.model_version] = current
+            while len(self._processors) > _KEPT_VERSIONS:
+                old_version, _ = self._processors.popitem(last=False)
+                for key in [key for key in self._batchers if key[0] == old_version]:
+                    self._batchers.pop(key).close()
+        if version is None:
+            return current
+        processor = self._processors.get(version)
+        if processor is None:
+            # Пред- и постобработка клиента рассчитаны на его версию — чужой моделью не считаем
+            raise ValueError(f"Версия модели {version} выгружена, текущая — {current.model_version}")
+        return processor
+
+    def batcher(self, processor: "ImageProcessor", model: str) -> _Batcher:
+        key = (processor.model_version, model)
+        batcher = self._batchers.get(key)
+        if batcher is None:
+            if model == "main":
+                session = processor.session
+            elif model == "cascade" and processor.cascade_session is not processor.session:
+                session = processor.cascade_session
+            else:
+                raise ValueError(f"Неизвестная модель: {model}")
+            batcher = self._batchers[key] = _Batcher(processor, session, self)
+        return batcher
+
+    def record_batch(self, size: int) -> None:
+        self._frames += size
+        self._batches += 1
+
+    def info(self) -> dict:
+        processor = self.processor()
+        cascade = processor.cascade_session
+        return {
+            "ok": True,
+            "version": processor.model_version,
+            "models": {
+                "main": _describe_session(processor.session),
+                "cascade": _describe_session(cascade) if cascade is not processor.session else None,
+            },
+            "stats": {
+                "connections": self.connections,
+                "in_flight": self.in_flight,
+                "frames": self._frames,
+                "batches": self._batches,
+                "mean_batch": round(self._frames / self._batches, 2) if self._batches else None,
+            },
+        }
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Запросы одного соединения выполняются по очереди: клиент ждет ответа на каждый"""
+        self.connections += 1
+        attached: dict[str, shared_memory.SharedMemory] = {}
+        # Префикс сегментов разделяемой памяти соединения, выдается в приветствии
+        prefix: Optional[str] = None
+        try:
+            while True:
+                try:
+                    header, payload = await _read_message(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                if prefix is None:
+                    if header.get("op") != "hello" or not self._authorized(header.get("token")):
+                        _write_message(writer, {"ok": False, "error": "Неверный токен сервера инференса"})
+                        await writer.drain()
+                        return
+                    prefix = f"rbx_{secrets.token_hex(4)}_"
+                    _write_message(writer, {"ok": True, "shm_prefix": prefix})
+                    await writer.drain()
+                    continue
+                try:
+                    if header.get("op") == "info":
+                        reply, buffers = self.info(), []
+                    elif header.get("op") == "run":
+                        self.in_flight += 1
+                        try:
+                            reply, buffers = await self._run(header, payload, attached, prefix)
+                        finally:
+                            self.in_flight -= 1
+                    else:
+                        raise ValueError(f"Неизвестная операция: {header.get('op')}")
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    reply, buffers = {"ok": False, "error": str(e)}, []
+                _write_message(writer, reply, buffers)
+                await writer.drain()
+        finally:
+            self.connections -= 1
+            for segment in attached.values():
+                segment.close()
+            writer.close()
+
+    @staticmethod
+    def _authorized(token) -> bool:
+        expected = settings.inference_server_token
+        if not expected:
+            return True
+        return isinstance(token, str) and hmac.compare_digest(token.encode(), expected.encode())
+
+    async def _run(self, header: dict, payload: bytes, attached: dict, prefix: str) -> tuple[dict, list]:
+        # Модель загружена до старта, замену выполняет наблюдатель: здесь загрузки не бывает
+        processor = self.processor(header.get("version"))
+        spec = header["input"]
+        segment = None
+        if header.get("shm"):
+            if not str(header["shm"]).startswith(prefix):
+                raise ValueError("Сегмент разделяемой памяти не принадлежит соединению")
+            segment = self._attach(header["shm"], attached)
+            if spec["offset"] + spec["nbytes"] > segment.size:
+                raise ValueError("Вход не помещается в сегмент разделяемой памяти")
+            array = tensor_from_buffer(segment.buf, spec)
+        else:
+            array = tensor_from_buffer(payload, spec)
+
+        def deliver(outputs: list) -> tuple[dict, list]:
+            reply = {"ok": True, "version": processor.model_version}
+            offset = header.get("out_offset", 0)
+            total = sum(align(output.nbytes) for output in outputs)
+            if segment is not None and total <= header.get("out_capacity", 0):
+                specs = []
+                for output in outputs:
+                    target = np.ndarray(output.shape, dtype=output.dtype, buffer=segment.buf, offset=offset)
+                    target[...] = output
+                    specs.append(describe_tensor(output, offset))
+                    offset += align(output.nbytes)
+                return {**reply, "shm": True, "outputs": specs}, []
+            # Выходы не помещаются в сегмент (или его нет) — отправляем в сообщении
+            buffers, specs, offset = [], [], 0
+            for output in outputs:
+                buffers.append(np.ascontiguousarray(output).tobytes())
+                specs.append(describe_tensor(output, offset))
+                offset += output.nbytes
+            return {**reply, "shm": False, "outputs": specs}, buffers
+
+        return await self.batcher(processor, header.get("model", "main")).submit(array, deliver)
+
+    @staticmethod
+    def _attach(name: str, attached: dict) -> shared_memory.SharedMemory:
+        segment = attached.get(name)
+        if segment is None:
+            # Клиент заменил сегмент на больший — старый больше не нужен
+            for old in attached.values():
+                old.close()
+            attached.clear()
+            segment = attached[name] = shared_memory.SharedMemory(name=name)
+            # Сегмент принадлежит клиенту: трекер ресурсов сервера не должен удалять его при выходе
+            resource_tracker.unregister(segment._name, "shared_memory")
+        return segment
+
+    def close(self) -> None:
+        for batcher in self._batchers.values():
+            batcher.close()
+        self._batchers.clear()
+
+
+async def serve(addresses: list[str], server: InferenceServer) -> None:
+    from app.services.model_loader import watch_model_updates
+
+    listeners = []
+    for address in addresses:
+        family, target = parse_address(address)
+        if family == "unix":
+            Path(target).unlink(missing_ok=True)
+            listeners.append(await asyncio.start_unix_server(server.handle, path=target))
+            # Подключаться могут только процессы того же пользователя
+            os.chmod(target, 0o600)
+        else:
+            host, port = target
+            listeners.append(await asyncio.start_server(server.handle, host, port, reuse_port=True))
+        print(f"🚀 Сервер инференса слушает {address}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+    watcher = asyncio.create_task(watch_model_updates()) if settings.models_watch_interval > 0 else None
+
+    await stop.wait()
+    print("⏳ Остановка сервера инференса...")
+    for listener in listeners:
+        listener.close()
+    if watcher is not None:
+        watcher.cancel()
+    server.close()
+    for address in addresses:
+        family, target = parse_address(address)
+        if family == "unix":
+            Path(target).unlink(missing_ok=True)
+
+
+def _is_private_address(address: str) -> bool:
+    """Адрес доступен только с этого хоста: unix-сокет или loopback"""
+    family, target = parse_address(address)
+    if family == "unix":
+        return True
+    host = target[0]
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Сервер инференса RBX")
+    parser.add_argument("--listen", action="append", default=None,
+                        help=f"Адрес unix:///path или tcp://host:port, можно несколько "
+                             f"(по умолчанию {settings.inference_server_listen})")
+    parser.add_argument("--batch-size", type=int, default=settings.inference_batch_size,
+                        help="Наибольший батч")
+    parser.add_argument("--batch-wait-ms", type=float, default=settings.inference_batch_wait_ms,
+                        help="Сколько первый запрос ждет заполнения батча (мс)")
+    parser.add_argument("--workers", type=int, default=1, help="Батчей, выполняемых одновременно")
+    parser.add_argument("--threads", type=int, default=settings.inference_threads,
+                        help="Потоки ONNX Runtime на инференс")
+    args = parser.parse_args(argv)
+
+    from app.services.model_loader import get_image_processor, model_status
+
+    addresses = args.listen or [settings.inference_server_listen]
+    try:
+        exposed = [address for address in addresses if not _is_private_address(address)]
+    except ValueError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    if exposed and not settings.inference_server_token:
+        print(f"❌ Адрес {exposed[0]} доступен из сети: задайте inference_server_token "
+              f"или слушайте unix-сокет или 127.0.0.1", file=sys.stderr)
+        return 1
+
+    # Сервер всегда считает сам, даже если в общем .env указан адрес сервера для воркеров
+    settings.inference_server_url = None
+    settings.inference_threads = args.threads
+    try:
+        get_image_processor()
+    except RuntimeError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    print(f"✅ Модель {model_status()['version']} загружена за {model_status()['load_seconds']} с (pid {os.getpid()})")
+
+    server = InferenceServer(args.batch_size, args.batch_wait_ms / 1000, args.workers)
+    try:
+        asyncio.run(serve(addresses, server))
+    finally:
+        server.executor.shutdown(wait=True)
+    print("👋 Сервер инференса остановлен")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
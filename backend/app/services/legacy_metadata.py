@@ -0,0 +1,73 @@
+import json
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.crud.response_version import bump_response_versions
+from app.models.route import Route
+from app.models.route_file import RouteFile
+from app.services.storage import processed_path
+
+LEGACY_METADATA_NAME = "metadata.json"
+
+
+async def import_legacy_metadata(session: AsyncSession) -> int:
+    """
+    Переносит метаданные из старых файлов uploads/<route_id>/metadata.json в таблицу route_files
+
+    После успешного импорта файл переименовывается, поэтому повторный запуск ничего не делает.
+
+    Returns:
+        int: количество импортированных записей
+    """
+    imported = 0
+    for metadata_file in settings.upload_dir.glob(f"*/{LEGACY_METADATA_NAME}"):
+        route_dir = metadata_file.parent
+        route_id = route_dir.name
+
+        route = await session.get(Route, route_id)
+        if route is None:
+            continue
+
+        try:
+            with open(metadata_file, "r", encoding="utf-8") as f:
+                metadata = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Не удалось прочитать {metadata_file}: {e}")
+            continue
+
+        # Один проход по директории вместо glob на каждый файл
+        originals = {path.stem: path.suffix for path in route_dir.iterdir() if path.is_file()}
+        existing = (
+            await session.execute(
+                select(RouteFile.id, RouteFile.original_name).where(RouteFile.route_id == route_id)
+            )
+        ).all()
+        existing_ids = {row.id for row in existing}
+        existing_names = {row.original_name for row in existing}
+
+        for file_id, file_meta in metadata.items():
+            original_name = file_meta.get("original_name", f"image_{file_id}")
+            if file_id in existing_ids or original_name in existing_names or file_id not in originals:
+                continue
+            existing_names.add(original_name)
+            session.add(
+                RouteFile(
+                    id=file_id,
+                    route_id=route_id,
+                    original_name=original_name,
+                    file_ext=file_meta.get("file_ext", originals[file_id]),
+                    is_processed=processed_path(route_id, file_id).exists(),
+                    red_detection_count=file_meta.get("red_detection_count", 0),
+                    green_detection_count=file_meta.get("green_detection_count", 0),
+                    total_detections=file_meta.get("total_detections", 0),
+                )
+            )
+            imported += 1
+
+        await bump_response_versions(session, route.user_id, [route_id])
+        await session.commit()
+        metadata_file.rename(metadata_file.with_name(f"{LEGACY_METADATA_NAME}.imported"))
+
+    return imported
@@ -0,0 +1,556 @@
+"""
+Нагрузочный тест: одновременные инспекторы загружают снимки и просматривают маршруты
+
+Каждый виртуальный инспектор регистрируется, создает маршрут, загружает первую пачку снимков
+и дальше до конца теста выполняет действия в заданной пропорции (--mix): загрузку пачки
+синтетических снимков, список файлов и статистику маршрута, список маршрутов, сводку и просмотр
+обработанного изображения. Опросы, как браузер, повторяются с If-None-Match.
+
+Приложение запускается в этом же процессе (по умолчанию), отдельным продакшн-сервером
+на свободном порту (--serve, как python -m app.server) или не запускается вовсе (--url).
+В первых двух случаях данные пишутся во временную директорию, а вместо модели используется
+заглушка с теми же входом и выходом, что у YOLO (нужен pip install onnx): она возвращает
+несколько постоянных детекций, а свертками перед выходом изображает вычисления настоящей
+модели (--stand-in-gflops; 0 — почти без вычислений). --model подставляет настоящую модель.
+
+В конце печатаются пропускная способность и задержки p50/p95/p99 по каждому действию,
+а также пиковая память (RSS): процесса теста вместе с приложением или сервера со всеми воркерами.
+--json сохраняет те же цифры для сравнения между версиями.
+
+Запуск из директории backend:
+    python -m app.services.loadtest --users 16 --duration 60
+    python -m app.services.loadtest --serve --workers 4 --users 32 --mix upload=1,files=4,image=4
+    python -m app.services.loadtest --url http://127.0.0.1:8000 --pid 12345 --stand-in-gflops 0
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Optional
+
+import cv2
+import numpy as np
+
+ACTIONS = ("upload", "files", "stats", "routes", "summary", "image")
+DEFAULT_MIX = "upload=1,files=3,stats=3,routes=1,summary=1,image=3"
+
+# Отказы допуска загрузок (перегрузка): ожидаемы под нагрузкой и считаются отдельно от ошибок
+_REJECTED_STATUSES = (429, 503)
+
+# Детекции заглушки во входе 640x640: (cx, cy, w, h, класс, уверенность)
+_STAND_IN_BOXES = [(200, 200, 100, 80, 5, 0.9), (400, 300, 60, 120, 1, 0.8), (100, 500, 50, 50, 6, 0.7)]
+_STAND_IN_CLASSES = 8
+_STAND_IN_ANCHORS = 8400
+# Свертка 16 -> 16 каналов 3x3 на карте 320x320, GFLOP
+_STAND_IN_CHANNELS = 16
+_CONV_GFLOPS = 2 * _STAND_IN_CHANNELS * _STAND_IN_CHANNELS * 9 * 320 * 320 / 1e9
+
+
+def _import_onnx():
+    try:
+        import onnx
+    except ImportError:
+        print("❌ Для модели-заглушки нужен пакет onnx (pip install onnx) или --model", file=sys.stderr)
+        raise SystemExit(1)
+    return onnx
+
+
+def build_stand_in_model(path: Path, gflops: float, seed: int = 0) -> None:
+    """
+    Модель-заглушка: вход images [1, 3, 640, 640], выход [1, 12, 8400] с постоянными детекциями
+
+    Свертки считаются, но их результат умножается на ноль, поэтому детекции не зависят от кадра.
+    """
+    onnx = _import_onnx()
+    from onnx import TensorProto, helper, numpy_helper
+
+    rng = np.random.default_rng(seed)
+    base = np.zeros((1, 4 + _STAND_IN_CLASSES, _STAND_IN_ANCHORS), dtype=np.float32)
+    for i, (cx, cy, w, h, class_id, conf) in enumerate(_STAND_IN_BOXES):
+        base[0, :4, i] = [cx, cy, w, h]
+        base[0, 4 + class_id, i] = conf
+
+    nodes = []
+    initializers = [
+        numpy_helper.from_array(base, "base"),
+        numpy_helper.from_array(np.array([1, 2, 3], dtype=np.int64), "axes"),
+        numpy_helper.from_array(np.array(0.0, dtype=np.float32), "zero"),
+    ]
+    features = "images"
+    layers = max(0, round(gflops / _CONV_GFLOPS))
+    for i in range(layers + 1 if layers else 0):
+        # Первая свертка уменьшает карту до 320x320, остальные сохраняют размер;
+        # веса нормированы, чтобы значения не росли от слоя к слою
+        in_channels = 3 if i == 0 else _STAND_IN_CHANNELS
+        weight = rng.standard_normal((_STAND_IN_CHANNELS, in_channels, 3, 3)).astype(np.float32) / (in_channels * 9)
+        initializers.append(numpy_helper.from_array(weight, f"conv{i}_w"))
+        nodes.append(helper.make_node(
+            "Conv", [features, f"conv{i}_w"], [f"conv{i}"], pads=[1, 1, 1, 1], strides=[2, 2] if i == 0 else [1, 1],
+        ))
+        features = f"conv{i}"
+    nodes += [
+        helper.make_node("ReduceMean", [features, "axes"], ["mean"], keepdims=0),
+        helper.make_node("Mul", ["mean", "zero"], ["zeroed"]),
+        helper.make_node("Add", ["zeroed", "base"], ["output0"]),
+    ]
+    graph = helper.make_graph(
+        nodes,
+        "stand_in",
+        [helper.make_tensor_value_info("images", TensorProto.FLOAT, [1, 3, 640, 640])],
+        [helper.make_tensor_value_info("output0", TensorProto.FLOAT, [1, 4 + _STAND_IN_CLASSES, _STAND_IN_ANCHORS])],
+        initializers,
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 18)])
+    # Версия формата, которую читает onnxruntime из requirements
+    model.ir_version = 9
+    onnx.checker.check_model(model)
+    onnx.save(model, str(path))
+
+
+def synthetic_images(count: int, width: int, height: int, seed: int = 0) -> list[bytes]:
+    """JPEG-кадры заданного размера: шум с крупными прямоугольниками, чтобы сжатие было похоже на снимки"""
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        image = cv2.resize(rng.integers(0, 256, (max(1, height // 16), max(1, width // 16), 3), dtype=np.uint8), (width, height))
+        for _ in range(8):
+            x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+            color = tuple(int(c) for c in rng.integers(0, 256, 3))
+            cv2.rectangle(image, (x, y), (x + width // 8, y + height // 8), color, -1)
+        ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        images.append(encoded.tobytes())
+    return images
+
+
+def parse_mix(value: str) -> dict[str, float]:
+    """upload=1,files=3,... -> веса действий"""
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.strip().partition("=")
+        if name not in ACTIONS:
+            raise argparse.ArgumentTypeError(f"Неизвестное действие {name!r}, допустимы: {', '.join(ACTIONS)}")
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Вес действия {name} должен быть числом: {weight!r}")
+    if not any(weight > 0 for weight in mix.values()):
+        raise argparse.ArgumentTypeError("Хотя бы одно действие должно иметь положительный вес")
+    return mix
+
+
+def _percentile(samples: list[float], percent: float) -> float:
+    """Процентиль по ближайшему рангу"""
+    index = max(0, min(len(samples) - 1, int(np.ceil(percent / 100 * len(samples))) - 1))
+    return samples[index]
+
+
+class LoadStats:
+    """Задержки и коды ответов по действиям"""
+
+    def __init__(self):
+        self.latencies: defaultdict[str, list[float]] = defaultdict(list)
+        self.statuses: defaultdict[str, Counter] = defaultdict(Counter)
+        self.images_uploaded = 0
+
+    def record(self, action: str, seconds: float, status_code: int) -> None:
+        self.latencies[action].append(seconds)
+        self.statuses[action][status_code] += 1
+
+    def summary(self, elapsed: float) -> dict:
+        actions = {}
+        for action in ACTIONS:
+            samples = sorted(self.latencies.get(action, []))
+            if not samples:
+                continue
+            statuses = self.statuses[action]
+            actions[action] = {
+                "requests": len(samples),
+                "rps": round(len(samples) / elapsed, 2),
+                "errors": sum(count for code, count in statuses.items()
+                              if (code >= 400 or code == 0) and code not in _REJECTED_STATUSES),
+                "rejected": sum(statuses[code] for code in _REJECTED_STATUSES),
+                "statuses": {str(code): count for code, count in sorted(statuses.items())},
+                "p50_ms": round(_percentile(samples, 50) * 1000, 1),
+                "p95_ms": round(_percentile(samples, 95) * 1000, 1),
+                "p99_ms": round(_percentile(samples, 99) * 1000, 1),
+                "max_ms": round(samples[-1] * 1000, 1),
+            }
+        return {
+            "elapsed_seconds": round(elapsed, 1),
+            "requests": sum(item["requests"] for item in actions.values()),
+            "rps": round(sum(item["requests"] for item in actions.values()) / elapsed, 2),
+            "images_uploaded": self.images_uploaded,
+            "images_per_second": round(self.images_uploaded / elapsed, 2),
+            "actions": actions,
+        }
+
+
+class Inspector:
+    """Виртуальный инспектор: свой пользователь, маршрут и снимки в нем"""
+
+    def __init__(self, client, index: int, args: argparse.Namespace, images: list[bytes], stats: LoadStats):
+        self.client = client
+        self.index = index
+        self.args = args
+        self.images = images
+        self.stats = stats
+        self.rng = random.Random(args.seed * 1000 + index)
+        self.headers: dict[str, str] = {}
+        self.route_id: Optional[str] = None
+        self.file_ids: list[str] = []
+        self.etags: dict[str, str] = {}
+        self.uploaded = 0
+
+    async def prepare(self, run_id: str) -> None:
+        """Регистрация, маршрут и первая пачка снимков (в замеры не входят)"""
+        response = await self.client.post(
+            "/api/auth/register",
+            json={"email": f"loadtest-{run_id}-{self.index}@example.com", "password": "loadtest"},
+        )
+        response.raise_for_status()
+        self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        response = await self.client.post("/api/routes/", json={"name": f"Нагрузка {self.index}"}, headers=self.headers)
+        response.raise_for_status()
+        self.route_id = response.json()["id"]
+        await self._upload(record=False)
+
+    async def run(self, deadline: float, mix: dict[str, float]) -> None:
+        actions = [action for action, weight in mix.items() if weight > 0]
+        weights = [mix[action] for action in actions]
+        while time.monotonic() < deadline:
+            action = self.rng.choices(actions, weights)[0]
+            if action == "image" and not self.file_ids:
+                action = "files"
+            await getattr(self, f"_{action}")()
+            if self.args.think_ms > 0:
+                await asyncio.sleep(self.rng.expovariate(1000 / self.args.think_ms))
+
+    async def _request(self, action: str, method: str, url: str, record: bool = True, poll: bool = False, **kwargs):
+        headers = dict(self.headers)
+        if poll and self.args.etag and url in self.etags:
+            headers["If-None-Match"] = self.etags[url]
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, headers=headers, **kwargs)
+        except Exception as e:
+            if record:
+                self.stats.record(action, time.perf_counter() - started, 0)
+            print(f"⚠️ {action}: {e!r}", file=sys.stderr)
+            return None
+        if record:
+            self.stats.record(action, time.perf_counter() - started, response.status_code)
+        if poll and response.status_code == 200 and "etag" in response.headers:
+            self.etags[url] = response.headers["etag"]
+        return response
+
+    async def _upload(self, record: bool = True) -> None:
+        files = []
+        for _ in range(self.args.batch):
+            self.uploaded += 1
+            image = self.images[self.rng.randrange(len(self.images))]
+            files.append(("files", (f"DJI_{self.index:03d}_{self.uploaded:06d}.JPG", image, "image/jpeg")))
+        response = await self._request("upload", "POST", f"/api/routes/{self.route_id}/files", record=record, files=files)
+        if response is not None and response.status_code == 200:
+            processed = [item["processed_id"] for item in response.json().get("processed_files", []) if "processed_id" in item]
+            self.file_ids.extend(processed)
+            if record:
+                self.stats.images_uploaded += len(processed)
+
+    async def _files(self) -> None:
+        response = await self._request("files", "GET", f"/api/routes/{self.route_id}/files", poll=True)
+        if response is not None and response.status_code == 200:
+            self.file_ids = [item["processed_id"] for item in response.json()["files"]]
+
+    async def _stats(self) -> None:
+        await self._request("stats", "GET", f"/api/routes/{self.route_id}/stats", poll=True)
+
+    async def _routes(self) -> None:
+        await self._request("routes", "GET", "/api/routes/", poll=True)
+
+    async def _summary(self) -> None:
+        await self._request("summary", "GET", "/api/routes/summary", poll=True)
+
+    async def _image(self) -> None:
+        file_id = self.rng.choice(self.file_ids)
+        await self._request("image", "GET", f"/api/routes/{self.route_id}/files/{file_id}/processed")
+
+
+def _process_tree(root: int) -> list[int]:
+    """Процесс и все его потомки (по /proc)"""
+    children = defaultdict(list)
+    for entry in Path("/proc").iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            # Имя процесса в скобках может содержать пробелы: поля считаются после него
+            stat = (entry / "stat").read_text()
+            ppid = int(stat.rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children[ppid].append(int(entry.name))
+    pids, queue = [], [root]
+    while queue:
+        pid = queue.pop()
+        pids.append(pid)
+        queue.extend(children.get(pid, []))
+    return pids
+
+
+def _rss_bytes(pids: list[int]) -> int:
+    total = 0
+    for pid in pids:
+        try:
+            for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+                if line.startswith("VmRSS:"):
+                    total += int(line.split()[1]) * 1024
+                    break
+        except OSError:
+            continue
+    return total
+
+
+class RssSampler:
+    """Пиковая суммарная память процесса и его потомков (воркеров), опрос раз в interval секунд"""
+
+    def __init__(self, pid: int, interval: float = 0.25):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def sample(self) -> None:
+        self.peak = max(self.peak, _rss_bytes(_process_tree(self.pid)))
+
+    async def _loop(self) -> None:
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if Path(f"/proc/{self.pid}").exists():
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self.sample()
+
+
+async def _wait_ready(client, timeout: float, process: Optional[subprocess.Popen] = None) -> None:
+    """Ждет, пока приложение загрузит модель (/api/health/ready)"""
+    deadline = time.monotonic() + timeout
+    error = None
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Сервер завершился с кодом {process.returncode}")
+        try:
+            response = await client.get("/api/health/ready")
+            if response.status_code == 200:
+                return
+            error = None
+        except Exception as e:
+            error = e
+        await asyncio.sleep(0.25)
+    if error is not None:
+        raise RuntimeError(f"Сервер {client.base_url} недоступен: {error!r}")
+    raise RuntimeError("Модель не загрузилась за отведенное время")
+
+
+async def _drive(client, args: argparse.Namespace, images: list[bytes]) -> dict:
+    stats = LoadStats()
+    run_id = uuid.uuid4().hex[:8]
+    inspectors = [Inspector(client, i, args, images, stats) for i in range(args.users)]
+    print(f"👷 Подготовка инспекторов: {args.users}...", file=sys.stderr)
+    await asyncio.gather(*(inspector.prepare(run_id) for inspector in inspectors))
+
+    print(f"🚀 Нагрузка {args.duration:.0f} с: {args.users} инспекторов, "
+          f"пачка {args.batch} снимков, действия {args.mix}", file=sys.stderr)
+    started = time.monotonic()
+    await asyncio.gather(*(inspector.run(started + args.duration, args.mix) for inspector in inspectors))
+    return stats.summary(time.monotonic() - started)
+
+
+def _environment(workdir: Path, model_path: Path) -> dict[str, str]:
+    """Настройки приложения для теста: своя БД, хранилище и модель во временной директории"""
+    uploads = workdir / "uploads"
+    return {
+        "database_url": f"sqlite+aiosqlite:///{workdir / 'loadtest.db'}",
+        "upload_dir": str(uploads),
+        "processed_dir": str(uploads / "processed"),
+        "storage_dir": str(uploads / "blobs"),
+        "crop_cache_dir": str(uploads / "crops"),
+        "models_dir": str(model_path.parent),
+        "default_model_file": model_path.name,
+        "preload_model": "true",
+        "models_watch_interval": "0",
+        # Без журнала SQL (он включен в окружении development)
+        "environment": "loadtest",
+    }
+
+
+async def _run_in_process(args: argparse.Namespace, images: list[bytes]) -> tuple[dict, int]:
+    import httpx
+
+    from app.main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=args.timeout) as client:
+            await _wait_ready(client, args.ready_timeout)
+            report = await _drive(client, args, images)
+    # Пик процесса теста: в нем работают и приложение, и генератор нагрузки
+    return report, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _run_served(args: argparse.Namespace, images: list[bytes], env: dict[str, str]) -> tuple[dict, int]:
+    import httpx
+
+    port = _free_port()
+    command = [sys.executable, "-m", "app.server", "--host", "127.0.0.1", "--port", str(port)]
+    if args.workers:
+        command += ["--workers", str(args.workers)]
+    backend_dir = Path(__file__).resolve().parents[2]
+    process = subprocess.Popen(command, cwd=backend_dir, env={**os.environ, **env})
+    sampler = RssSampler(process.pid)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=args.timeout) as client:
+            await _wait_ready(client, args.ready_timeout, process)
+            sampler.start()
+            report = await _drive(client, args, images)
+        await sampler.stop()
+        return report, sampler.peak
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+async def _run_remote(args: argparse.Namespace, images: list[bytes]) -> tuple[dict, Optional[int]]:
+    import httpx
+
+    sampler = RssSampler(args.pid) if args.pid else None
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout) as client:
+        await _wait_ready(client, args.ready_timeout)
+        if sampler:
+            sampler.start()
+        report = await _drive(client, args, images)
+    if sampler:
+        await sampler.stop()
+        return report, sampler.peak
+    return report, None
+
+
+def print_report(report: dict) -> None:
+    print(f"Длительность: {report['elapsed_seconds']} с, запросов: {report['requests']} "
+          f"({report['rps']}/с), снимков загружено: {report['images_uploaded']} ({report['images_per_second']}/с)")
+    print(f"{'':<8} {'запросов':>9} {'в сек':>8} {'ошибок':>7} {'отказов':>8} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'макс, мс':>9}  коды")
+    for action, item in report["actions"].items():
+        statuses = " ".join(f"{code}:{count}" for code, count in item["statuses"].items())
+        print(f"{action:<8} {item['requests']:>9} {item['rps']:>8} {item['errors']:>7} {item['rejected']:>8} {item['p50_ms']:>9} "
+              f"{item['p95_ms']:>9} {item['p99_ms']:>9} {item['max_ms']:>9}  {statuses}")
+    if report.get("peak_rss_bytes") is not None:
+        print(f"Пиковая память ({report['rss_scope']}): {report['peak_rss_bytes'] / 1024 / 1024:.0f} МБ")
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест: загрузки и просмотр маршрутов инспекторами")
+    parser.add_argument("--users", type=int, default=8, help="Одновременных инспекторов")
+    parser.add_argument("--duration", type=float, default=30.0, help="Длительность нагрузки, секунды")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help=f"Веса действий ({', '.join(ACTIONS)}), по умолчанию {DEFAULT_MIX}")
+    parser.add_argument("--batch", type=int, default=4, help="Снимков в одной загрузке")
+    parser.add_argument("--image-size", default="1920x1080", help="Размер синтетических снимков, ШxВ")
+    parser.add_argument("--distinct-images", type=int, default=8, help="Сколько разных снимков сгенерировать")
+    parser.add_argument("--think-ms", type=float, default=0.0,
+                        help="Средняя пауза инспектора между действиями, мс (0 — без пауз)")
+    parser.add_argument("--no-etag", dest="etag", action="store_false", help="Опрашивать без If-None-Match")
+    parser.add_argument("--seed", type=int, default=0)
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--serve", action="store_true",
+                        help="Запустить продакшн-сервер (app.server) на свободном порту вместо приложения в процессе")
+    target.add_argument("--url", default=None, help="Уже запущенный сервер, например http://127.0.0.1:8000")
+    parser.add_argument("--workers", type=int, default=None, help="Воркеров сервера для --serve")
+    parser.add_argument("--pid", type=int, default=None, help="PID сервера для замера памяти с --url")
+    parser.add_argument("--model", type=Path, default=None, help="Настоящая модель вместо заглушки")
+    parser.add_argument("--stand-in-gflops", type=float, default=8.7,
+                        help="Вычисления заглушки на кадр, GFLOP (8.7 — как у YOLOv8n; 0 — почти без вычислений)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Таймаут одного запроса, секунды")
+    parser.add_argument("--ready-timeout", type=float, default=120.0, help="Сколько ждать загрузки модели, секунды")
+    parser.add_argument("--json", type=Path, default=None, help="Сохранить результаты в JSON")
+    args = parser.parse_args(argv)
+    try:
+        width, height = (int(value) for value in args.image_size.lower().split("x"))
+    except ValueError:
+        parser.error("--image-size ожидается в виде ШxВ, например 1920x1080")
+    if args.users < 1 or args.batch < 1 or args.duration <= 0:
+        parser.error("--users, --batch и --duration должны быть положительными")
+
+    images = synthetic_images(max(1, args.distinct_images), width, height, args.seed)
+    workdir = Path(tempfile.mkdtemp(prefix="rbx-loadtest-"))
+    try:
+        if args.url:
+            report, peak_rss = asyncio.run(_run_remote(args, images))
+            rss_scope = f"сервер, PID {args.pid} с потомками"
+        else:
+            if args.model:
+                model_path = args.model.resolve()
+                if not model_path.is_file():
+                    print(f"❌ Модель не найдена: {model_path}", file=sys.stderr)
+                    return 1
+            else:
+                model_path = workdir / "models" / "stand-in.onnx"
+                model_path.parent.mkdir()
+                build_stand_in_model(model_path, args.stand_in_gflops, args.seed)
+            env = _environment(workdir, model_path)
+            if args.serve:
+                report, peak_rss = asyncio.run(_run_served(args, images, env))
+                rss_scope = "сервер со всеми воркерами"
+            else:
+                # Настройки читаются при первом импорте app.core.config, поэтому приложение импортируется позже
+                os.environ.update(env)
+                report, peak_rss = asyncio.run(_run_in_process(args, images))
+                rss_scope = "процесс теста вместе с приложением"
+    except RuntimeError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report.update({
+        "users": args.users,
+        "batch": args.batch,
+        "mix": args.mix,
+        "image_size": [width, height],
+        "model": str(args.model) if args.model else f"stand-in {args.stand_in_gflops} GFLOP",
+        "peak_rss_bytes": peak_rss,
+        "rss_scope": rss_scope if peak_rss is not None else None,
+    })
+    print_report(report)
+    if args.json:
+        args.json.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"💾 Результаты: {args.json}")
+    return 1 if any(item["errors"] for item in report["actions"].values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+"""
+Вариант модели с предобработкой внутри графа
+
+Обычная модель принимает float32 NCHW RGB в [0, 1], и Python на каждом кадре приводит
+кадр после letterbox к этому формату. Инструмент добавляет перед графом узлы, которые делают
+то же самое внутри ONNX Runtime (BGR -> RGB, NHWC -> NCHW, приведение к float и деление на 255),
+и сохраняет новую версию модели с входом uint8 NHWC BGR. ImageProcessor определяет такой
+вход по типу и передает модели кадр после letterbox как есть.
+
+После сборки вариант сравнивается с исходной моделью и текущей предобработкой на изображениях
+(или на синтетических кадрах): выходы модели и детекции должны совпасть. Готовый вариант
+выбирается как любая версия модели — файлом ai/ACTIVE, через /api/admin/models/activate или --activate.
+
+Нужен пакет onnx (pip install onnx); серверу для работы с вариантом он не нужен.
+
+Запуск из директории backend:
+    python -m app.services.model_fuse
+    python -m app.services.model_fuse ../ai/best.onnx --images /path/to/images --activate
+"""
+import argparse
+import sys
+from pathlib import Path
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from app.services.image_processor import ImageProcessor
+from app.services.model_loader import activate_model, active_model_path, models_dir
+from app.services.storage import is_image_filename
+
+# Метка в метаданных модели: вход уже приводится графом
+PREPROCESSING_KEY = "rbx.preprocessing"
+PREPROCESSING_UINT8 = "uint8_nhwc_bgr"
+
+
+def _import_onnx():
+    try:
+        import onnx
+    except ImportError:
+        print("❌ Для сборки варианта нужен пакет onnx: pip install onnx", file=sys.stderr)
+        raise SystemExit(1)
+    return onnx
+
+
+def build_uint8_variant(model):
+    """
+    Добавляет к модели вход uint8 NHWC BGR и узлы предобработки перед исходным входом
+
+    Исходный вход становится промежуточным тензором с тем же именем, поэтому остальной
+    граф не меняется.
+    """
+    onnx = _import_onnx()
+    from onnx import TensorProto, helper, numpy_helper
+
+    graph = model.graph
+    initializer_names = {init.name for init in graph.initializer}
+    inputs = [value for value in graph.input if value.name not in initializer_names]
+    if len(inputs) != 1:
+        raise ValueError(f"Ожидается модель с одним входом, входов: {len(inputs)}")
+    source = inputs[0]
+    tensor_type = source.type.tensor_type
+    if tensor_type.elem_type != TensorProto.FLOAT:
+        raise ValueError(f"Вход {source.name} уже не float32 — модель, видимо, уже собрана")
+    dims = list(tensor_type.shape.dim)
+    if len(dims) != 4 or dims[1].dim_value != 3:
+        raise ValueError(f"Ожидается вход NCHW с 3 каналами: {source.name}")
+
+    def dim(value):
+        return value.dim_value if value.HasField("dim_value") else (value.dim_param or None)
+
+    name = source.name
+    uint8_input = helper.make_tensor_value_info(
+        f"{name}_uint8", TensorProto.UINT8, [dim(dims[0]), dim(dims[2]), dim(dims[3]), 3]
+    )
+    # Сначала NHWC -> NCHW: перестановка каналов по оси 1 копирует целые плоскости,
+    # по оси 3 (NHWC) — отдельные байты и в несколько раз медленнее
+    nodes = [
+        helper.make_node("Transpose", [uint8_input.name], [f"{name}_nchw"], perm=[0, 3, 1, 2]),
+        helper.make_node("Gather", [f"{name}_nchw", f"{name}_bgr_to_rgb"], [f"{name}_rgb"], axis=1),
+        helper.make_node("Cast", [f"{name}_rgb"], [f"{name}_float"], to=TensorProto.FLOAT),
+        helper.make_node("Div", [f"{name}_float", f"{name}_scale"], [name]),
+    ]
+    constants = [
+        numpy_helper.from_array(np.array([2, 1, 0], dtype=np.int64), f"{name}_bgr_to_rgb"),
+        # Деление на 255, а не умножение на float32(1/255): так результат совпадает
+        # с cv2.dnn.blobFromImage побитово
+        numpy_helper.from_array(np.array(255.0, dtype=np.float32), f"{name}_scale"),
+    ]
+
+    position = list(graph.input).index(source)
+    graph.input.remove(source)
+    graph.input.insert(position, uint8_input)
+    graph.initializer.extend(constants)
+    original_nodes = list(graph.node)
+    del graph.node[:]
+    graph.node.extend(nodes + original_nodes)
+
+    model.metadata_props.append(onnx.StringStringEntryProto(key=PREPROCESSING_KEY, value=PREPROCESSING_UINT8))
+    onnx.checker.check_model(model)
+    return model
+
+
+def _synthetic_frames(count: int, seed: int = 0) -> list[tuple[str, bytes]]:
+    """Кадры разных размеров и пропорций (JPEG), если своих изображений нет"""
+    rng = np.random.default_rng(seed)
+    sizes = [(1920, 1080), (1080, 1920), (4000, 3000), (640, 640), (1237, 811)]
+    frames = []
+    for i in range(count):
+        width, height = sizes[i % len(sizes)]
+        image = cv2.resize(rng.integers(0, 256, (height // 16, width // 16, 3), dtype=np.uint8), (width, height))
+        for _ in range(8):
+            x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+            color = tuple(int(c) for c in rng.integers(0, 256, 3))
+            cv2.rectangle(image, (x, y), (x + width // 8, y + height // 8), color, -1)
+        ok, encoded = cv2.imencode(".jpg", image)
+        frames.append((f"synthetic-{i}.jpg", encoded.tobytes()))
+    return frames
+
+
+def _image_frames(directory: Path, limit: Optional[int]) -> list[tuple[str, bytes]]:
+    paths = sorted(p for p in directory.rglob("*") if p.is_file() and is_image_filename(p.name))
+    return [(str(path.relative_to(directory)), path.read_bytes()) for path in paths[:limit]]
+
+
+def _same_detections(expected: list[dict], actual: list[dict], atol: float) -> bool:
+    if len(expected) != len(actual):
+        return False
+    for a, b in zip(expected, actual):
+        if a["class_id"] != b["class_id"] or abs(a["conf"] - b["conf"]) > atol:
+            return False
+        if any(abs(x - y) > 0.5 for x, y in zip(a["bbox"], b["bbox"])):
+            return False
+    return True
+
+
+def check_parity(
+    original: ImageProcessor,
+    variant: ImageProcessor,
+    frames: list[tuple[str, bytes]],
+    atol: float = 1e-4,
+) -> bool:
+    """
+    Сравнивает вариант с исходной моделью на одних и тех же кадрах
+
+    Исходная модель получает тензор текущей предобработки (float32 NCHW), вариант — кадр после
+    letterbox (uint8 NHWC); сравниваются выходы модели и детекции после postprocess.
+    """
+    ok = True
+    worst = 0.0
+    for name, image_bytes in frames:
+        model_image, _ = original.decode_for_model(image_bytes)
+        expected_input, _, scale, padding = original.preprocess_image(model_image)
+        actual_input, _, _, _ = variant.preprocess_image(model_image)
+
+        expected_outputs = [np.array(output) for output in original._run_session(expected_input)]
+        actual_outputs = [np.array(output) for output in variant._run_session(actual_input)]
+        diff = max(float(np.max(np.abs(e - a))) if e.size else 0.0 for e, a in zip(expected_outputs, actual_outputs))
+        worst = max(worst, diff)
+
+        expected = original.postprocess(expected_outputs, scale, padding)
+        actual = variant.postprocess(actual_outputs, scale, padding)
+        same = diff <= atol and _same_detections(expected, actual, atol)
+        ok = ok and same
+        mark = "✅" if same else "❌"
+        print(f"  {mark} {name}: детекций {len(expected)} / {len(actual)}, расхождение выходов {diff:.2e}", file=sys.stderr)
+    print(f"Кадров: {len(frames)}, наибольшее расхождение выходов: {worst:.2e} (допуск {atol:.0e})")
+    return ok
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Сборка варианта модели с предобработкой uint8 внутри графа")
+    parser.add_argument("model", type=Path, nargs="?", default=None,
+                        help="Исходная модель (по умолчанию активная версия)")
+    parser.add_argument("--output", type=Path, default=None,
+                        help="Куда сохранить вариант (по умолчанию <имя>.uint8.onnx рядом с исходной)")
+    parser.add_argument("--images", type=Path, default=None,
+                        help="Изображения для проверки совпадения (по умолчанию синтетические кадры)")
+    parser.add_argument("--limit", type=int, default=None, help="Проверить только первые N изображений")
+    parser.add_argument("--frames", type=int, default=10, help="Число синтетических кадров")
+    parser.add_argument("--atol", type=float, default=1e-4, help="Допустимое расхождение выходов и уверенности")
+    # Непроверенный вариант активировать нельзя
+    check = parser.add_mutually_exclusive_group()
+    check.add_argument("--no-check", action="store_true", help="Не сравнивать с исходной моделью")
+    check.add_argument("--activate", action="store_true",
+                       help="Сделать вариант активной версией, если проверка прошла")
+    args = parser.parse_args(argv)
+
+    onnx = _import_onnx()
+    source = args.model or active_model_path()
+    output = args.output or source.with_name(f"{source.stem}.uint8.onnx")
+    if not source.is_file():
+        print(f"❌ Модель не найдена: {source}", file=sys.stderr)
+        return 1
+
+    print(f"🔧 Сборка {output.name} из {source.name}...", file=sys.stderr)
+    try:
+        model = build_uint8_variant(onnx.load(str(source)))
+    except ValueError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    tmp_path = output.with_name(f"{output.name}.tmp")
+    onnx.save(model, str(tmp_path))
+    tmp_path.replace(output)
+    print(f"✅ Сохранено: {output}")
+
+    if not args.no_check:
+        frames = _image_frames(args.images, args.limit) if args.images else _synthetic_frames(args.frames)
+        if not frames:
+            print(f"❌ В {args.images} нет изображений", file=sys.stderr)
+            return 1
+        print("🔍 Сравнение с исходной моделью...", file=sys.stderr)
+        original = ImageProcessor(source)
+        variant = ImageProcessor(output)
+        if not variant.uint8_input:
+            print("❌ Вариант не принимает uint8 — сборка не удалась", file=sys.stderr)
+            return 1
+        if not check_parity(original, variant, frames, args.atol):
+            print("❌ Вариант расходится с исходной моделью, активировать его нельзя", file=sys.stderr)
+            return 1
+
+    if args.activate:
+        if output.parent.resolve() != models_dir().resolve():
+            print(f"❌ Активировать можно только версию из {models_dir()}", file=sys.stderr)
+            return 1
+        activate_model(output.name)
+        print(f"✅ Активная версия: {output.name}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,281 @@
+"""
+Процессор изображений процесса, реестр версий модели и замена модели без перезапуска
+
+Модуль не импортирует OpenCV, ONNX Runtime и PIL: они подгружаются вместе с моделью,
+поэтому импорт приложения остается быстрым, а модель можно грузить в фоне после старта.
+
+Версии модели — файлы *.onnx в директории моделей (по умолчанию ai/ в корне проекта).
+Активная версия записана в файле ACTIVE этой директории (без него — settings.default_model_file).
+Новая версия загружается и прогревается в фоне, затем одной операцией подменяет текущую:
+запросы, уже получившие процессор, дорабатывают на старой версии, новые получают новую.
+
+С inference_server_url модель выбирает и загружает сервер инференса, а процессор воркера
+обращается к нему; наблюдатель тогда следит за версией на сервере.
+"""
+import asyncio
+import hashlib
+import os
+import threading
+import time
+import uuid
+import weakref
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+from app.core.config import settings
+
+if TYPE_CHECKING:
+    from app.services.image_processor import ImageProcessor
+
+ACTIVE_MODEL_FILE = "ACTIVE"
+
+# Текущий процессор; подменяется целиком при загрузке новой версии
+_image_processor: Optional["ImageProcessor"] = None
+# Замененные процессоры, которые еще используются запросами (для ожидания при остановке)
+_retired: "weakref.WeakSet[ImageProcessor]" = weakref.WeakSet()
+_processor_error: Optional[str] = None
+_failed_at: Optional[float] = None
+# not_loaded -> loading -> ready | failed; swapping — загружается новая версия, работает текущая
+_state = "not_loaded"
+_load_seconds: Optional[float] = None
+_loaded_at: Optional[datetime] = None
+# Файл и его (mtime, размер) на момент загрузки — по ним наблюдатель замечает новую версию
+_loaded_path: Optional[Path] = None
+_loaded_signature: Optional[tuple] = None
+_load_lock = threading.Lock()
+_background_tasks: set[asyncio.Task] = set()
+
+
+def models_dir() -> Path:
+    if settings.models_dir is not None:
+        return settings.models_dir
+    return Path(__file__).parent.parent.parent.parent / "ai"
+
+
+def active_model_path() -> Path:
+    """Файл активной версии модели"""
+    pointer = models_dir() / ACTIVE_MODEL_FILE
+    try:
+        name = pointer.read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        name = ""
+    return models_dir() / (name or settings.default_model_file)
+
+
+def _signature(path: Path) -> Optional[tuple]:
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return str(path), stat.st_mtime_ns, stat.st_size
+
+
+def _source_signature(path: Path) -> Optional[tuple]:
+    """Признак смены модели: файл активной версии или версия на сервере инференса"""
+    if settings.inference_server_url:
+        from app.services.inference_rpc import remote_model_version
+
+        version = remote_model_version(settings.inference_server_url)
+        return ("remote", version) if version else None
+    return _signature(path)
+
+
+def model_version(path: Path) -> str:
+    """Версия модели: имя файла и начало SHA-256 содержимого (замена файла дает новую версию)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return f"{path.stem}-{digest.hexdigest()[:12]}"
+
+
+def list_models() -> list[dict]:
+    """Версии модели в директории моделей"""
+    active = active_model_path()
+    models = []
+    for path in sorted(models_dir().glob("*.onnx")):
+        stat = path.stat()
+        models.append({
+            "name": path.name,
+            "size": stat.st_size,
+            "modified_at": datetime.fromtimestamp(stat.st_mtime).isoformat(),
+            "active": path == active,
+            "loaded": path == _loaded_path,
+        })
+    return models
+
+
+def activate_model(name: str) -> Path:
+    """
+    Делает версию активной: записывает ее имя в файл ACTIVE
+
+    Файл читают все воркеры (наблюдатель watch_model_updates), поэтому выбор версии
+    применяется во всех процессах, а не только в том, который принял запрос.
+    """
+    path = models_dir() / name
+    if Path(name).name != name or path.suffix != ".onnx" or not path.is_file():
+        raise FileNotFoundError(f"Версия модели не найдена: {name}")
+    pointer = models_dir() / ACTIVE_MODEL_FILE
+    tmp_path = pointer.with_name(f"{ACTIVE_MODEL_FILE}.{uuid.uuid4().hex}.tmp")
+    tmp_path.write_text(name, encoding="utf-8")
+    os.replace(tmp_path, pointer)
+    return path
+
+
+def _load(path: Path) -> "ImageProcessor":
+    """Загружает, прогревает и подставляет новую версию; вызывается под _load_lock"""
+    global _image_processor, _processor_error, _failed_at, _state, _load_seconds, _loaded_at
+    global _loaded_path, _loaded_signature
+
+    replacing = _image_processor is not None
+    _state = "swapping" if replacing else "loading"
+    started = time.monotonic()
+    remote = settings.inference_server_url
+    signature = _signature(path)
+    try:
+        from app.services.image_processor import ImageProcessor
+
+        if signature is None and not remote:
+            raise FileNotFoundError(f"Модель не найдена: {path}")
+        processor = ImageProcessor(
+            model_path=path,
+            model_version=None if remote else model_version(path),
+            intra_op_num_threads=settings.inference_threads,
+            cascade=settings.cascade_enabled,
+            cascade_model_path=settings.cascade_model_path,
+            cascade_threshold=settings.cascade_threshold,
+            inference_server=remote,
+        )
+        processor.warmup()
+        if remote:
+            signature = ("remote", processor.model_version)
+    except Exception as e:
+        # Ошибка не запоминается навсегда: следующая попытка — через models_retry_seconds
+        # или при изменении файла модели; текущая версия, если есть, продолжает работать
+        _processor_error = str(e)
+        _failed_at = time.monotonic()
+        _loaded_signature = signature
+        _state = "ready" if replacing else "failed"
+        raise RuntimeError(f"Не удалось инициализировать процессор изображений: {e}")
+
+    if replacing:
+        _retired.add(_image_processor)
+    _image_processor = processor
+    _processor_error = None
+    _failed_at = None
+    _load_seconds = time.monotonic() - started
+    _loaded_at = datetime.utcnow()
+    _loaded_path = None if remote else path
+    _loaded_signature = signature
+    _state = "ready"
+    return processor
+
+
+def get_image_processor() -> "ImageProcessor":
+    """
+    Получить текущий процессор изображений
+
+    Первый вызов загружает и прогревает активную версию; параллельные вызовы ждут ту же загрузку.
+    Вызывающий код держит полученный процессор до конца своей работы — замена версии
+    на него не влияет.
+    """
+    processor = _image_processor
+    if processor is not None:
+        return processor
+
+    with _load_lock:
+        if _image_processor is not None:
+            return _image_processor
+        if _failed_at is not None and time.monotonic() - _failed_at < settings.models_retry_seconds:
+            raise RuntimeError(f"Ошибка процессора изображений: {_processor_error}")
+        return _load(active_model_path())
+
+
+def reload_model() -> "ImageProcessor":
+    """Загружает активную версию заново (даже если файл не менялся) и подменяет текущую"""
+    with _load_lock:
+        return _load(active_model_path())
+
+
+def get_loaded_image_processor() -> Optional["ImageProcessor"]:
+    """Возвращает процессор, только если он уже загружен (без попытки загрузки)"""
+    return _image_processor
+
+
+def loaded_image_processors() -> list["ImageProcessor"]:
+    """Текущий процессор и замененные, которые еще дорабатывают начатые запросы"""
+    processors = list(_retired)
+    if _image_processor is not None:
+        processors.append(_image_processor)
+    return processors
+
+
+def current_model_version() -> Optional[str]:
+    return _image_processor.model_version if _image_processor is not None else None
+
+
+def model_status() -> dict:
+    """Состояние модели для проверок готовности"""
+    return {
+        "state": _state,
+        "version": current_model_version(),
+        "path": str(_loaded_path) if _loaded_path else None,
+        "active_path": str(active_model_path()),
+        "inference_server": settings.inference_server_url,
+        "error": _processor_error,
+        "load_seconds": round(_load_seconds, 3) if _load_seconds is not None else None,
+        "loaded_at": _loaded_at.isoformat() if _loaded_at else None,
+        "retired_in_use": len(_retired),
+    }
+
+
+async def load_model_in_background() -> None:
+    """Загружает модель в пуле потоков, не задерживая старт сервера"""
+    try:
+        await asyncio.to_thread(get_image_processor)
+        print(f"✅ Модель {current_model_version()} загружена за {_load_seconds:.2f} с")
+    except Exception as e:
+        print(f"⚠️ Модель не загружена, изображения будут сохраняться без обработки ИИ: {e}")
+
+
+async def reload_model_in_background() -> None:
+    """Загружает активную версию в фоне и подменяет текущую; ошибка не останавливает работу"""
+    previous = current_model_version()
+    try:
+        await asyncio.to_thread(reload_model)
+        print(f"🔄 Модель заменена: {previous} -> {current_model_version()} ({_load_seconds:.2f} с)")
+    except Exception as e:
+        print(f"⚠️ Новая версия модели не загружена, работает {previous}: {e}")
+
+
+def schedule_model_reload() -> None:
+    """Запускает фоновую замену модели из обработчика запроса"""
+    task = asyncio.create_task(reload_model_in_background())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def watch_model_updates() -> None:
+    """
+    Следит за активной версией: смена файла ACTIVE или самого файла модели запускает замену
+
+    Файл должен не меняться между двумя проверками — так не загружается недописанная копия.
+    """
+    candidate = None
+    while True:
+        await asyncio.sleep(settings.models_watch_interval)
+        if _state in ("loading", "swapping"):
+            continue
+        signature = await asyncio.to_thread(_source_signature, active_model_path())
+        if _image_processor is None and _loaded_signature is None:
+            # Модель еще не загружалась (preload_model выключен) — загрузит первая обработка
+            continue
+        if signature is None or signature == _loaded_signature:
+            candidate = None
+            continue
+        if signature != candidate:
+            candidate = signature
+            continue
+        candidate = None
+        await reload_model_in_background()
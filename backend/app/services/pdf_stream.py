@@ -0,0 +1,75 @@
+"""
+PDF, который записывается постранично
+
+Каждая страница — одно JPEG-изображение на весь лист (текст с кириллицей рисуется заранее,
+шрифт в PDF встраивать не нужно). Страницы отдаются по мере готовности, в памяти остаются
+только смещения объектов для таблицы xref в конце файла.
+"""
+
+# A4 в пунктах
+A4_WIDTH_PT = 595.28
+A4_HEIGHT_PT = 841.89
+
+_CATALOG_ID = 1
+_PAGES_ID = 2
+
+
+class PdfStream:
+    """Последовательная запись PDF: start(), add_page() для каждой страницы, finish()"""
+
+    def __init__(self, page_width: float = A4_WIDTH_PT, page_height: float = A4_HEIGHT_PT):
+        self.page_width = page_width
+        self.page_height = page_height
+        self._position = 0
+        self._offsets: dict[int, int] = {}
+        self._page_ids: list[int] = []
+        self._next_id = _PAGES_ID + 1
+
+    def _object(self, object_id: int, body: bytes) -> bytes:
+        data = f"{object_id} 0 obj\n".encode() + body + b"\nendobj\n"
+        self._offsets[object_id] = self._position
+        self._position += len(data)
+        return data
+
+    def _raw(self, data: bytes) -> bytes:
+        self._position += len(data)
+        return data
+
+    def start(self) -> bytes:
+        # Двоичный комментарий во второй строке — признак бинарного файла для программ передачи
+        return self._raw(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def add_page(self, jpeg: bytes, width: int, height: int) -> bytes:
+        """Страница из JPEG (RGB) размером width x height пикселей, растянутого на весь лист"""
+        image_id, content_id, page_id = self._next_id, self._next_id + 1, self._next_id + 2
+        self._next_id += 3
+        self._page_ids.append(page_id)
+
+        image = self._object(image_id, (
+            f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+            f"/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /DCTDecode /Length {len(jpeg)} >>\nstream\n"
+        ).encode() + jpeg + b"\nendstream")
+        content = f"q {self.page_width:.2f} 0 0 {self.page_height:.2f} 0 0 cm /Im0 Do Q".encode()
+        content_object = self._object(
+            content_id, f"<< /Length {len(content)} >>\nstream\n".encode() + content + b"\nendstream"
+        )
+        page = self._object(page_id, (
+            f"<< /Type /Page /Parent {_PAGES_ID} 0 R /MediaBox [0 0 {self.page_width:.2f} {self.page_height:.2f}] "
+            f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> /Contents {content_id} 0 R >>"
+        ).encode())
+        return image + content_object + page
+
+    def finish(self) -> bytes:
+        """Дерево страниц, каталог и таблица xref"""
+        kids = " ".join(f"{page_id} 0 R" for page_id in self._page_ids)
+        data = self._object(_PAGES_ID, f"<< /Type /Pages /Kids [{kids}] /Count {len(self._page_ids)} >>".encode())
+        data += self._object(_CATALOG_ID, f"<< /Type /Catalog /Pages {_PAGES_ID} 0 R >>".encode())
+
+        xref_offset = self._position
+        lines = [f"xref\n0 {self._next_id}\n", "0000000000 65535 f \n"]
+        for object_id in range(1, self._next_id):
+            lines.append(f"{self._offsets[object_id]:010d} 00000 n \n")
+        lines.append(
+            f"trailer\n<< /Size {self._next_id} /Root {_CATALOG_ID} 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n"
+        )
+        return data + self._raw("".join(lines).encode())
@@ -0,0 +1,332 @@
+import asyncio
+import queue
+import threading
+import time
+from collections.abc import Callable, Iterator
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Optional
+
+from app.core.config import settings
+
+if TYPE_CHECKING:
+    from app.services.image_processor import ImageProcessor
+
+STAGE_NAMES = ("decode", "inference", "encode")
+
+
+class PipelineJob:
+    """Изображение, проходящее через конвейер; key — произвольный контекст вызывающего кода"""
+
+    def __init__(self, key: Any, image_bytes: Optional[bytes], output_path: Optional[Path] = None):
+        self.key = key
+        # None — задание проходит конвейер без обработки (не изображение или нет модели)
+        self.image_bytes = image_bytes
+        self.output_path = output_path
+        self.result: Optional[dict] = None
+        self.error: Optional[Exception] = None
+        self._sequence = 0
+        self._prepared: Optional[tuple] = None
+        self._detections: Optional[list[dict]] = None
+        # Кадр отсеян дешевым проходом каскада — инференс и разметка не нужны
+        self._empty = False
+        self._full_seconds = 0.0
+
+
+class _StagePool:
+    """Потоки одной стадии, общие для всех конвейеров процесса; запускаются при первом задании"""
+
+    def __init__(self, index: int, name: str, workers: int):
+        self.index = index
+        self.name = name
+        self.workers = max(1, workers)
+        # Очередь не ограничена: заданий каждого конвейера в ней не больше его окна
+        self.queue: queue.Queue[tuple["ImagePipeline", PipelineJob]] = queue.Queue()
+        self._threads: list[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    def put(self, pipeline: "ImagePipeline", job: PipelineJob) -> None:
+        if not self._threads:
+            self._start()
+        self.queue.put((pipeline, job))
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._threads:
+                return
+            for number in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"pipeline-{self.name}-{number}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _worker(self) -> None:
+        while True:
+            pipeline, job = self.queue.get()
+            pipeline._run_stage(self.index, job)
+
+
+_stage_pools: Optional[list[_StagePool]] = None
+_stage_pools_lock = threading.Lock()
+
+
+def get_stage_pools() -> list[_StagePool]:
+    """
+    Потоки стадий процесса: pipeline_*_workers на стадию, сколько бы загрузок ни шло одновременно
+    """
+    global _stage_pools
+    if _stage_pools is None:
+        with _stage_pools_lock:
+            if _stage_pools is None:
+                workers = (
+                    settings.pipeline_decode_workers,
+                    settings.pipeline_inference_workers,
+                    settings.pipeline_encode_workers,
+                )
+                _stage_pools = [
+                    _StagePool(index, name, count) for index, (name, count) in enumerate(zip(STAGE_NAMES, workers))
+                ]
+    return _stage_pools
+
+
+class _Stage:
+    """Работа одной стадии для одного конвейера"""
+
+    def __init__(self, pool: _StagePool, handler: Callable[[PipelineJob], None]):
+        self.name = pool.name
+        self.workers = pool.workers
+        self.handler = handler
+        self.items = 0
+        # Сколько заданий конвейера прошло стадию (с обработкой или без)
+        self.passed = 0
+        self.busy_seconds = 0.0
+        self.finished_at: Optional[float] = None
+
+
+class ImagePipeline:
+    """
+    Конвейер обработки изображений: декодирование -> инференс -> разметка и запись
+
+    Стадии выполняются общими для процесса потоками (get_stage_pools), поэтому пока модель
+    считает один кадр, следующий уже декодируется, а предыдущий кодируется и пишется на диск,
+    а одновременные загрузки делят одни и те же потоки и не множат их. У каждого конвейера
+    окно заданий: submit блокируется, пока в стадиях и среди невыданных результатов столько
+    заданий, — память не растет, если какая-то стадия или потребитель не успевают.
+    Результаты выдаются в порядке подачи; окно включает и готовые задания, ждущие более раннее.
+
+    Из event loop используются submit_async и next_result_async: они ждут окно и результаты,
+    не занимая потоки пула run_in_threadpool, — иначе каждая загрузка держала бы два потока,
+    и одновременные загрузки исчерпали бы пул, общий с запросами к БД и файлам.
+    """
+
+    def __init__(self, processor: Optional["ImageProcessor"], window: Optional[int] = None):
+        self.processor = processor
+        pools = get_stage_pools()
+        self._pools = pools
+        self._stages = [
+            _Stage(pool, handler) for pool, handler in zip(pools, (self._decode, self._infer, self._encode))
+        ]
+        size = window or max(1, settings.pipeline_queue_size) * (len(self._stages) + 1)
+        self._window = threading.Semaphore(size)
+        self._cond = threading.Condition()
+        # Готовые задания по порядковому номеру подачи
+        self._ready: dict[int, PipelineJob] = {}
+        self._submitted = 0
+        self._next_sequence = 0
+        self._started_at: Optional[float] = None
+        self._cancelled = threading.Event()
+        self._closed = False
+        self._empty_frames = 0
+        # Event loop, из которого ждут submit_async и next_result_async; потоки стадий будят его
+        # через call_soon_threadsafe при каждом готовом результате и освобождении окна
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._changed = asyncio.Event()
+
+    def _decode(self, job: PipelineJob) -> None:
+        if self.processor.cascade and self.processor.screen(job.image_bytes):
+            job._empty = True
+            return
+        started = time.perf_counter()
+        job._prepared = self.processor.prepare(job.image_bytes)
+        job._full_seconds += time.perf_counter() - started
+
+    def _infer(self, job: PipelineJob) -> None:
+        if job._empty:
+            return
+        started = time.perf_counter()
+        model_image, is_full, preprocessed, scale, padding = job._prepared
+        job._detections = self.processor.infer(preprocessed, scale, padding)
+        # Входной тензор больше не нужен, освобождаем его до стадии кодирования
+        job._prepared = (model_image, is_full)
+        job._full_seconds += time.perf_counter() - started
+
+    def _encode(self, job: PipelineJob) -> None:
+        if job._empty:
+            job.result = self.processor.render_empty(job.image_bytes, job.output_path)
+        else:
+            started = time.perf_counter()
+            model_image, is_full = job._prepared
+            job._prepared = None
+            job.result = self.processor.render(
+                job.image_bytes, model_image, is_full, job._detections, job.output_path
+            )
+            self.processor.record_full_pass(job._full_seconds + time.perf_counter() - started)
+        job.image_bytes = None
+        with self._cond:
+            self._empty_frames += int(job._empty)
+
+    def start(self) -> "ImagePipeline":
+        self._started_at = time.perf_counter()
+        return self
+
+    def _run_stage(self, index: int, job: PipelineJob) -> None:
+        """Выполняется потоком стадии; передает задание следующей стадии или в готовые"""
+        stage = self._stages[index]
+        if job.image_bytes is not None and job.error is None and not self._cancelled.is_set():
+            started = time.perf_counter()
+            try:
+                stage.handler(job)
+            except Exception as e:
+                job.error = e
+                job._prepared = None
+                job.image_bytes = None
+            elapsed = time.perf_counter() - started
+            with self._cond:
+                stage.items += 1
+                stage.busy_seconds += elapsed
+        with self._cond:
+            stage.passed += 1
+            if self._closed and stage.passed == self._submitted:
+                stage.finished_at = time.perf_counter()
+            if index + 1 == len(self._stages):
+                self._ready[job._sequence] = job
+                self._cond.notify_all()
+        if index + 1 < len(self._stages):
+            self._pools[index + 1].put(self, job)
+        else:
+            self._notify()
+
+    def _notify(self) -> None:
+        """Будит ожидающих в event loop; вызывается из любого потока"""
+        loop = self._loop
+        if loop is None:
+            return
+        try:
+            loop.call_soon_threadsafe(self._changed.set)
+        except RuntimeError:
+            # Event loop уже закрыт — ждать некому
+            pass
+
+    async def _wait_until(self, ready: Callable[[], bool]) -> None:
+        """Ждет в event loop, пока ready() не вернет True; ready проверяется после каждого _notify"""
+        self._loop = asyncio.get_running_loop()
+        while True:
+            # Сброс до проверки: уведомление после проверки не теряется
+            self._changed.clear()
+            if ready():
+                return
+            await self._changed.wait()
+
+    def submit(self, job: PipelineJob) -> None:
+        """Подает задание на вход; блокируется, пока окно конвейера заполнено"""
+        self._window.acquire()
+        self._enqueue(job)
+
+    async def submit_async(self, job: PipelineJob) -> None:
+        """submit для event loop: ждет место в окне, не блокируя поток"""
+        await self._wait_until(lambda: self._window.acquire(blocking=False))
+        self._enqueue(job)
+
+    def _enqueue(self, job: PipelineJob) -> None:
+        with self._cond:
+            if self._cancelled.is_set():
+                self._window.release()
+                return
+            job._sequence = self._submitted
+            self._submitted += 1
+        self._pools[0].put(self, job)
+
+    def close(self) -> None:
+        """Сообщает, что новых заданий не будет; повторный вызов ничего не делает"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            now = time.perf_counter()
+            for stage in self._stages:
+                if stage.passed == self._submitted:
+                    stage.finished_at = now
+            self._cond.notify_all()
+        self._notify()
+
+    def next_result(self) -> Optional[PipelineJob]:
+        """Следующее по порядку подачи задание или None, если конвейер закрыт и все задания выданы"""
+        with self._cond:
+            while not self._result_ready():
+                self._cond.wait()
+            return self._pop_result()
+
+    async def next_result_async(self) -> Optional[PipelineJob]:
+        """next_result для event loop: ждет результат, не блокируя поток"""
+        def ready() -> bool:
+            with self._cond:
+                return self._result_ready()
+
+        await self._wait_until(ready)
+        with self._cond:
+            return self._pop_result()
+
+    def _result_ready(self) -> bool:
+        """Есть следующее по порядку задание или выдавать больше нечего; вызывается под _cond"""
+        return self._next_sequence in self._ready or (self._closed and self._next_sequence == self._submitted)
+
+    def _pop_result(self) -> Optional[PipelineJob]:
+        """Вызывается под _cond, когда _result_ready() вернул True"""
+        job = self._ready.pop(self._next_sequence, None)
+        if job is None:
+            return None
+        self._next_sequence += 1
+        self._window.release()
+        # Освободилось место в окне — подача в event loop может продолжаться
+        self._notify()
+        return job
+
+    def results(self) -> Iterator[PipelineJob]:
+        """Готовые задания в порядке подачи; заканчивается после close()"""
+        while (job := self.next_result()) is not None:
+            yield job
+
+    def cancel(self) -> None:
+        """
+        Останавливает конвейер, не дожидаясь потребителя
+
+        Оставшиеся задания проходят стадии без обработки, результаты отбрасываются
+        в фоновом потоке — так освобождается окно, если подача ждет в submit.
+        """
+        self._cancelled.set()
+        self.close()
+        threading.Thread(target=self._drain, name="pipeline-drain", daemon=True).start()
+
+    def _drain(self) -> None:
+        for _ in self.results():
+            pass
+
+    def stats(self) -> dict:
+        """Загрузка стадий: доля времени, которое потоки стадии были заняты работой"""
+        now = time.perf_counter()
+        started = self._started_at or now
+        stages = {}
+        for stage in self._stages:
+            wall = (stage.finished_at or now) - started
+            stages[stage.name] = {
+                "workers": stage.workers,
+                "items": stage.items,
+                "busy_seconds": round(stage.busy_seconds, 3),
+                "utilization": round(stage.busy_seconds / (wall * stage.workers), 3) if wall > 0 else 0.0,
+            }
+        finished = self._stages[-1].finished_at or now
+        return {"wall_seconds": round(finished - started, 3), "stages": stages, "empty_frames": self._empty_frames}
+
+    @staticmethod
+    def format_stats(stats: dict) -> str:
+        return ", ".join(
+            f"{name} {stage['utilization']:.0%} ({stage['workers']})" for name, stage in stats["stages"].items()
+        )
@@ -0,0 +1,344 @@
+"""
+Отчет о повреждениях маршрута: каждая детекция bad_insulator / damaged_insulator
+с вырезкой, уверенностью, именем снимка и координатами
+
+Отчет формируется потоком: детекции читаются из БД страницами, вырезки готовятся
+в пуле потоков с опережением на несколько кадров и берутся из кэша миниатюр
+(app.services.crops), строки отдаются клиенту по мере готовности. Память не зависит
+от числа повреждений на маршруте.
+"""
+import asyncio
+import base64
+import csv
+import html
+import io
+import itertools
+from collections import Counter, deque
+from collections.abc import AsyncIterator
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import TYPE_CHECKING, Optional
+
+from app.core.config import settings
+from app.crud.detection import get_route_defects_page
+from app.db.session import AsyncSessionLocal
+from app.services.classes import CLASS_NAMES
+from app.services.crops import CropCache, get_crop_cache
+from app.services.pdf_stream import PdfStream
+
+if TYPE_CHECKING:
+    from app.models.detection import Detection
+    from app.models.route_file import RouteFile
+
+# Формат отчета: MIME-тип и расширение файла
+REPORT_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", ".csv"),
+    "html": ("text/html; charset=utf-8", ".html"),
+    "pdf": ("application/pdf", ".pdf"),
+}
+
+_CSV_COLUMNS = (
+    "number", "image", "file_id", "class_id", "class_name", "confidence",
+    "x1", "y1", "x2", "y2", "latitude", "longitude", "taken_at",
+)
+# Детекций за один запрос к БД
+_PAGE_SIZE = 500
+# Сколько кадров с вырезками готовится впрок на каждый поток
+_PREFETCH_PER_WORKER = 4
+# Строк CSV/HTML в одном куске ответа
+_FLUSH_ROWS = 50
+
+# Страница PDF: A4 при 150 dpi
+_PDF_PAGE_SIZE = (1240, 1754)
+_PDF_MARGIN = 80
+_PDF_ROW_HEIGHT = 200
+_PDF_QUALITY = 80
+
+
+class DefectRow:
+    """Строка отчета: детекция, ее кадр и миниатюра вырезки (JPEG) или None"""
+
+    def __init__(self, number: int, detection: "Detection", route_file: "RouteFile", crop: Optional[bytes]):
+        self.number = number
+        self.detection = detection
+        self.route_file = route_file
+        self.crop = crop
+
+    @property
+    def class_name(self) -> str:
+        return CLASS_NAMES.get(self.detection.class_id, f"class_{self.detection.class_id}")
+
+    @property
+    def location(self) -> str:
+        if self.detection.latitude is None or self.detection.longitude is None:
+            return "—"
+        return f"{self.detection.latitude:.6f}, {self.detection.longitude:.6f}"
+
+    @property
+    def taken_at(self) -> str:
+        return self.route_file.taken_at.strftime("%Y-%m-%d %H:%M:%S") if self.route_file.taken_at else "—"
+
+
+def _load_crops(cache: CropCache, route_file: "RouteFile", detections: list["Detection"]) -> list[Optional[bytes]]:
+    boxes = [(d.x1, d.y1, d.x2, d.y2) for d in detections]
+    return [path.read_bytes() if path else None for path in cache.get_crops(route_file, boxes)]
+
+
+async def _iter_defect_groups(route_id: str) -> AsyncIterator[list[tuple["Detection", "RouteFile"]]]:
+    """Детекции повреждений маршрута, сгруппированные по кадрам"""
+    after_id = 0
+    while True:
+        # Своя короткая сессия на страницу: запрос не держит транзакцию, пока клиент читает ответ
+        async with AsyncSessionLocal() as session:
+            page = await get_route_defects_page(session, route_id, after_id, _PAGE_SIZE)
+        if not page:
+            return
+        after_id = page[-1][0].id
+        for _, group in itertools.groupby(page, key=lambda row: row[1].id):
+            yield list(group)
+
+
+async def iter_defect_rows(route_id: str, with_crops: bool = True) -> AsyncIterator[DefectRow]:
+    """
+    Строки отчета по порядку; вырезки следующих кадров готовятся, пока отдаются текущие
+
+    Один кадр с несколькими повреждениями декодируется один раз.
+    """
+    if not with_crops:
+        number = 0
+        async for group in _iter_defect_groups(route_id):
+            for detection, route_file in group:
+                number += 1
+                yield DefectRow(number, detection, route_file, None)
+        return
+
+    loop = asyncio.get_running_loop()
+    cache = get_crop_cache()
+    workers = max(1, settings.report_crop_workers)
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="report-crops")
+    pending: deque[tuple[list, asyncio.Future]] = deque()
+    number = 0
+    groups = _iter_defect_groups(route_id)
+    exhausted = False
+    try:
+        while pending or not exhausted:
+            while not exhausted and len(pending) < workers * _PREFETCH_PER_WORKER:
+                group = await anext(groups, None)
+                if group is None:
+                    exhausted = True
+                    break
+                detections = [detection for detection, _ in group]
+                future = loop.run_in_executor(executor, _load_crops, cache, group[0][1], detections)
+                pending.append((group, future))
+            if not pending:
+                break
+            group, future = pending.popleft()
+            for (detection, route_file), crop in zip(group, await future):
+                number += 1
+                yield DefectRow(number, detection, route_file, crop)
+    finally:
+        # Клиент мог прервать загрузку: не ждем вырезки, которые уже никому не нужны
+        executor.shutdown(wait=False, cancel_futures=True)
+        await groups.aclose()
+
+
+async def stream_csv_report(route_id: str) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM — чтобы Excel открыл кириллицу без выбора кодировки
+    buffer.write("\ufeff")
+    writer.writerow(_CSV_COLUMNS)
+    async for row in iter_defect_rows(route_id, with_crops=False):
+        detection = row.detection
+        writer.writerow((
+            row.number,
+            row.route_file.original_name,
+            row.route_file.id,
+            detection.class_id,
+            row.class_name,
+            round(detection.confidence, 4),
+            round(detection.x1, 1),
+            round(detection.y1, 1),
+            round(detection.x2, 1),
+            round(detection.y2, 1),
+            detection.latitude,
+            detection.longitude,
+            row.route_file.taken_at.isoformat() if row.route_file.taken_at else None,
+        ))
+        if row.number % _FLUSH_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+_HTML_HEAD = """<!DOCTYPE html>
+<html lang="ru">
+<head>
+<meta charset="utf-8">
+<title>Отчет о повреждениях: {name}</title>
+<style>
+body {{ font-family: sans-serif; margin: 24px; color: #222; }}
+table {{ border-collapse: collapse; width: 100%; }}
+th, td {{ border: 1px solid #ccc; padding: 6px 8px; text-align: left; vertical-align: middle; }}
+th {{ background: #f2f2f2; }}
+td.crop {{ width: {size}px; text-align: center; }}
+td.crop img {{ max-width: {size}px; max-height: {size}px; display: block; margin: auto; }}
+tr {{ page-break-inside: avoid; }}
+</style>
+</head>
+<body>
+<h1>Отчет о повреждениях</h1>
+<p>Маршрут: <b>{name}</b><br>Сформирован: {generated}</p>
+<table>
+<thead><tr><th>№</th><th>Вырезка</th><th>Класс</th><th>Уверенность</th><th>Снимок</th><th>Координаты</th><th>Время съемки</th></tr></thead>
+<tbody>
+"""
+
+
+async def stream_html_report(route_id: str, route_name: str) -> AsyncIterator[str]:
+    """Самодостаточная HTML-страница: вырезки встроены как data URI"""
+    yield _HTML_HEAD.format(
+        name=html.escape(route_name),
+        size=settings.report_crop_size,
+        generated=datetime.now().strftime("%Y-%m-%d %H:%M"),
+    )
+    counts: Counter = Counter()
+    chunk: list[str] = []
+    async for row in iter_defect_rows(route_id):
+        counts[row.class_name] += 1
+        crop = (
+            f'<img src="data:image/jpeg;base64,{base64.b64encode(row.crop).decode()}" alt="">'
+            if row.crop else "—"
+        )
+        chunk.append(
+            f"<tr><td>{row.number}</td><td class=\"crop\">{crop}</td><td>{row.class_name}</td>"
+            f"<td>{row.detection.confidence:.2f}</td><td>{html.escape(row.route_file.original_name)}</td>"
+            f"<td>{row.location}</td><td>{row.taken_at}</td></tr>\n"
+        )
+        if len(chunk) >= _FLUSH_ROWS:
+            yield "".join(chunk)
+            chunk = []
+    total = sum(counts.values())
+    by_class = ", ".join(f"{name}: {count}" for name, count in sorted(counts.items()))
+    chunk.append(
+        f"</tbody>\n</table>\n<p>Всего повреждений: <b>{total}</b>{' (' + by_class + ')' if by_class else ''}</p>\n"
+        "</body>\n</html>\n"
+    )
+    yield "".join(chunk)
+
+
+class _PdfPageRenderer:
+    """Рисует страницы отчета; вызывается в потоке пула, не в цикле событий"""
+
+    def __init__(self, route_name: str, generated: str):
+        from PIL import ImageFont
+
+        self.route_name = route_name
+        self.generated = generated
+        self.font = _load_font(ImageFont, 26)
+        self.title_font = _load_font(ImageFont, 40)
+        self.crop_size = settings.report_crop_size
+
+    def render(self, rows: list[DefectRow], page_number: int, footer: Optional[str] = None) -> tuple[bytes, int, int]:
+        from PIL import Image, ImageDraw
+
+        width, height = _PDF_PAGE_SIZE
+        page = Image.new("RGB", _PDF_PAGE_SIZE, "white")
+        draw = ImageDraw.Draw(page)
+        y = _PDF_MARGIN
+        if page_number == 1:
+            draw.text((_PDF_MARGIN, y), "Отчет о повреждениях", font=self.title_font, fill="black")
+            y += 60
+            draw.text((_PDF_MARGIN, y), f"Маршрут: {self.route_name}", font=self.font, fill="black")
+            y += 36
+            draw.text((_PDF_MARGIN, y), f"Сформирован: {self.generated}", font=self.font, fill="black")
+            y += 60
+
+        text_x = _PDF_MARGIN + self.crop_size + 30
+        for row in rows:
+            draw.line((_PDF_MARGIN, y, width - _PDF_MARGIN, y), fill="#cccccc", width=2)
+            y += 15
+            if row.crop:
+                with Image.open(io.BytesIO(row.crop)) as crop:
+                    page.paste(crop.convert("RGB"), (_PDF_MARGIN, y))
+            else:
+                draw.rectangle((_PDF_MARGIN, y, _PDF_MARGIN + self.crop_size, y + self.crop_size), outline="#cccccc")
+            lines = [
+                f"№ {row.number}   {row.class_name}   уверенность {row.detection.confidence:.2f}",
+                f"Снимок: {row.route_file.original_name}",
+                f"Координаты: {row.location}",
+                f"Время съемки: {row.taken_at}",
+            ]
+            for i, line in enumerate(lines):
+                line = _fit_text(draw, line, self.font, width - _PDF_MARGIN - text_x)
+                draw.text((text_x, y + i * 38), line, font=self.font, fill="black")
+            y += _PDF_ROW_HEIGHT - 15
+
+        if footer:
+            draw.text((_PDF_MARGIN, y + 30), footer, font=self.font, fill="black")
+        draw.text((width - _PDF_MARGIN - 150, height - _PDF_MARGIN), f"Стр. {page_number}", font=self.font, fill="#555555")
+
+        output = io.BytesIO()
+        page.save(output, "JPEG", quality=_PDF_QUALITY)
+        return output.getvalue(), width, height
+
+    def rows_per_page(self, page_number: int) -> int:
+        top = _PDF_MARGIN + (156 if page_number == 1 else 0)
+        # Место под итог и номер страницы
+        available = _PDF_PAGE_SIZE[1] - top - _PDF_MARGIN - 100
+        return max(1, available // _PDF_ROW_HEIGHT)
+
+
+def _fit_text(draw, text: str, font, max_width: float) -> str:
+    """Обрезает строку с многоточием, чтобы она поместилась по ширине"""
+    if draw.textlength(text, font=font) <= max_width:
+        return text
+    while text and draw.textlength(text + "…", font=font) > max_width:
+        text = text[:-1]
+    return text + "…"
+
+
+def _load_font(image_font, size: int):
+    candidates = [str(settings.report_font_path)] if settings.report_font_path else []
+    candidates += ["DejaVuSans.ttf", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"]
+    for candidate in candidates:
+        try:
+            return image_font.truetype(candidate, size)
+        except OSError:
+            continue
+    # Встроенный шрифт Pillow: кириллица может не отображаться
+    return image_font.load_default(size)
+
+
+async def stream_pdf_report(route_id: str, route_name: str) -> AsyncIterator[bytes]:
+    """PDF по странице: страница рисуется и отдается, как только набраны ее строки"""
+    pdf = PdfStream()
+    renderer = _PdfPageRenderer(route_name, datetime.now().strftime("%Y-%m-%d %H:%M"))
+    yield pdf.start()
+
+    counts: Counter = Counter()
+    page_rows: list[DefectRow] = []
+    page_number = 1
+    async for row in iter_defect_rows(route_id):
+        counts[row.class_name] += 1
+        page_rows.append(row)
+        if len(page_rows) == renderer.rows_per_page(page_number):
+            yield pdf.add_page(*await asyncio.to_thread(renderer.render, page_rows, page_number))
+            page_rows = []
+            page_number += 1
+
+    total = sum(counts.values())
+    by_class = ", ".join(f"{name}: {count}" for name, count in sorted(counts.items()))
+    footer = f"Всего повреждений: {total}" + (f" ({by_class})" if by_class else "")
+    yield pdf.add_page(*await asyncio.to_thread(renderer.render, page_rows, page_number, footer))
+    yield pdf.finish()
+
+
+def stream_report(route_id: str, route_name: str, report_format: str) -> AsyncIterator:
+    """Поток отчета в нужном формате (REPORT_FORMATS)"""
+    if report_format == "csv":
+        return stream_csv_report(route_id)
+    if report_format == "pdf":
+        return stream_pdf_report(route_id, route_name)
+    return stream_html_report(route_id, route_name)
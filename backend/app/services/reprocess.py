@@ -0,0 +1,331 @@
+import asyncio
+import os
+import shutil
+from collections.abc import AsyncIterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.crud.blob import add_blob_refs, delete_blob_files, release_blob_refs
+from app.crud.detection import add_detections, count_detections_by_class, delete_detections_of_files
+from app.crud.reprocess_job import (
+    create_reprocess_job,
+    release_route_locks,
+    touch_route_locks,
+    update_reprocess_job,
+)
+from app.crud.rollup import RollupDelta, apply_rollup_delta, count_classes
+from app.crud.route_file import lock_route_files, select_route_files
+from app.db.session import AsyncSessionLocal
+from app.models.reprocess_job import ReprocessJob
+from app.models.route_file import RouteFile
+from app.services.model_loader import get_image_processor
+from app.services.storage import (
+    checksum_file,
+    file_original_path,
+    processed_path,
+    route_processed_dir,
+    route_upload_dir,
+)
+
+if TYPE_CHECKING:
+    from app.services.image_processor import ImageProcessor
+
+# Журналы обработанных файлов: <директория маршрута>/.reprocess/<версия модели>/<ID задачи>.log
+CHECKPOINT_DIR = ".reprocess"
+
+# Количество загрузок, которые сейчас обрабатываются в этом процессе.
+# Повторная обработка уступает им процессор, чтобы не замедлять пользователей.
+_live_uploads = 0
+
+
+@asynccontextmanager
+async def live_upload() -> AsyncIterator[None]:
+    """Отмечает выполняющуюся пользовательскую загрузку"""
+    global _live_uploads
+    _live_uploads += 1
+    try:
+        yield
+    finally:
+        _live_uploads -= 1
+
+
+# Поля задачи, которые сохраняются в БД по ходу обработки
+_PROGRESS_FIELDS = (
+    "status", "total", "processed", "skipped", "failed", "current_route_id", "error", "started_at", "finished_at",
+)
+
+# Задачи, которые выполняет этот процесс (ссылки, чтобы задачи не собрал сборщик мусора)
+_tasks: set[asyncio.Task] = set()
+
+
+def job_to_dict(job: ReprocessJob) -> dict:
+    done = job.processed + job.skipped + job.failed
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "route_ids": job.route_ids,
+        "current_route_id": job.current_route_id,
+        "total": job.total,
+        "processed": job.processed,
+        "skipped": job.skipped,
+        "failed": job.failed,
+        "progress": round(done / job.total, 4) if job.total else (1.0 if job.status == "completed" else 0.0),
+        "error": job.error,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+async def start_job(
+    session: AsyncSession,
+    user_id: str,
+    route_ids: list[str],
+    file_ids: list[str] | None = None,
+    file_filter: str | None = None,
+) -> ReprocessJob | None:
+    """
+    Создает задачу и запускает ее в фоне в этом процессе
+
+    Returns:
+        ReprocessJob или None, если часть маршрутов уже обрабатывается (в любом процессе)
+    """
+    # Без явного выбора обрабатываются все файлы маршрута
+    if file_ids is None and not file_filter:
+        file_filter = "all"
+    job = await create_reprocess_job(session, user_id, route_ids, file_ids, file_filter)
+    if job is None:
+        return None
+    task = asyncio.create_task(_run_job(job))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return job
+
+
+async def _save_progress(session: AsyncSession, job: ReprocessJob) -> bool:
+    """
+    Сохраняет прогресс задачи и продлевает блокировки ее маршрутов (без commit)
+
+    Returns:
+        bool: False, если блокировки сняты как брошенные и маршруты может обрабатывать другая задача
+    """
+    await update_reprocess_job(session, job.id, **{field: getattr(job, field) for field in _PROGRESS_FIELDS})
+    return await touch_route_locks(session, job.id) > 0
+
+
+async def _heartbeat(job: ReprocessJob) -> None:
+    """Продлевает блокировки, пока задача ждет загрузки или обрабатывает длинный пакет"""
+    while True:
+        await asyncio.sleep(max(1.0, settings.route_lock_timeout / 4))
+        try:
+            async with AsyncSessionLocal() as session:
+                await _save_progress(session, job)
+                await session.commit()
+        except Exception as e:
+            print(f"⚠️ Не удалось обновить задачу повторной обработки {job.id}: {e}")
+
+
+def _checkpoint_path(route_id: str, model_version: str, job_id: str) -> Path:
+    return route_upload_dir(route_id) / CHECKPOINT_DIR / model_version / f"{job_id}.log"
+
+
+def _load_checkpoints(route_id: str, model_version: str) -> tuple[set[str], list[Path]]:
+    """
+    ID файлов, уже обработанных этой версией модели в прерванных запусках, и журналы этих запусков
+
+    Журналы других версий модели устарели и удаляются. Одновременно маршрут обрабатывает
+    только одна задача, поэтому остальные журналы той же версии принадлежат прерванным запускам.
+    """
+    root = route_upload_dir(route_id) / CHECKPOINT_DIR
+    done: set[str] = set()
+    paths: list[Path] = []
+    if not root.is_dir():
+        return done, paths
+    for directory in root.iterdir():
+        if directory.name != model_version:
+            shutil.rmtree(directory, ignore_errors=True)
+            continue
+        for path in directory.glob("*.log"):
+            with open(path, "r", encoding="utf-8") as f:
+                done.update(line.strip() for line in f if line.strip())
+            paths.append(path)
+    return done, paths
+
+
+def _remove_checkpoints(route_id: str, paths: list[Path]) -> None:
+    for path in paths:
+        path.unlink(missing_ok=True)
+    root = route_upload_dir(route_id) / CHECKPOINT_DIR
+    # Пустые директории версий и сам журнал маршрута больше не нужны
+    for directory in [*root.glob("*"), root]:
+        try:
+            directory.rmdir()
+        except OSError:
+            pass
+
+
+def _append_checkpoint(path: Path, file_ids: list[str]) -> None:
+    """Дописывает ID обработанных файлов в журнал — один fsync на пакет"""
+    if not file_ids:
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("".join(f"{file_id}\n" for file_id in file_ids))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _reprocess_file(processor: "ImageProcessor", route_file: RouteFile) -> dict:
+    """Обрабатывает сохраненный оригинал; результат пишется во временный файл"""
+    with open(file_original_path(route_file), "rb") as f:
+        content = f.read()
+
+    target_path = processed_path(route_file.route_id, route_file.id, settings.processed_format)
+    tmp_path = target_path.with_name(f"{target_path.name}.tmp")
+    try:
+        result = processor.process_image(content, output_path=tmp_path)
+        result["hash"], result["crc32"], result["size"] = checksum_file(tmp_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    result["tmp_path"] = tmp_path
+    return result
+
+
+async def _wait_for_live_uploads() -> None:
+    while _live_uploads > 0:
+        await asyncio.sleep(settings.reprocess_throttle_seconds)
+
+
+async def _reprocess_route(job: ReprocessJob, processor: "ImageProcessor", executor: ThreadPoolExecutor,
+                           route_id: str) -> None:
+    loop = asyncio.get_running_loop()
+    done, checkpoints = _load_checkpoints(route_id, processor.model_version)
+    checkpoint = _checkpoint_path(route_id, processor.model_version, job.id)
+    route_processed_dir(route_id).mkdir(parents=True, exist_ok=True)
+
+    async with AsyncSessionLocal() as session:
+        route_files = await select_route_files(
+            session, route_id, job.file_ids, job.file_filter, model_version=processor.model_version
+        )
+        route_files = [f for f in route_files if processor.is_image_file(f.original_name)]
+
+        # Пропускаются только файлы, которые и в БД записаны как обработанные этой моделью
+        pending = [f for f in route_files if f.id not in done or f.model_version != processor.model_version]
+        job.skipped += len(route_files) - len(pending)
+
+        batch_size = max(1, settings.reprocess_batch_size)
+        for i in range(0, len(pending), batch_size):
+            await _wait_for_live_uploads()
+            batch: list[RouteFile] = pending[i:i + batch_size]
+
+            futures = [
+                loop.run_in_executor(executor, _reprocess_file, processor, f)
+                for f in batch
+            ]
+            results = await asyncio.gather(*futures, return_exceptions=True)
+
+            # Подменяем обработанные изображения атомарно и фиксируем статистику одной транзакцией.
+            # Файлы, удаленные или замененные загрузкой во время обработки, пропускаются
+            present = await lock_route_files(session, [f.id for f in batch])
+            succeeded_ids = [
+                f.id for f, result in zip(batch, results)
+                if f.id in present and not isinstance(result, Exception)
+            ]
+            class_counts = await count_detections_by_class(session, succeeded_ids)
+            await delete_detections_of_files(session, succeeded_ids)
+            delta = RollupDelta(job.user_id)
+            finished: list[str] = []
+            new_blobs: list[tuple[str, Path]] = []
+            old_hashes: list[str | None] = []
+            stale_paths: list[Path] = []
+            for route_file, result in zip(batch, results):
+                if route_file.id not in present:
+                    if not isinstance(result, Exception):
+                        result["tmp_path"].unlink(missing_ok=True)
+                    job.skipped += 1
+                    continue
+                if isinstance(result, Exception):
+                    print(f"Ошибка повторной обработки {route_file.original_name}: {result}")
+                    job.failed += 1
+                    continue
+                # Новая версия попадает в хранилище, старая теряет ссылку; версия из директории
+                # маршрута (до переноса в хранилище) больше не нужна
+                new_blobs.append((result["hash"], result["tmp_path"]))
+                old_hashes.append(route_file.processed_hash)
+                if route_file.is_processed and not route_file.processed_hash:
+                    stale_paths.append(processed_path(route_id, route_file.id, route_file.processed_format))
+                route_file.processed_hash = result["hash"]
+                route_file.processed_crc32 = result["crc32"]
+                route_file.processed_size = result["size"]
+                delta.remove(route_file, class_counts.get(route_file.id, {}))
+                route_file.is_processed = True
+                route_file.processed_format = result["format"]
+                route_file.model_version = result["model_version"]
+                route_file.red_detection_count = result["red_detection_count"]
+                route_file.green_detection_count = result["green_detection_count"]
+                route_file.total_detections = result["total_detections"]
+                add_detections(session, route_file, result["detections"])
+                delta.add(route_file, count_classes(result["detections"]))
+                finished.append(route_file.id)
+                job.processed += 1
+            await apply_rollup_delta(session, delta)
+            await add_blob_refs(session, new_blobs)
+            freed = await release_blob_refs(session, old_hashes)
+            if not await _save_progress(session, job):
+                raise RuntimeError("Блокировка маршрута снята как брошенная, обработка остановлена")
+            await session.commit()
+            await delete_blob_files(session, freed)
+            for path in stale_paths:
+                path.unlink(missing_ok=True)
+            _append_checkpoint(checkpoint, finished)
+
+    _remove_checkpoints(route_id, [*checkpoints, checkpoint])
+
+
+async def _run_job(job: ReprocessJob) -> None:
+    job.status = "running"
+    job.started_at = datetime.utcnow()
+    heartbeat = asyncio.create_task(_heartbeat(job))
+    try:
+        processor = await asyncio.to_thread(get_image_processor)
+
+        async with AsyncSessionLocal() as session:
+            for route_id in job.route_ids:
+                route_files = await select_route_files(
+                    session, route_id, job.file_ids, job.file_filter, model_version=processor.model_version
+                )
+                job.total += sum(1 for f in route_files if processor.is_image_file(f.original_name))
+            await _save_progress(session, job)
+            await session.commit()
+
+        with ThreadPoolExecutor(max_workers=max(1, settings.reprocess_workers)) as executor:
+            for route_id in job.route_ids:
+                job.current_route_id = route_id
+                await _reprocess_route(job, processor, executor, route_id)
+        job.current_route_id = None
+        job.status = "completed"
+    except asyncio.CancelledError:
+        # Остановка воркера: уже обработанные файлы записаны в журнал, повторный запуск продолжит
+        job.status = "failed"
+        job.error = "Задача прервана остановкой воркера"
+        raise
+    except Exception as e:
+        print(f"❌ Ошибка повторной обработки: {e}")
+        job.status = "failed"
+        job.error = str(e)
+    finally:
+        heartbeat.cancel()
+        job.finished_at = datetime.utcnow()
+        try:
+            async with AsyncSessionLocal() as session:
+                await _save_progress(session, job)
+                await release_route_locks(session, job.id)
+                await session.commit()
+        except Exception as e:
+            print(f"⚠️ Не удалось сохранить задачу повторной обработки {job.id}: {e}")
@@ -0,0 +1,163 @@
+"""
+Замер времени ответа списка файлов маршрута на большом маршруте
+
+Во временной директории создается отдельная БД с маршрутом из N обработанных файлов, после чего
+GET /api/routes/{id}/files запрашивается через приложение в этом же процессе (без сети):
+без сжатия, с gzip и с brotli — с выключенным кэшем ответов,
+затем из кэша и с If-None-Match (ответ 304). Для сравнения отдельно замеряется
+кодирование того же ответа прежним путем FastAPI (проверка pydantic, jsonable_encoder, json.dumps)
+и через orjson.
+
+Запуск из директории backend:
+    python -m app.services.response_bench --files 10000
+    python -m app.services.response_bench --files 10000 --repeat 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+
+def _summary(samples: list[float]) -> tuple[float, float]:
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    return statistics.median(samples) * 1000, p95 * 1000
+
+
+async def _seed(files: int) -> tuple[str, str]:
+    """Пользователь и маршрут с files обработанными файлами; возвращает (route_id, токен)"""
+    from app.core.security import create_access_token
+    from app.crud.route import create_route
+    from app.crud.user import create_user
+    from app.db.session import AsyncSessionLocal
+    from app.main import init_database
+    from app.models.route_file import RouteFile
+    from app.schemas.user import UserCreate
+
+    await init_database()
+    async with AsyncSessionLocal() as session:
+        user = await create_user(session, UserCreate(email="bench@example.com", password="benchmark"))
+        route = await create_route(session, "Замер", user.id)
+        for start in range(0, files, 1000):
+            session.add_all(
+                RouteFile(
+                    id=str(uuid.uuid4()),
+                    route_id=route.id,
+                    original_name=f"DJI_{i:05d}.JPG",
+                    file_ext=".JPG",
+                    is_processed=True,
+                    processed_format="jpeg",
+                    model_version="best-000000000000",
+                    red_detection_count=i % 3,
+                    green_detection_count=i % 5,
+                    total_detections=i % 3 + i % 5,
+                )
+                for i in range(start, min(files, start + 1000))
+            )
+            await session.commit()
+        return route.id, create_access_token(user.email)
+
+
+async def _measure(files: int, repeat: int) -> int:
+    import httpx
+    import orjson
+    from fastapi.encoders import jsonable_encoder
+    from pydantic import TypeAdapter
+
+    from app.main import app
+    from app.services.response_cache import get_response_cache
+
+    route_id, token = await _seed(files)
+    url = f"/api/routes/{route_id}/files"
+    encodings = ["identity", "gzip", "br"]
+    cache = get_response_cache()
+    cache_size, cache.max_bytes = cache.max_bytes, 0
+
+    transport = httpx.ASGITransport(app=app)
+    rows = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def run(name: str, headers: dict, expected_status: int = 200) -> bytes:
+            samples = []
+            raw = b""
+            for attempt in range(repeat + 1):
+                started = time.perf_counter()
+                async with client.stream("GET", url, headers={"Authorization": f"Bearer {token}", **headers}) as response:
+                    # Сырые байты, как они ушли бы в сеть (клиент их не распаковывает)
+                    raw = b"".join([chunk async for chunk in response.aiter_raw()])
+                elapsed = time.perf_counter() - started
+                if response.status_code != expected_status:
+                    raise RuntimeError(f"{url}: {response.status_code}")
+                if attempt:
+                    samples.append(elapsed)
+            rows.append((name, *_summary(samples), len(raw)))
+            return raw
+
+        try:
+            # Без кэша ответов: каждый запрос читает файлы из БД
+            for encoding in encodings:
+                raw = await run(f"ответ, {encoding}", {"Accept-Encoding": encoding})
+                if encoding == "identity":
+                    content = orjson.loads(raw)
+            cache.max_bytes = cache_size
+            if cache.max_bytes:
+                await run("ответ из кэша, identity", {"Accept-Encoding": "identity"})
+            response = await client.get(url, headers={"Authorization": f"Bearer {token}"})
+            await run("ответ 304 по ETag", {"If-None-Match": response.headers["etag"]}, expected_status=304)
+        except RuntimeError as e:
+            print(f"❌ {e}", file=sys.stderr)
+            return 1
+
+    # Кодирование того же ответа: прежний путь FastAPI для обработчика с "-> dict" и orjson
+    adapter = TypeAdapter(dict)
+    for name, encode in (
+        ("кодирование, pydantic+json", lambda: json.dumps(
+            jsonable_encoder(adapter.validate_python(content)),
+            ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":"),
+        ).encode()),
+        ("кодирование, orjson", lambda: orjson.dumps(content)),
+    ):
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            body = encode()
+            samples.append(time.perf_counter() - started)
+        rows.append((name, *_summary(samples), len(body)))
+
+    print(f"Файлов в маршруте: {files}, запросов на вариант: {repeat}")
+    print(f"{'':<30} {'медиана, мс':>12} {'p95, мс':>9} {'байт':>11}")
+    for name, median, p95, size in rows:
+        print(f"{name:<30} {median:>12.1f} {p95:>9.1f} {size:>11}")
+    return 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Время ответа списка файлов на большом маршруте")
+    parser.add_argument("--files", type=int, default=10000, help="Файлов в маршруте")
+    parser.add_argument("--repeat", type=int, default=20, help="Запросов на каждый вариант")
+    args = parser.parse_args(argv)
+
+    # Отдельная БД и директории во временной папке: рабочие данные не трогаются.
+    # Настройки читаются при первом импорте app.core.config, поэтому приложение импортируется ниже
+    workdir = Path(tempfile.mkdtemp(prefix="rbx-bench-"))
+    os.environ["database_url"] = f"sqlite+aiosqlite:///{workdir / 'bench.db'}"
+    os.environ["upload_dir"] = str(workdir / "uploads")
+    os.environ["processed_dir"] = str(workdir / "uploads" / "processed")
+    os.environ["preload_model"] = "false"
+    os.environ["models_watch_interval"] = "0"
+    # Без журнала SQL (он включен в окружении development)
+    os.environ["environment"] = "benchmark"
+    try:
+        return asyncio.run(_measure(args.files, max(1, args.repeat)))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""
+Кэш ответов GET, которые целиком определяются данными в БД
+
+Ключ ответа — пользователь, путь и параметры запроса; к нему прилагается версия данных
+(app.crud.response_version): маршрута для его файлов и статистики, пользователя — для списка
+маршрутов и сводки. Версия меняется в транзакции вместе с данными, поэтому каждый запрос читает
+только ее и отдает закэшированное тело, если версия та же.
+
+ETag слабый и вычисляется из ключа и версии, поэтому ответ 304 не требует ни тела в памяти,
+ни пересчета: клиент с актуальным ETag получает его в любом воркере. Подпись секретным ключом
+не дает подобрать ETag чужого маршрута.
+"""
+import hashlib
+import hmac
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+from urllib.parse import urlencode
+
+from fastapi import Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.crud.response_version import get_response_version
+
+# Клиент обязан перепроверять ответ (ETag), но хранить его может только у себя
+_CACHE_CONTROL = "private, no-cache"
+# Заголовки, которые не сохраняются вместе с телом
+_SKIPPED_HEADERS = {"content-length", "etag", "cache-control"}
+
+
+class _Entry(NamedTuple):
+    version: int
+    body: bytes
+    headers: dict[str, str]
+
+
+class ResponseCache:
+    """LRU тел ответов с ограничением по суммарному размеру; используется только из event loop"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def get(self, key: str, version: int) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None or entry.version != version:
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, entry: _Entry) -> None:
+        if len(entry.body) > self.max_bytes:
+            return
+        self.discard(key)
+        self._entries[key] = entry
+        self.size += len(entry.body)
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted.body)
+
+    def discard(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry.body)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+        }
+
+
+_response_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> ResponseCache:
+    """Кэш этого процесса (при prefork у каждого воркера свой, версии общие через БД)"""
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache(max(0, settings.response_cache_mb) * 1024 * 1024)
+    return _response_cache
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Слабое сравнение из If-None-Match: префикс W/ не учитывается
+
+    "*" не совпадает ни с чем: существует ли еще маршрут, здесь неизвестно — это проверит обработчик.
+    """
+    if not if_none_match:
+        return False
+    tag = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == tag for candidate in if_none_match.split(","))
+
+
+class CachedRead:
+    """
+    Кэшируемый ответ одного запроса
+
+    response — готовый ответ (из кэша или 304), если обработчику ничего считать не нужно;
+    иначе обработчик собирает ответ и передает его в store().
+    """
+
+    def __init__(self, key: str, version: int, etag: str):
+        self.key = key
+        self.version = version
+        self.etag = etag
+        self.response: Optional[Response] = None
+
+    def _headers(self) -> dict[str, str]:
+        return {"ETag": self.etag, "Cache-Control": _CACHE_CONTROL}
+
+    def store(self, response: Response) -> Response:
+        """Дополняет ответ ETag и сохраняет его тело под версией, прочитанной до сборки ответа"""
+        if response.status_code != 200:
+            return response
+        response.headers.update(self._headers())
+        cache = get_response_cache()
+        if cache.max_bytes:
+            headers = {name: value for name, value in response.headers.items() if name not in _SKIPPED_HEADERS}
+            cache.put(self.key, _Entry(self.version, bytes(response.body), headers))
+        return response
+
+
+async def cached_read(request: Request, session: AsyncSession, user_id: str, scope: str) -> CachedRead:
+    """
+    Проверяет кэш для GET-запроса пользователя к данным scope (route_scope или user_scope)
+
+    Версия читается до данных: если они изменятся во время сборки ответа, более свежее тело
+    сохранится под старой версией и просто не совпадет со следующей.
+    """
+    query = urlencode(sorted(request.query_params.multi_items()))
+    key = f"{user_id}\n{request.url.path}\n{query}"
+    version = await get_response_version(session, scope)
+    etag = 'W/"' + hmac.new(
+        settings.secret_key.encode(), f"{key}\n{version}".encode(), hashlib.sha256
+    ).hexdigest()[:32] + '"'
+    read = CachedRead(key, version, etag)
+
+    cache = get_response_cache()
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        cache.not_modified += 1
+        read.response = Response(status_code=304, headers=read._headers())
+        return read
+    entry = cache.get(key, version) if cache.max_bytes else None
+    if entry is not None:
+        cache.hits += 1
+        read.response = Response(content=entry.body, headers={**entry.headers, **read._headers()})
+    else:
+        cache.misses += 1
+    return read
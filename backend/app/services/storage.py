@@ -0,0 +1,233 @@
+import hashlib
+import os
+import shutil
+import time
+import uuid
+import zlib
+from abc import ABC, abstractmethod
+from collections.abc import Iterator
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+from app.core.config import settings
+
+if TYPE_CHECKING:
+    from app.models.route_file import RouteFile
+
+# Форматы обработанных изображений: расширение файла и MIME-тип
+PROCESSED_FORMATS = {
+    "jpeg": (".jpg", "image/jpeg"),
+    "webp": (".webp", "image/webp"),
+}
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif', '.webp'}
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def is_image_filename(filename: str) -> bool:
+    """Проверяет по расширению, является ли файл изображением"""
+    return any(filename.lower().endswith(ext) for ext in IMAGE_EXTENSIONS)
+
+
+def route_upload_dir(route_id: str) -> Path:
+    """Директория с оригиналами файлов маршрута"""
+    return settings.upload_dir / route_id
+
+
+def route_processed_dir(route_id: str) -> Path:
+    """Директория с обработанными изображениями маршрута"""
+    return settings.processed_dir / route_id
+
+
+def original_path(route_id: str, file_id: str, file_ext: str) -> Path:
+    """Путь к оригиналу файла (расширение хранится в БД, поэтому glob не нужен)"""
+    return route_upload_dir(route_id) / f"{file_id}{file_ext}"
+
+
+def processed_path(route_id: str, file_id: str, processed_format: str | None = None) -> Path:
+    """Путь к обработанному изображению (по умолчанию — JPEG)"""
+    suffix, _ = PROCESSED_FORMATS[processed_format or "jpeg"]
+    return route_processed_dir(route_id) / f"{file_id}_processed{suffix}"
+
+
+def processed_media_type(processed_format: str | None) -> str:
+    return PROCESSED_FORMATS[processed_format or "jpeg"][1]
+
+
+def remove_file_data(route_id: str, file_id: str, file_ext: str) -> None:
+    """Удаляет оригинал и обработанную версию файла с диска"""
+    original_path(route_id, file_id, file_ext).unlink(missing_ok=True)
+    for processed_format in PROCESSED_FORMATS:
+        processed_path(route_id, file_id, processed_format).unlink(missing_ok=True)
+
+
+def remove_files_data(route_id: str, files: list[tuple[str, str]]) -> dict[str, str]:
+    """
+    Пакетно удаляет оригиналы и обработанные версии файлов
+
+    Args:
+        route_id: ID маршрута
+        files: пары (file_id, file_ext)
+
+    Returns:
+        dict: file_id -> текст ошибки для файлов, которые не удалось удалить
+    """
+    errors: dict[str, str] = {}
+    for file_id, file_ext in files:
+        try:
+            remove_file_data(route_id, file_id, file_ext)
+        except OSError as e:
+            errors[file_id] = str(e)
+    return errors
+
+
+def hash_file(path: Path) -> str:
+    """SHA-256 содержимого файла (ключ объекта в хранилище)"""
+    return checksum_file(path)[0]
+
+
+def checksum_file(path: Path) -> tuple[str, int, int]:
+    """SHA-256, CRC-32 и размер файла за одно чтение"""
+    digest = hashlib.sha256()
+    crc = 0
+    size = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(_HASH_CHUNK_SIZE):
+            digest.update(chunk)
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+    return digest.hexdigest(), crc, size
+
+
+def set_processed_checksums(route_file: "RouteFile", path: Optional[Path]) -> None:
+    """Хеш, CRC-32 и размер обработанного изображения; path=None — обработанной версии нет"""
+    if path is None:
+        route_file.processed_hash = route_file.processed_crc32 = route_file.processed_size = None
+        return
+    route_file.processed_hash, route_file.processed_crc32, route_file.processed_size = checksum_file(path)
+
+
+class StorageBackend(ABC):
+    """
+    Хранилище содержимого файлов по хешу (content-addressed)
+
+    Одинаковые файлы разных маршрутов хранятся один раз; сколько файлов ссылается на объект,
+    учитывает таблица blobs (app.crud.blob). Путь к объекту вычисляется по хешу из БД,
+    без обхода директорий.
+    """
+
+    @abstractmethod
+    def blob_path(self, digest: str) -> Path:
+        """Путь к объекту по его хешу"""
+
+    @abstractmethod
+    def put(self, digest: str, source: Path, keep_source: bool = False) -> None:
+        """Помещает подготовленный файл в хранилище; если объект уже есть, источник не нужен"""
+
+    @abstractmethod
+    def delete(self, digest: str, grace_seconds: float = 0) -> bool:
+        """Удаляет объект, если он не обновлялся последние grace_seconds; True — удален"""
+
+    @abstractmethod
+    def iter_blobs(self) -> Iterator[tuple[str, float]]:
+        """Все объекты хранилища: (хеш, время последнего изменения) — для сборки мусора"""
+
+
+class LocalStorage(StorageBackend):
+    """
+    Хранилище на локальном диске: <root>/ab/cd/<sha256>
+
+    Два уровня по 256 поддиректорий держат директории небольшими при любом числе файлов.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def blob_path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest[2:4] / digest
+
+    def put(self, digest: str, source: Path, keep_source: bool = False) -> None:
+        target = self.blob_path(digest)
+        if target.exists():
+            # Свежая отметка времени защищает объект от сборки мусора, пока ссылка не зафиксирована
+            os.utime(target)
+            if not keep_source:
+                source.unlink(missing_ok=True)
+            return
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if keep_source:
+            # Жесткая ссылка не копирует данные; на другой файловой системе — копия
+            tmp_path = target.with_name(f"{digest}.{uuid.uuid4().hex}.tmp")
+            try:
+                os.link(source, tmp_path)
+            except OSError:
+                shutil.copyfile(source, tmp_path)
+            os.replace(tmp_path, target)
+        else:
+            os.replace(source, target)
+
+    def delete(self, digest: str, grace_seconds: float = 0) -> bool:
+        path = self.blob_path(digest)
+        try:
+            if grace_seconds and time.time() - path.stat().st_mtime < grace_seconds:
+                return False
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        return True
+
+    def iter_blobs(self) -> Iterator[tuple[str, float]]:
+        for path in self.root.glob("??/??/*"):
+            if path.is_file() and not path.name.endswith(".tmp"):
+                yield path.name, path.stat().st_mtime
+
+
+_storage: Optional[StorageBackend] = None
+
+
+def get_storage() -> StorageBackend:
+    global _storage
+    if _storage is None:
+        _storage = LocalStorage(settings.storage_dir)
+    return _storage
+
+
+def file_original_path(route_file: "RouteFile") -> Path:
+    """Путь к оригиналу по метаданным из БД: объект хранилища или файл в директории маршрута"""
+    if route_file.original_hash:
+        return get_storage().blob_path(route_file.original_hash)
+    return original_path(route_file.route_id, route_file.id, route_file.file_ext)
+
+
+def file_processed_path(route_file: "RouteFile") -> Path:
+    """Путь к обработанному изображению по метаданным из БД"""
+    if route_file.processed_hash:
+        return get_storage().blob_path(route_file.processed_hash)
+    return processed_path(route_file.route_id, route_file.id, route_file.processed_format)
+
+
+def staged_blobs(route_file: "RouteFile") -> list[tuple[str, Path]]:
+    """
+    Файлы записи, которые нужно перенести в хранилище: пары (хеш, путь в директории маршрута)
+
+    Для записей с хешами оригинал и обработанная версия лежат в директории маршрута,
+    пока запись не сохранена (app.crud.route_file.replace_route_files).
+    """
+    blobs = []
+    if route_file.original_hash:
+        blobs.append((route_file.original_hash, original_path(route_file.route_id, route_file.id, route_file.file_ext)))
+    if route_file.processed_hash:
+        blobs.append((
+            route_file.processed_hash,
+            processed_path(route_file.route_id, route_file.id, route_file.processed_format),
+        ))
+    return blobs
+
+
+def hash_staged_files(route_file: "RouteFile") -> None:
+    """Вычисляет хеши оригинала и обработанной версии, пока они лежат в директории маршрута"""
+    source = original_path(route_file.route_id, route_file.id, route_file.file_ext)
+    route_file.original_hash = hash_file(source) if source.exists() else None
+    processed = processed_path(route_file.route_id, route_file.id, route_file.processed_format)
+    set_processed_checksums(route_file, processed if route_file.is_processed and processed.exists() else None)
@@ -0,0 +1,235 @@
+"""
+Перенос файлов маршрутов в хранилище по хешу, проверка и сборка мусора
+
+Запуск из директории backend:
+    python -m app.services.storage_migrate                  # перенести файлы из директорий маршрутов
+    python -m app.services.storage_migrate --verify [--fix] # сверить ссылки и наличие объектов
+    python -m app.services.storage_migrate --gc             # удалить объекты без ссылок и старые миниатюры
+
+Перенос можно выполнять на работающем сервере: файл копируется в хранилище, запись получает
+хеш, и только после фиксации транзакции удаляется копия в директории маршрута. Повторный запуск
+продолжает с места остановки. Во время переноса не стоит запускать повторную обработку —
+если это случилось, --verify --fix выправит счетчики ссылок.
+"""
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+from sqlalchemy import func, literal_column, select, union_all, update
+
+from app.core.config import settings
+from app.services.crops import get_crop_cache
+from app.services.storage import checksum_file, get_storage, hash_file, original_path, processed_path
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Перенос файлов маршрутов в хранилище по хешу")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--verify", action="store_true", help="Сверить счетчики ссылок и наличие объектов")
+    mode.add_argument("--gc", action="store_true", help="Удалить объекты хранилища без ссылок")
+    parser.add_argument("--fix", action="store_true", help="С --verify: исправить найденные расхождения")
+    parser.add_argument("--batch-size", type=int, default=200, help="Сколько записей переносить за транзакцию")
+    parser.add_argument("--dry-run", action="store_true", help="Только посчитать, ничего не менять")
+    return parser.parse_args(argv)
+
+
+def _hash_legacy_files(rows: list) -> list[tuple[str, str | None, Path, tuple[str, int, int] | None, Path]]:
+    """Хеши файлов, которые еще лежат в директориях маршрутов; None — переносить нечего"""
+    hashed = []
+    for row in rows:
+        source = original_path(row.route_id, row.id, row.file_ext)
+        processed = processed_path(row.route_id, row.id, row.processed_format)
+        original_hash = hash_file(source) if row.original_hash is None and source.exists() else None
+        processed_checksums = (
+            checksum_file(processed)
+            if row.is_processed and row.processed_hash is None and processed.exists()
+            else None
+        )
+        hashed.append((row.id, original_hash, source, processed_checksums, processed))
+    return hashed
+
+
+async def migrate(batch_size: int, dry_run: bool) -> int:
+    from app.crud.blob import add_blob_refs
+    from app.db.session import AsyncSessionLocal
+    from app.models.route_file import RouteFile
+
+    pending = (RouteFile.original_hash.is_(None)) | (
+        RouteFile.is_processed.is_(True) & RouteFile.processed_hash.is_(None)
+    )
+    moved_files = moved_bytes = missing = 0
+    started = time.perf_counter()
+    last_id = ""
+    async with AsyncSessionLocal() as session:
+        while True:
+            rows = (await session.execute(
+                select(
+                    RouteFile.id,
+                    RouteFile.route_id,
+                    RouteFile.file_ext,
+                    RouteFile.is_processed,
+                    RouteFile.processed_format,
+                    RouteFile.original_hash,
+                    RouteFile.processed_hash,
+                )
+                .where(pending, RouteFile.id > last_id)
+                .order_by(RouteFile.id)
+                .limit(batch_size)
+            )).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            blobs: list[tuple[str, Path]] = []
+            for file_id, original_hash, source, processed_checksums, processed in await asyncio.to_thread(
+                _hash_legacy_files, rows
+            ):
+                found = []
+                if original_hash is not None:
+                    found.append((RouteFile.original_hash, original_hash, source, {}))
+                if processed_checksums is not None:
+                    digest, crc32, size = processed_checksums
+                    found.append((
+                        RouteFile.processed_hash,
+                        digest,
+                        processed,
+                        {"processed_crc32": crc32, "processed_size": size},
+                    ))
+                if not found:
+                    missing += 1
+                for column, digest, path, extra in found:
+                    if not dry_run:
+                        # Условие IS NULL: запись могли удалить или обновить, пока считался хеш
+                        result = await session.execute(
+                            update(RouteFile)
+                            .where(RouteFile.id == file_id, column.is_(None))
+                            .values({column.key: digest, **extra})
+                            .returning(RouteFile.id)
+                        )
+                        if result.first() is None:
+                            continue
+                    blobs.append((digest, path))
+
+            moved_files += len(blobs)
+            moved_bytes += sum(path.stat().st_size for _, path in blobs)
+            if not dry_run:
+                await add_blob_refs(session, blobs, keep_source=True)
+                await session.commit()
+                for _, path in blobs:
+                    path.unlink(missing_ok=True)
+            print(f"⏳ Перенесено файлов: {moved_files} ({moved_bytes / 1024 / 1024:.1f} МБ)")
+
+    prefix = "🔎 Будет перенесено" if dry_run else "✅ Перенесено"
+    print(f"{prefix} файлов: {moved_files}, {moved_bytes / 1024 / 1024:.1f} МБ "
+          f"за {time.perf_counter() - started:.1f} с; записей без файлов на диске: {missing}")
+    return 0
+
+
+async def verify(fix: bool) -> int:
+    """Сверяет таблицу blobs со ссылками из route_files и наличие объектов на диске"""
+    from app.crud.blob import delete_blob_files, release_blob_refs
+    from app.db.session import AsyncSessionLocal
+    from app.models.blob import Blob
+    from app.models.route_file import RouteFile
+
+    storage = get_storage()
+    digest = literal_column("digest")
+    references = union_all(
+        select(RouteFile.original_hash.label("digest")).where(RouteFile.original_hash.is_not(None)),
+        select(RouteFile.processed_hash.label("digest")).where(RouteFile.processed_hash.is_not(None)),
+    ).subquery()
+    async with AsyncSessionLocal() as session:
+        expected = dict((await session.execute(
+            select(digest, func.count()).select_from(references).group_by(digest)
+        )).all())
+        recorded = dict((await session.execute(select(Blob.digest, Blob.ref_count))).all())
+
+        wrong = {key: count for key, count in expected.items() if key in recorded and recorded[key] != count}
+        unrecorded = [key for key in expected if key not in recorded]
+        unreferenced = [key for key in recorded if key not in expected]
+        missing = [key for key in expected if not storage.blob_path(key).exists()]
+
+        print(f"📦 Объектов со ссылками: {len(expected)}, в таблице blobs: {len(recorded)}")
+        print(f"   Неверный счетчик ссылок: {len(wrong)}, нет записи в blobs: {len(unrecorded)}, "
+              f"запись без ссылок: {len(unreferenced)}")
+        print(f"   Нет файла в хранилище: {len(missing)}")
+        for key in missing[:20]:
+            print(f"   ⚠️ {key}")
+
+        if fix and (wrong or unrecorded or unreferenced):
+            for key, count in wrong.items():
+                await session.execute(update(Blob).where(Blob.digest == key).values(ref_count=count))
+            for key in unrecorded:
+                path = storage.blob_path(key)
+                size = path.stat().st_size if path.exists() else 0
+                session.add(Blob(digest=key, size=size, ref_count=expected[key]))
+            # Снимаем все учтенные ссылки — запись и объект удаляются
+            freed = await release_blob_refs(session, [key for key in unreferenced for _ in range(max(1, recorded[key]))])
+            await session.commit()
+            await delete_blob_files(session, freed)
+            print("🛠 Расхождения исправлены")
+    return 1 if missing or (not fix and (wrong or unrecorded or unreferenced)) else 0
+
+
+async def collect_garbage(dry_run: bool) -> int:
+    """
+    Удаляет объекты хранилища, которых нет в таблице blobs (прерванные загрузки и переносы),
+    и миниатюры отчетов для изображений, которых больше нет
+    """
+    from app.db.session import AsyncSessionLocal
+    from app.models.blob import Blob
+    from app.models.route_file import RouteFile
+
+    storage = get_storage()
+    grace = settings.storage_gc_grace_seconds
+    async with AsyncSessionLocal() as session:
+        known = set((await session.scalars(select(Blob.digest))).all())
+        legacy_ids = set((await session.scalars(
+            select(RouteFile.id).where(RouteFile.processed_hash.is_(None))
+        )).all())
+
+    removed = 0
+    now = time.time()
+    for key, mtime in storage.iter_blobs():
+        if key in known or now - mtime < grace:
+            continue
+        if dry_run or storage.delete(key, grace_seconds=grace):
+            removed += 1
+
+    crops = get_crop_cache()
+    removed_crops = 0
+    for key, mtime in crops.iter_keys():
+        # Ключ миниатюр — хеш обработанного изображения или ID файла, еще не перенесенного в хранилище
+        if key in known or key in legacy_ids or now - mtime < grace:
+            continue
+        if not dry_run:
+            crops.purge(key)
+        removed_crops += 1
+    prefix = "🔎 Будет удалено" if dry_run else "🧹 Удалено"
+    print(f"{prefix} объектов без ссылок: {removed}, изображений с устаревшими миниатюрами: {removed_crops}")
+    return 0
+
+
+async def _run(args: argparse.Namespace) -> int:
+    from app.db.session import engine
+    from app.main import init_database
+
+    await init_database()
+    try:
+        if args.verify:
+            return await verify(args.fix and not args.dry_run)
+        if args.gc:
+            return await collect_garbage(args.dry_run)
+        return await migrate(max(1, args.batch_size), args.dry_run)
+    finally:
+        await engine.dispose()
+
+
+def main(argv: list[str] | None = None) -> int:
+    return asyncio.run(_run(parse_args(argv)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
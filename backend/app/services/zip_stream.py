@@ -0,0 +1,202 @@
+"""
+ZIP-архив, который формируется на лету
+
+Записи хранятся без сжатия (JPEG уже сжат), а их размеры и CRC-32 известны заранее, поэтому
+раскладка архива вычисляется до отправки первого байта: известен размер ответа, и можно отдать
+любой диапазон байт (Range) без чтения предыдущих файлов. Содержимое файлов читается
+с диска кусками по мере отправки — память не зависит от размера архива.
+Для архивов больше 4 ГБ и с числом файлов больше 65535 используется ZIP64.
+"""
+import asyncio
+import bisect
+import struct
+import zlib
+from collections.abc import AsyncIterator
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Union
+
+# Значения, начиная с которых поле не помещается в обычный заголовок и уходит в ZIP64
+_ZIP64_LIMIT = 0xFFFFFFFF
+_ZIP64_COUNT_LIMIT = 0xFFFF
+_READ_CHUNK_SIZE = 1024 * 1024
+# Имена в UTF-8
+_FLAG_UTF8 = 0x0800
+
+
+class ZipEntry:
+    """Файл архива: содержимое берется из файла на диске (path) или из памяти (data)"""
+
+    def __init__(
+        self,
+        name: str,
+        size: int,
+        crc32: int,
+        modified: datetime,
+        path: Optional[Path] = None,
+        data: Optional[bytes] = None,
+    ):
+        self.name = name
+        self.size = size
+        self.crc32 = crc32
+        self.modified = modified
+        self.path = path
+        self.data = data
+
+    @classmethod
+    def from_bytes(cls, name: str, data: bytes, modified: datetime) -> "ZipEntry":
+        return cls(name, len(data), zlib.crc32(data), modified, data=data)
+
+
+def _dos_datetime(value: datetime) -> tuple[int, int]:
+    if value.year < 1980:
+        return 0, (1 << 5) | 1
+    time = (value.hour << 11) | (value.minute << 5) | (value.second // 2)
+    date = ((value.year - 1980) << 9) | (value.month << 5) | value.day
+    return time, date
+
+
+def _local_header(entry: ZipEntry, name: bytes) -> bytes:
+    time, date = _dos_datetime(entry.modified)
+    zip64 = entry.size >= _ZIP64_LIMIT
+    extra = struct.pack("<HHQQ", 0x0001, 16, entry.size, entry.size) if zip64 else b""
+    size = 0xFFFFFFFF if zip64 else entry.size
+    return struct.pack(
+        "<IHHHHHIIIHH",
+        0x04034B50,
+        45 if zip64 else 20,
+        _FLAG_UTF8,
+        0,  # без сжатия
+        time,
+        date,
+        entry.crc32,
+        size,
+        size,
+        len(name),
+        len(extra),
+    ) + name + extra
+
+
+def _central_header(entry: ZipEntry, name: bytes, offset: int) -> bytes:
+    time, date = _dos_datetime(entry.modified)
+    zip64_fields = []
+    size = entry.size
+    if entry.size >= _ZIP64_LIMIT:
+        size = 0xFFFFFFFF
+        zip64_fields += [entry.size, entry.size]
+    header_offset = offset
+    if offset >= _ZIP64_LIMIT:
+        header_offset = 0xFFFFFFFF
+        zip64_fields.append(offset)
+    extra = b""
+    if zip64_fields:
+        extra = struct.pack(f"<HH{len(zip64_fields)}Q", 0x0001, 8 * len(zip64_fields), *zip64_fields)
+    version = 45 if zip64_fields else 20
+    return struct.pack(
+        "<IHHHHHHIIIHHHHHII",
+        0x02014B50,
+        version,
+        version,
+        _FLAG_UTF8,
+        0,
+        time,
+        date,
+        entry.crc32,
+        size,
+        size,
+        len(name),
+        len(extra),
+        0,  # комментарий
+        0,  # номер диска
+        0,  # внутренние атрибуты
+        0,  # внешние атрибуты
+        header_offset,
+    ) + name + extra
+
+
+def _end_of_central_directory(count: int, cd_offset: int, cd_size: int) -> bytes:
+    zip64 = count >= _ZIP64_COUNT_LIMIT or cd_offset >= _ZIP64_LIMIT or cd_size >= _ZIP64_LIMIT
+    record = b""
+    if zip64:
+        zip64_offset = cd_offset + cd_size
+        record = struct.pack(
+            "<IQHHIIQQQQ", 0x06064B50, 44, 45, 45, 0, 0, count, count, cd_size, cd_offset
+        ) + struct.pack("<IIQI", 0x07064B50, 0, zip64_offset, 1)
+    return record + struct.pack(
+        "<IHHHHIIH",
+        0x06054B50,
+        0,
+        0,
+        0xFFFF if zip64 else count,
+        0xFFFF if zip64 else count,
+        0xFFFFFFFF if zip64 else cd_size,
+        0xFFFFFFFF if zip64 else cd_offset,
+        0,
+    )
+
+
+class ZipStream:
+    """Раскладка архива: последовательность кусков из памяти и из файлов с известными смещениями"""
+
+    def __init__(self, entries: list[ZipEntry]):
+        self._offsets: list[int] = []
+        self._segments: list[Union[bytes, ZipEntry]] = []
+        self._size = 0
+
+        central: list[bytes] = []
+        for entry in entries:
+            name = entry.name.encode("utf-8")
+            central.append(_central_header(entry, name, self._size))
+            self._add(_local_header(entry, name))
+            self._add(entry.data if entry.data is not None else entry)
+        cd_offset = self._size
+        for header in central:
+            self._add(header)
+        self._add(_end_of_central_directory(len(entries), cd_offset, self._size - cd_offset))
+
+    def _add(self, segment: Union[bytes, ZipEntry]) -> None:
+        length = len(segment) if isinstance(segment, bytes) else segment.size
+        if length:
+            self._offsets.append(self._size)
+            self._segments.append(segment)
+            self._size += length
+
+    @property
+    def size(self) -> int:
+        """Размер архива в байтах"""
+        return self._size
+
+    async def iter_range(self, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """Байты архива с start по end включительно"""
+        end = self._size - 1 if end is None else min(end, self._size - 1)
+        index = max(0, bisect.bisect_right(self._offsets, start) - 1)
+        position = start
+        while position <= end and index < len(self._segments):
+            segment = self._segments[index]
+            segment_start = self._offsets[index]
+            skip = position - segment_start
+            if isinstance(segment, bytes):
+                length = min(len(segment) - skip, end - position + 1)
+                yield segment[skip:skip + length]
+            else:
+                length = min(segment.size - skip, end - position + 1)
+                async for chunk in _read_file(segment.path, skip, length):
+                    yield chunk
+            position += length
+            index += 1
+
+
+async def _read_file(path: Path, offset: int, length: int) -> AsyncIterator[bytes]:
+    f = await asyncio.to_thread(open, path, "rb")
+    try:
+        await asyncio.to_thread(f.seek, offset)
+        remaining = length
+        while remaining > 0:
+            chunk = await asyncio.to_thread(f.read, min(_READ_CHUNK_SIZE, remaining))
+            if not chunk:
+                # Файл укоротился после расчета раскладки — архив получился бы битым
+                raise OSError(f"Файл изменился во время экспорта: {path}")
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        await asyncio.to_thread(f.close)
@@ -0,0 +1,95 @@
+"""
+Допуск загрузок к обработке (app.services.admission): учет лимитов и их освобождение
+
+Запуск из директории backend:
+    python -m pytest tests
+"""
+import pytest
+
+from app.services.admission import AdmissionController, AdmissionRejected
+
+_MB = 1024 * 1024
+
+
+def _controller(max_images: int = 10, max_bytes: int = 100 * _MB, user_share: float = 0.5) -> AdmissionController:
+    return AdmissionController(max_images=max_images, max_bytes=max_bytes, user_share=user_share, retry_after=7)
+
+
+def _assert_idle(controller: AdmissionController) -> None:
+    stats = controller.stats()
+    assert stats["inflight_images"] == 0
+    assert stats["queued_bytes"] == 0
+    assert stats["active_users"] == 0
+
+
+def test_release_returns_limit_as_files_finish():
+    controller = _controller()
+    ticket = controller.admit("alice", 4, 8 * _MB)
+    assert controller.stats()["inflight_images"] == 4
+
+    ticket.release(1, 2 * _MB)
+    ticket.release(1, 2 * _MB)
+    stats = controller.stats()
+    assert stats["inflight_images"] == 2
+    assert stats["queued_bytes"] == 4 * _MB
+
+    ticket.close()
+    _assert_idle(controller)
+
+
+def test_ticket_is_released_when_upload_fails():
+    controller = _controller()
+    with pytest.raises(RuntimeError):
+        with controller.admit("alice", 3, 3 * _MB) as ticket:
+            ticket.release(1, _MB)
+            raise RuntimeError("upload aborted")
+    _assert_idle(controller)
+
+    # Повторное закрытие (например, из фоновой задачи ответа) ничего не меняет
+    ticket.close()
+    _assert_idle(controller)
+    assert controller.admit("alice", 5, _MB).held_images == 5
+
+
+def test_user_share_and_overload():
+    controller = _controller(max_images=10, user_share=0.5)
+    first = controller.admit("alice", 5, _MB)
+
+    with pytest.raises(AdmissionRejected) as error:
+        controller.admit("alice", 1, _MB)
+    assert error.value.status_code == 429
+    assert error.value.retry_after == 7
+
+    second = controller.admit("bob", 5, _MB)
+    with pytest.raises(AdmissionRejected) as error:
+        controller.check("carol", _MB)
+    assert error.value.status_code == 503
+
+    first.close()
+    second.close()
+    _assert_idle(controller)
+    assert controller.stats()["rejected_user"] == 1
+    assert controller.stats()["rejected_overload"] == 1
+
+
+def test_upload_larger_than_share_holds_only_the_share():
+    controller = _controller(max_images=10, user_share=0.5)
+    ticket = controller.admit("alice", 12, _MB)
+    # Загрузка крупнее доли занимает долю целиком, пока остаток не станет меньше
+    assert ticket.held_images == 5
+    for _ in range(8):
+        ticket.release(1, 0)
+    assert ticket.held_images == 4
+    assert controller.stats()["inflight_images"] == 4
+
+    ticket.close()
+    _assert_idle(controller)
+
+
+def test_zero_limits_admit_everything():
+    controller = _controller(max_images=0, max_bytes=0)
+    tickets = [controller.admit(f"user-{i}", 1000, 1000 * _MB) for i in range(5)]
+    assert controller.stats()["max_images"] is None
+    for ticket in tickets:
+        ticket.close()
+    _assert_idle(controller)
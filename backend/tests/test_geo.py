@@ -0,0 +1,91 @@
+"""
+Сеточный пространственный индекс и прямоугольники поиска (app.services.geo)
+
+Запуск из директории backend:
+    python -m pytest tests
+"""
+import math
+import random
+
+import pytest
+
+from app.services.geo import (
+    EARTH_RADIUS_M,
+    MAX_CELL_ROWS,
+    bbox_for_radius,
+    cell_ranges,
+    geo_cell,
+    haversine_m,
+    split_bbox,
+)
+
+
+def _covered(boxes, latitude: float, longitude: float) -> bool:
+    return any(
+        min_lat <= latitude <= max_lat and min_lon <= longitude <= max_lon
+        for min_lat, min_lon, max_lat, max_lon in boxes
+    )
+
+
+def _in_cells(boxes, latitude: float, longitude: float) -> bool:
+    cell = geo_cell(latitude, longitude)
+    return any(first <= cell <= last for box in boxes for first, last in cell_ranges(*box))
+
+
+def _destination(latitude: float, longitude: float, distance_m: float, bearing: float) -> tuple[float, float]:
+    """Точка на расстоянии distance_m по азимуту bearing (радианы)"""
+    delta = distance_m / EARTH_RADIUS_M
+    phi1, lambda1 = math.radians(latitude), math.radians(longitude)
+    phi2 = math.asin(math.sin(phi1) * math.cos(delta) + math.cos(phi1) * math.sin(delta) * math.cos(bearing))
+    lambda2 = lambda1 + math.atan2(
+        math.sin(bearing) * math.sin(delta) * math.cos(phi1),
+        math.cos(delta) - math.sin(phi1) * math.sin(phi2),
+    )
+    return math.degrees(phi2), (math.degrees(lambda2) + 540.0) % 360.0 - 180.0
+
+
+def test_split_bbox_across_antimeridian():
+    assert split_bbox(10.0, 20.0, 11.0, 21.0) == [(10.0, 20.0, 11.0, 21.0)]
+    boxes = split_bbox(-17.0, 179.5, -16.0, -179.5)
+    assert boxes == [(-17.0, 179.5, -16.0, 180.0), (-17.0, -180.0, -16.0, -179.5)]
+    assert _covered(boxes, -16.5, 179.9) and _covered(boxes, -16.5, -179.9)
+    assert not _covered(boxes, -16.5, 0.0)
+    assert _in_cells(boxes, -16.5, 179.999) and _in_cells(boxes, -16.5, -179.999)
+
+
+@pytest.mark.parametrize(
+    ("latitude", "longitude", "radius_m"),
+    [
+        (55.75, 37.62, 2_000),
+        (-16.5, 179.99, 5_000),
+        (64.0, -179.98, 20_000),
+        (70.0, 100.0, 300_000),
+        (89.99, 0.0, 5_000),
+    ],
+)
+def test_radius_boxes_cover_the_circle(latitude, longitude, radius_m):
+    boxes = bbox_for_radius(latitude, longitude, radius_m)
+    assert all(min_lon <= max_lon and -180.0 <= min_lon and max_lon <= 180.0 for _, min_lon, _, max_lon in boxes)
+    rng = random.Random(0)
+    for _ in range(500):
+        point = _destination(latitude, longitude, radius_m * rng.random() ** 0.5, rng.uniform(0, 2 * math.pi))
+        assert haversine_m(latitude, longitude, *point) <= radius_m * 1.000001
+        assert _covered(boxes, *point)
+        if all(cell_ranges(*box) is not None for box in boxes):
+            assert _in_cells(boxes, *point)
+
+
+def test_radius_box_crossing_antimeridian_is_split():
+    boxes = bbox_for_radius(0.0, 179.999, 1_000)
+    assert len(boxes) == 2
+    assert boxes[0][3] == 180.0 and boxes[1][1] == -180.0
+
+
+def test_polar_circle_covers_all_longitudes():
+    boxes = bbox_for_radius(89.995, 10.0, 2_000)
+    assert boxes == [(boxes[0][0], -180.0, 90.0, 180.0)]
+
+
+def test_cell_ranges_give_up_on_large_boxes():
+    assert cell_ranges(0.0, 0.0, 0.01 * (MAX_CELL_ROWS - 1), 1.0) is not None
+    assert cell_ranges(0.0, 0.0, 0.01 * (MAX_CELL_ROWS + 1), 1.0) is None
@@ -0,0 +1,83 @@
+"""
+Вариант модели с предобработкой uint8 внутри графа (app.services.model_fuse)
+
+Запуск из директории backend:
+    python -m pytest tests
+"""
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+onnx = pytest.importorskip("onnx")
+
+from onnx import TensorProto, helper, numpy_helper  # noqa: E402
+
+from app.services.image_processor import ImageProcessor  # noqa: E402
+from app.services.model_fuse import _synthetic_frames, build_uint8_variant, check_parity, main  # noqa: E402
+
+_SIZE = 64
+_FEATURES = 12
+
+
+def _tiny_model(path: Path) -> None:
+    """Свертка 1x1 с разными весами каналов: выход зависит от порядка каналов и масштаба входа"""
+    rng = np.random.default_rng(0)
+    weight = rng.standard_normal((_FEATURES, 3, 1, 1)).astype(np.float32)
+    graph = helper.make_graph(
+        [
+            helper.make_node("Conv", ["images", "weight"], ["features"]),
+            helper.make_node("Reshape", ["features", "shape"], ["output0"]),
+        ],
+        "tiny",
+        [helper.make_tensor_value_info("images", TensorProto.FLOAT, [1, 3, _SIZE, _SIZE])],
+        [helper.make_tensor_value_info("output0", TensorProto.FLOAT, [1, _FEATURES, _SIZE * _SIZE])],
+        [
+            numpy_helper.from_array(weight, "weight"),
+            numpy_helper.from_array(np.array([1, _FEATURES, _SIZE * _SIZE], dtype=np.int64), "shape"),
+        ],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 18)])
+    model.ir_version = 9
+    onnx.save(model, str(path))
+
+
+@pytest.fixture
+def models(tmp_path: Path) -> tuple[Path, Path]:
+    source = tmp_path / "tiny.onnx"
+    _tiny_model(source)
+    variant = tmp_path / "tiny.uint8.onnx"
+    onnx.save(build_uint8_variant(onnx.load(str(source))), str(variant))
+    return source, variant
+
+
+def test_uint8_variant_matches_float_path(models):
+    source, variant = models
+    original = ImageProcessor(source)
+    fused = ImageProcessor(variant)
+    assert not original.uint8_input
+    assert fused.uint8_input
+
+    for _, image_bytes in _synthetic_frames(5, seed=1):
+        image, _ = original.decode_for_model(image_bytes)
+        expected_input, _, _, _ = original.preprocess_image(image)
+        actual_input, _, _, _ = fused.preprocess_image(image)
+        assert actual_input.dtype == np.uint8
+        expected = original._run_session(expected_input)[0]
+        actual = fused._run_session(actual_input)[0]
+        np.testing.assert_allclose(actual, expected, rtol=0, atol=1e-5)
+
+    assert check_parity(original, fused, _synthetic_frames(3, seed=2))
+
+
+def test_variant_is_not_fused_twice(models):
+    _, variant = models
+    with pytest.raises(ValueError):
+        build_uint8_variant(onnx.load(str(variant)))
+
+
+def test_activate_requires_check(models):
+    source, _ = models
+    with pytest.raises(SystemExit) as error:
+        main([str(source), "--no-check", "--activate"])
+    assert error.value.code == 2
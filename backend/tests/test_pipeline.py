@@ -0,0 +1,139 @@
+"""
+Конвейер обработки загрузок (app.services.pipeline): порядок результатов, окно и отмена
+
+Запуск из директории backend:
+    python -m pytest tests
+"""
+import asyncio
+import random
+import threading
+import time
+
+from app.services.pipeline import ImagePipeline, PipelineJob
+
+
+class _FakeProcessor:
+    """Стадии с разной задержкой: задания обгоняют друг друга внутри конвейера"""
+
+    cascade = False
+
+    def __init__(self, fail_on: bytes | None = None):
+        self.fail_on = fail_on
+        self.random = random.Random(0)
+        self.lock = threading.Lock()
+
+    def _sleep(self) -> None:
+        with self.lock:
+            delay = self.random.random() * 0.005
+        time.sleep(delay)
+
+    def prepare(self, image_bytes: bytes):
+        self._sleep()
+        if image_bytes == self.fail_on:
+            raise ValueError("broken frame")
+        return None, True, image_bytes, 1.0, (0, 0, 0, 0)
+
+    def infer(self, preprocessed, scale, padding):
+        self._sleep()
+        return []
+
+    def render(self, image_bytes, model_image, is_full, detections, output_path):
+        self._sleep()
+        return {"image": image_bytes}
+
+    def record_full_pass(self, seconds: float) -> None:
+        pass
+
+
+def _jobs(count: int) -> list[PipelineJob]:
+    # Каждое третье задание проходит конвейер без обработки
+    return [PipelineJob(i, None if i % 3 == 0 else f"frame-{i}".encode()) for i in range(count)]
+
+
+def test_results_keep_submission_order_within_window():
+    pipeline = ImagePipeline(_FakeProcessor(), window=3).start()
+    jobs = _jobs(40)
+
+    def produce() -> None:
+        for job in jobs:
+            pipeline.submit(job)
+        pipeline.close()
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    keys = []
+    for job in pipeline.results():
+        assert pipeline._submitted - pipeline._next_sequence <= 3
+        keys.append(job.key)
+    producer.join(5)
+
+    assert keys == list(range(40))
+    # Обработаны только изображения, и каждое — своим кадром
+    assert [job.key for job in jobs if job.result is not None] == [i for i in range(40) if i % 3]
+    assert all(job.result["image"] == f"frame-{job.key}".encode() for job in jobs if job.result is not None)
+
+
+def test_async_api_does_not_block_threads():
+    async def upload(pipeline: ImagePipeline, jobs: list[PipelineJob]) -> list[int]:
+        async def produce() -> None:
+            for job in jobs:
+                await pipeline.submit_async(job)
+            pipeline.close()
+
+        producer = asyncio.create_task(produce())
+        keys = []
+        while (job := await pipeline.next_result_async()) is not None:
+            keys.append(job.key)
+        await producer
+        return keys
+
+    async def main() -> list[list[int]]:
+        pipelines = [ImagePipeline(_FakeProcessor(), window=2).start() for _ in range(8)]
+        return await asyncio.gather(*(upload(pipeline, _jobs(15)) for pipeline in pipelines))
+
+    # Все загрузки ждут окно и результаты в одном потоке event loop: блокирующее ожидание
+    # в нем остановило бы и остальные загрузки
+    results = []
+    runner = threading.Thread(target=lambda: results.append(asyncio.run(main())), daemon=True)
+    runner.start()
+    runner.join(30)
+    assert not runner.is_alive()
+    assert results == [[list(range(15))] * 8]
+
+
+def test_stage_error_is_returned_in_order():
+    pipeline = ImagePipeline(_FakeProcessor(fail_on=b"frame-4"), window=8).start()
+    jobs = _jobs(8)
+    for job in jobs[:4]:
+        pipeline.submit(job)
+    results = [pipeline.next_result() for _ in range(2)]
+    for job in jobs[4:]:
+        pipeline.submit(job)
+    pipeline.close()
+    results += list(pipeline.results())
+
+    assert [job.key for job in results] == list(range(8))
+    assert isinstance(results[4].error, ValueError)
+    assert results[4].result is None
+    assert all(job.error is None for i, job in enumerate(results) if i != 4)
+
+
+def test_cancel_unblocks_producer():
+    pipeline = ImagePipeline(_FakeProcessor(), window=2).start()
+    submitted = []
+
+    def produce() -> None:
+        for job in _jobs(50):
+            pipeline.submit(job)
+            submitted.append(job.key)
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    time.sleep(0.1)
+    # Потребитель не читает результаты: подача стоит на заполненном окне
+    assert producer.is_alive()
+    assert len(submitted) <= 3
+
+    pipeline.cancel()
+    producer.join(5)
+    assert not producer.is_alive()
@@ -0,0 +1,116 @@
+"""
+Кэш ответов чтения (app.services.response_cache): версии данных, ETag и вытеснение
+
+Запуск из директории backend:
+    python -m pytest tests
+"""
+import asyncio
+from pathlib import Path
+
+from fastapi import Request, Response
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.crud.response_version import bump_response_versions, get_response_version, route_scope, user_scope
+from app.db.base import Base
+from app.services.response_cache import ResponseCache, _Entry, _etag_matches, cached_read
+
+
+def _request(path: str, query: str = "", if_none_match: str | None = None) -> Request:
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match else []
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": path,
+        "query_string": query.encode(),
+        "headers": headers,
+    })
+
+
+def test_cache_drops_stale_versions_and_evicts_lru():
+    cache = ResponseCache(max_bytes=10)
+    cache.put("a", _Entry(1, b"aaaa", {}))
+    cache.put("b", _Entry(1, b"bbbb", {}))
+    assert cache.get("a", 2) is None
+    assert cache.get("a", 1).body == b"aaaa"
+
+    # "a" прочитан последним, поэтому вытесняется "b"
+    cache.put("c", _Entry(1, b"cccc", {}))
+    assert cache.get("b", 1) is None
+    assert cache.get("a", 1) is not None
+    assert cache.size == 8
+
+    cache.put("a", _Entry(2, b"aa", {}))
+    assert cache.size == 6
+    cache.put("huge", _Entry(1, b"x" * 11, {}))
+    assert cache.get("huge", 1) is None
+    assert cache.stats()["entries"] == 2
+
+
+def test_weak_etag_comparison():
+    etag = 'W/"abc"'
+    assert _etag_matches('W/"abc"', etag)
+    assert _etag_matches('"abc"', etag)
+    assert _etag_matches('"other", W/"abc"', etag)
+    assert not _etag_matches('"abcd"', etag)
+    assert not _etag_matches("*", etag)
+    assert not _etag_matches(None, etag)
+
+
+async def _scenario(database: Path) -> dict:
+    engine = create_async_engine(f"sqlite+aiosqlite:///{database}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+    seen = {}
+    try:
+        async with sessions() as session:
+            scope = route_scope("r1")
+            seen["initial"] = await get_response_version(session, scope)
+
+            first = await cached_read(_request("/api/routes/r1/files", "b=2&a=1"), session, "u1", scope)
+            seen["first_cached"] = first.response is not None
+            first.store(Response(content=b"[1]", media_type="application/json"))
+
+            # Тот же запрос с параметрами в другом порядке берется из кэша
+            second = await cached_read(_request("/api/routes/r1/files", "a=1&b=2"), session, "u1", scope)
+            seen["second_body"] = second.response.body
+            seen["same_etag"] = second.etag == first.etag
+
+            revalidated = await cached_read(
+                _request("/api/routes/r1/files", "a=1&b=2", if_none_match=first.etag), session, "u1", scope
+            )
+            seen["revalidated_status"] = revalidated.response.status_code
+
+            other_user = await cached_read(_request("/api/routes/r1/files", "a=1&b=2"), session, "u2", scope)
+            seen["other_user_cached"] = other_user.response is not None
+
+            await bump_response_versions(session, "u1", ["r1"])
+            await session.commit()
+            seen["versions"] = (
+                await get_response_version(session, scope),
+                await get_response_version(session, user_scope("u1")),
+                await get_response_version(session, route_scope("r2")),
+            )
+
+            stale = await cached_read(
+                _request("/api/routes/r1/files", "a=1&b=2", if_none_match=first.etag), session, "u1", scope
+            )
+            seen["after_bump_cached"] = stale.response is not None
+            seen["after_bump_etag_changed"] = stale.etag != first.etag
+        return seen
+    finally:
+        await engine.dispose()
+
+
+def test_version_bump_invalidates_body_and_etag(tmp_path, monkeypatch):
+    monkeypatch.setattr("app.services.response_cache._response_cache", ResponseCache(1024 * 1024))
+    seen = asyncio.run(_scenario(tmp_path / "cache.db"))
+
+    assert seen["initial"] == 0
+    assert not seen["first_cached"]
+    assert seen["second_body"] == b"[1]" and seen["same_etag"]
+    assert seen["revalidated_status"] == 304
+    assert not seen["other_user_cached"]
+    assert seen["versions"] == (1, 1, 0)
+    assert not seen["after_bump_cached"]
+    assert seen["after_bump_etag_changed"]
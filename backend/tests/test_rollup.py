@@ -0,0 +1,97 @@
+"""
+Сводки по маршрутам (app.crud.rollup): изменения по ходу загрузок и удалений совпадают
+с полным пересчетом по таблицам файлов и детекций
+
+Запуск из директории backend:
+    python -m pytest tests
+"""
+import asyncio
+from datetime import datetime
+from pathlib import Path
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.core.utils import generate_uuid
+from app.crud.rollup import rebuild_rollups
+from app.crud.route_file import delete_route_file, replace_route_file
+from app.db.base import Base
+from app.models import ClassDayRollup, Route, RouteDayRollup, RouteFile, User
+
+
+def _file(route_id: str, name: str, detections: list[int], taken_at: datetime | None = None) -> tuple:
+    red = sum(1 for class_id in detections if class_id in (5, 6))
+    route_file = RouteFile(
+        id=generate_uuid(),
+        route_id=route_id,
+        original_name=name,
+        file_ext=".jpg",
+        is_processed=True,
+        processed_format="jpeg",
+        red_detection_count=red,
+        green_detection_count=len(detections) - red,
+        total_detections=len(detections),
+        taken_at=taken_at,
+    )
+    boxes = [
+        {"class_id": class_id, "conf": 0.9, "bbox": [0.0, 0.0, 10.0, 10.0]}
+        for class_id in detections
+    ]
+    return route_file, boxes
+
+
+async def _snapshot(session) -> tuple[set, set]:
+    days = (await session.execute(select(RouteDayRollup))).scalars().all()
+    classes = (await session.execute(select(ClassDayRollup))).scalars().all()
+    return (
+        {(r.route_id, r.day, r.image_count, r.processed_count, r.defect_image_count, r.detection_count) for r in days},
+        {(r.route_id, r.day, r.class_id, r.detection_count, r.image_count) for r in classes},
+    )
+
+
+async def _scenario(database: Path) -> tuple[tuple[set, set], tuple[set, set]]:
+    engine = create_async_engine(f"sqlite+aiosqlite:///{database}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+    try:
+        async with sessions() as session:
+            user = User(id=generate_uuid(), email="rollup@example.com", hashed_password="x")
+            routes = [Route(id=generate_uuid(), name=f"r{i}", user_id=user.id) for i in range(2)]
+            session.add_all([user, *routes])
+            await session.commit()
+
+            first, second = routes[0].id, routes[1].id
+            june, july = datetime(2024, 6, 1, 12), datetime(2024, 7, 2, 9)
+            uploads = [
+                _file(first, "a.jpg", [5, 5, 1], june),
+                _file(first, "b.jpg", [], june),
+                _file(first, "c.jpg", [2, 6], july),
+                _file(first, "d.jpg", [3]),
+                _file(second, "a.jpg", [6], june),
+            ]
+            for route_file, boxes in uploads:
+                await replace_route_file(session, route_file, user.id, boxes)
+
+            # Повторная загрузка того же имени заменяет файл и его вклад в сводки
+            route_file, boxes = _file(first, "a.jpg", [1], july)
+            await replace_route_file(session, route_file, user.id, boxes)
+            # Удаление единственного файла дня убирает и день
+            await delete_route_file(session, first, uploads[2][0].id, user.id)
+            await delete_route_file(session, second, uploads[4][0].id, user.id)
+
+            incremental = await _snapshot(session)
+            await rebuild_rollups(session)
+            rebuilt = await _snapshot(session)
+        return incremental, rebuilt
+    finally:
+        await engine.dispose()
+
+
+def test_incremental_rollups_match_rebuild(tmp_path):
+    incremental, rebuilt = asyncio.run(_scenario(tmp_path / "rollup.db"))
+    assert incremental == rebuilt
+    days, classes = incremental
+    # Остались a.jpg (июль), b.jpg (июнь) и d.jpg (день загрузки) первого маршрута
+    assert sum(row[2] for row in days) == 3
+    assert {row[2] for row in classes} == {1, 3}
@@ -0,0 +1,178 @@
+"""
+ZIP-архив на лету (app.services.zip_stream) и диапазоны экспорта маршрута
+
+Архив читается стандартным zipfile: целиком и через произвольные диапазоны байт,
+как при докачке с Range.
+
+Запуск из директории backend:
+    python -m pytest tests
+"""
+import asyncio
+import io
+import random
+import zipfile
+import zlib
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+
+from app.api.routes.routes import _parse_byte_range
+from app.services.zip_stream import ZipEntry, ZipStream
+
+_MODIFIED = datetime(2024, 5, 17, 10, 30, 12)
+
+
+def _read(archive: ZipStream, start: int = 0, end: int | None = None) -> bytes:
+    async def collect() -> bytes:
+        return b"".join([chunk async for chunk in archive.iter_range(start, end)])
+
+    return asyncio.run(collect())
+
+
+class _RangeReader(io.RawIOBase):
+    """Файл поверх ZipStream: каждое чтение — отдельный запрос диапазона"""
+
+    def __init__(self, archive: ZipStream):
+        self.archive = archive
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.archive.size}[whence]
+        self.position = base + offset
+        return self.position
+
+    def readinto(self, buffer) -> int:
+        if self.position >= self.archive.size or not len(buffer):
+            return 0
+        data = _read(self.archive, self.position, self.position + len(buffer) - 1)
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+def _entries(tmp_path: Path) -> tuple[list[ZipEntry], dict[str, bytes]]:
+    rng = random.Random(0)
+    contents = {
+        "DJI_0001.jpg": rng.randbytes(300_000),
+        "Опора 12/снимок.jpg": rng.randbytes(70_000),
+        "empty.jpg": b"",
+        "detections.csv": b"file,class_id\nDJI_0001.jpg,5\n",
+    }
+    entries = []
+    for name, data in contents.items():
+        if name.endswith(".jpg"):
+            path = tmp_path / f"{len(entries)}.bin"
+            path.write_bytes(data)
+            # Размер и CRC берутся из БД, как при экспорте, — файл читается только при отправке
+            entries.append(ZipEntry(name, len(data), zlib.crc32(data), _MODIFIED, path=path))
+        else:
+            entries.append(ZipEntry.from_bytes(name, data, _MODIFIED))
+    return entries, contents
+
+
+def test_archive_round_trip(tmp_path):
+    entries, contents = _entries(tmp_path)
+    archive = ZipStream(entries)
+    data = _read(archive)
+    assert len(data) == archive.size
+
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == list(contents)
+        for name, content in contents.items():
+            assert zf.read(name) == content
+            info = zf.getinfo(name)
+            assert info.compress_type == zipfile.ZIP_STORED
+            assert info.date_time == (2024, 5, 17, 10, 30, 12)
+
+
+def test_ranges_match_full_archive(tmp_path):
+    entries, _ = _entries(tmp_path)
+    archive = ZipStream(entries)
+    data = _read(archive)
+    rng = random.Random(1)
+    ranges = [(0, 0), (0, 29), (archive.size - 1, archive.size - 1), (100, archive.size + 100)]
+    ranges += [tuple(sorted(rng.randrange(archive.size) for _ in range(2))) for _ in range(50)]
+    for start, end in ranges:
+        assert _read(archive, start, end) == data[start:end + 1]
+
+
+def test_resumed_download_is_a_valid_archive(tmp_path):
+    entries, contents = _entries(tmp_path)
+    archive = ZipStream(entries)
+    # Загрузка прервалась в середине файла и продолжена с Range
+    cut = archive.size // 2
+    data = _read(archive, 0, cut - 1) + _read(ZipStream(entries), cut)
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        assert zf.read("Опора 12/снимок.jpg") == contents["Опора 12/снимок.jpg"]
+
+
+def test_file_changed_after_layout_is_an_error(tmp_path):
+    entries, _ = _entries(tmp_path)
+    entries[0].path.write_bytes(b"short")
+    with pytest.raises(OSError):
+        _read(ZipStream(entries))
+
+
+def test_zip64_for_many_entries():
+    entries = [ZipEntry.from_bytes(f"{i}.txt", b"", _MODIFIED) for i in range(70_000)]
+    entries.append(ZipEntry.from_bytes("last.txt", b"last", _MODIFIED))
+    archive = ZipStream(entries)
+    with zipfile.ZipFile(_RangeReader(archive)) as zf:
+        assert len(zf.infolist()) == 70_001
+        assert zf.read("last.txt") == b"last"
+
+
+def test_zip64_for_large_entry(tmp_path):
+    # Разреженный файл больше 4 ГБ: zipfile читает только заголовки и нужные куски
+    big = tmp_path / "big.bin"
+    with open(big, "wb") as f:
+        f.truncate(5 * 1024 ** 3)
+    archive = ZipStream([
+        ZipEntry("big.jpg", 5 * 1024 ** 3, 0, _MODIFIED, path=big),
+        ZipEntry.from_bytes("after.txt", b"after the big one", _MODIFIED),
+    ])
+    with zipfile.ZipFile(_RangeReader(archive)) as zf:
+        big_info, after_info = zf.infolist()
+        assert big_info.file_size == 5 * 1024 ** 3
+        assert after_info.header_offset > 0xFFFFFFFF
+        with zf.open("big.jpg") as f:
+            assert f.read(1024) == bytes(1024)
+        assert zf.read("after.txt") == b"after the big one"
+
+
+@pytest.mark.parametrize(
+    ("header", "expected"),
+    [
+        ("bytes=0-9", (0, 9)),
+        ("bytes=90-", (90, 99)),
+        ("bytes=-10", (90, 99)),
+        ("bytes=-500", (0, 99)),
+        ("bytes=50-500", (50, 99)),
+        ("bytes=0-1,5-6", None),
+        ("items=0-1", None),
+        ("bytes=a-b", None),
+    ],
+)
+def test_parse_byte_range(header, expected):
+    assert _parse_byte_range(header, 100) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=100-200", "bytes=20-10"])
+def test_unsatisfiable_range(header):
+    with pytest.raises(HTTPException) as error:
+        _parse_byte_range(header, 100)
+    assert error.value.status_code == 416
+    assert error.value.headers["Content-Range"] == "bytes */100"
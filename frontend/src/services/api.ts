@@ -22,6 +22,23 @@ export interface UploadFilesResponse {
   processed_files: ProcessedFile[];
 }
 
+export interface UploadFileEvent extends ProcessedFile {
+  index: number;
+  total: number;
+}
+
+export interface UploadSummaryEvent {
+  message: string;
+  total: number;
+  uploaded: number;
+  processed: number;
+  errors: number;
+  red_detection_count: number;
+  green_detection_count: number;
+  total_detections: number;
+  elapsed_seconds: number;
+}
+
 class ApiService {
   private getToken(): string | null {
     return storage.getToken();
@@ -166,6 +183,67 @@ class ApiService {
     return this.requestWithFormData<UploadFilesResponse>(`/routes/${routeId}/files`, formData);
   }
 
+  // Потоковая загрузка: onFile вызывается по мере обработки каждого файла на сервере
+  async uploadFilesStream(
+    routeId: string,
+    files: File[],
+    onFile: (event: UploadFileEvent) => void
+  ): Promise<UploadSummaryEvent> {
+    const formData = new FormData();
+    files.forEach((file) => {
+      formData.append('files', file);
+    });
+
+    const token = this.getToken();
+    const headers: Record<string, string> = {};
+    if (token) {
+      headers['Authorization'] = `Bearer ${token}`;
+    }
+
+    const response = await fetch(`${API_BASE_URL}/routes/${routeId}/files/stream`, {
+      method: 'POST',
+      headers,
+      body: formData,
+    });
+
+    if (!response.ok || !response.body) {
+      const error = await response.json().catch(() => ({ detail: 'Неизвестная ошибка' }));
+      throw new Error(error.detail || `Ошибка HTTP! Статус: ${response.status}`);
+    }
+
+    const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+    let buffer = '';
+    let summary: UploadSummaryEvent | null = null;
+
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += value;
+
+      // События Server-Sent Events разделены пустой строкой
+      let boundary = buffer.indexOf('\n\n');
+      while (boundary !== -1) {
+        const chunk = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+        boundary = buffer.indexOf('\n\n');
+
+        let event = 'message';
+        let data = '';
+        for (const line of chunk.split('\n')) {
+          if (line.startsWith('event: ')) event = line.slice(7);
+          else if (line.startsWith('data: ')) data += line.slice(6);
+        }
+        if (event === 'file') onFile(JSON.parse(data));
+        else if (event === 'summary') summary = JSON.parse(data);
+      }
+    }
+
+    if (!summary) {
+      throw new Error('Загрузка прервана до завершения обработки');
+    }
+    return summary;
+  }
+
   async uploadSingleFile(routeId: string, file: File): Promise<UploadFilesResponse> {
     const formData = new FormData();
     formData.append('files', file);
@@ -14,6 +14,9 @@ export interface Route {
   description?: string | null;
   user_id: string;
   files?: string[];
+  file_count?: number;
+  defect_count?: number;
+  last_upload_at?: string | null;
   fileCount?: number;
 }
 
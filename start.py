@@ -1,3 +1,4 @@
+import argparse
 import subprocess
 import sys
 import time
@@ -13,20 +14,54 @@ def run_process(cmd: list[str], cwd: Path | None = None, shell: bool = False) ->
     return subprocess.Popen(cmd, cwd=cwd, shell=shell)
 
 
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Запуск RBX")
+    parser.add_argument(
+        "--prod",
+        action="store_true",
+        help="Продакшн-режим: несколько воркеров без --reload, модель загружается до fork",
+    )
+    parser.add_argument("--workers", type=int, default=None, help="Количество воркеров в продакшн-режиме")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    return parser.parse_args()
+
+
 def main() -> None:
-    backend_cmd = [
-        sys.executable,
-        "-m",
-        "uvicorn",
-        "app.main:app",
-        "--reload",
-    ]
+    args = parse_args()
+
+    if args.prod:
+        backend_cmd = [
+            sys.executable,
+            "-m",
+            "app.server",
+            "--host",
+            args.host,
+            "--port",
+            str(args.port),
+        ]
+        if args.workers:
+            backend_cmd += ["--workers", str(args.workers)]
+    else:
+        backend_cmd = [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "app.main:app",
+            "--reload",
+        ]
     
     frontend_cmd = ["npm", "run", "dev"]
 
     processes: list[subprocess.Popen] = []
     try:
         processes.append(run_process(backend_cmd, cwd=BACKEND_DIR))
+        if args.prod:
+            # Фронтенд в продакшне собирается и раздается отдельно
+            while all(p.poll() is None for p in processes):
+                time.sleep(1)
+            return
+
         time.sleep(2)
         
         is_windows = sys.platform == "win32"